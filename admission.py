@@ -0,0 +1,359 @@
+import math
+import threading
+import time
+import uuid
+from collections import defaultdict, namedtuple
+from functools import wraps
+from flask import current_app, request, session
+
+# ----------------------
+# Admission Control
+# ----------------------
+# Expensive routes (imports, exports, PDF reports, batch writes) belong to
+# pools, and each pool is admitted against its own limits before the view
+# runs:
+#
+#   rate, burst    a token bucket per user: `rate` requests a minute, with
+#                  bursts of up to `burst`. An empty bucket is a 429.
+#   per_user       requests one user may have running in the pool at once.
+#                  One more is a 429.
+#   concurrency    requests running in the pool across all users. Beyond it
+#                  up to `queue` requests wait up to `queue_timeout` seconds
+#                  for a slot; a full queue or a timeout is a 503.
+#
+# A rejection raises Rejected (the app turns it into the response, with a
+# Retry-After header) without waiting beyond the bounded queue, so
+# one user's uploads or reports can't occupy every worker and leave none
+# for /dashboard and /login. A streamed response keeps its slot until it is
+# closed, so a CSV export counts until its last byte is sent.
+#
+# The default backend keeps the counts in the worker process, which limits
+# threaded workers; ADMISSION_URL=redis://... shares them between workers.
+# /admission/stats (behind STATS_TOKEN) shows the limits next to the live
+# numbers.
+
+PoolLimits = namedtuple('PoolLimits', ['concurrency', 'per_user', 'queue', 'queue_timeout', 'rate', 'burst'])
+
+DEFAULT_LIMITS = {
+    'import': PoolLimits(concurrency=2, per_user=1, queue=4, queue_timeout=10, rate=6, burst=3),
+    'export': PoolLimits(concurrency=4, per_user=2, queue=8, queue_timeout=10, rate=30, burst=10),
+    'report': PoolLimits(concurrency=2, per_user=1, queue=4, queue_timeout=15, rate=6, burst=3),
+    'batch': PoolLimits(concurrency=4, per_user=2, queue=8, queue_timeout=5, rate=60, burst=20),
+}
+LEASE_SECONDS = 600  # shared backend: slots of a worker that died are freed after this
+POLL_INTERVAL = 0.05  # shared backend: how often a queued request retries
+SERVICE_SMOOTHING = 0.2  # weight of the latest request in the average service time
+
+OUTCOMES = ('admitted', 'queued', 'rate', 'user', 'queue_full', 'timeout')
+
+
+class Rejected(Exception):
+    def __init__(self, status, reason, message, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))  # whole seconds, for the Retry-After header
+
+
+class LocalBackend:
+    """Slots, queues and token buckets in this process. One per gunicorn worker."""
+
+    def __init__(self):
+        self.slots = defaultdict(set)  # key -> tokens of running requests
+        self.buckets = {}  # key -> (tokens, updated_at)
+        self.waiting = defaultdict(int)
+        self._changed = threading.Condition(threading.RLock())
+
+    def take(self, key, rate, burst):
+        """Take a token; returns 0, or the seconds until one is available."""
+        now = time.monotonic()
+        per_second = rate / 60.0
+        with self._changed:
+            tokens, updated_at = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * per_second)
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                return 0
+            self.buckets[key] = (tokens, now)
+            return (1 - tokens) / per_second
+
+    def acquire(self, key, limit):
+        with self._changed:
+            if len(self.slots[key]) >= limit:
+                return None
+            token = uuid.uuid4().hex
+            self.slots[key].add(token)
+            return token
+
+    def release(self, key, token):
+        with self._changed:
+            self.slots[key].discard(token)
+            if not self.slots[key]:
+                del self.slots[key]
+            self._changed.notify_all()
+
+    def running(self, key):
+        return len(self.slots.get(key, ()))
+
+    def join_queue(self, key, size):
+        with self._changed:
+            if self.waiting[key] >= size:
+                return False
+            self.waiting[key] += 1
+            return True
+
+    def leave_queue(self, key):
+        with self._changed:
+            self.waiting[key] -= 1
+
+    def queued(self, key):
+        return self.waiting.get(key, 0)
+
+    def acquire_before(self, key, limit, deadline):
+        """acquire(), waiting for a release until `deadline` (time.monotonic())."""
+        with self._changed:
+            while len(self.slots[key]) >= limit:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._changed.wait(remaining)
+            return self.acquire(key, limit)
+
+    def users_running(self, pool):
+        prefix = f'{pool}:user:'
+        return sum(1 for key, tokens in list(self.slots.items()) if key.startswith(prefix) and tokens)
+
+
+ACQUIRE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[4])
+    redis.call('EXPIRE', KEYS[1], ARGV[5])
+    return 1
+end
+return 0
+"""
+
+TAKE_SCRIPT = """
+local now, per_second, burst = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = tonumber(state[1]) or burst
+local at = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - at) * per_second)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / per_second end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'at', ARGV[1])
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / per_second) + 1)
+return tostring(wait)
+"""
+
+
+class RedisBackend:
+    """Shared backend so the limits hold across every gunicorn worker."""
+
+    def __init__(self, url, prefix='fintrack:admission:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("ADMISSION_URL points at Redis but the 'redis' package is not installed")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._acquire = self.client.register_script(ACQUIRE_SCRIPT)
+        self._take = self.client.register_script(TAKE_SCRIPT)
+
+    def take(self, key, rate, burst):
+        return float(self._take(keys=[self.prefix + 'bucket:' + key], args=[time.time(), rate / 60.0, burst]))
+
+    def acquire(self, key, limit):
+        # Slots are leased rather than held, so a worker that dies mid-request
+        # can't keep them forever
+        now = time.time()
+        token = uuid.uuid4().hex
+        if self._acquire(keys=[self.prefix + 'slots:' + key],
+                         args=[now, limit, now + LEASE_SECONDS, token, LEASE_SECONDS + 1]):
+            return token
+        return None
+
+    def release(self, key, token):
+        self.client.zrem(self.prefix + 'slots:' + key, token)
+
+    def running(self, key):
+        name = self.prefix + 'slots:' + key
+        self.client.zremrangebyscore(name, '-inf', time.time())
+        return self.client.zcard(name)
+
+    def join_queue(self, key, size):
+        name = self.prefix + 'queue:' + key
+        if self.client.incr(name) > size:
+            self.client.decr(name)
+            return False
+        # Lets the count reset once the pool goes quiet, in case a waiter died
+        self.client.expire(name, LEASE_SECONDS)
+        return True
+
+    def leave_queue(self, key):
+        self.client.decr(self.prefix + 'queue:' + key)
+
+    def queued(self, key):
+        return max(0, int(self.client.get(self.prefix + 'queue:' + key) or 0))
+
+    def acquire_before(self, key, limit, deadline):
+        while True:
+            token = self.acquire(key, limit)
+            remaining = deadline - time.monotonic()
+            if token is not None or remaining <= 0:
+                return token
+            time.sleep(min(remaining, POLL_INTERVAL))
+
+    def users_running(self, pool):
+        return None
+
+
+class AdmissionControl:
+    def __init__(self, app=None):
+        self.backend = None
+        self.enabled = False
+        self.limits = {}
+        self.outcomes = defaultdict(int)  # (pool, outcome) -> requests
+        self.wait_seconds = defaultdict(float)  # pool -> total time spent queued
+        self.service_seconds = {}  # pool -> moving average of time slots are held
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ADMISSION_ENABLED', True)
+        app.config.setdefault('ADMISSION_URL', None)
+        app.config.setdefault('ADMISSION_LIMITS', {})
+        self.enabled = app.config['ADMISSION_ENABLED']
+        self.limits = dict(DEFAULT_LIMITS)
+        # Overrides change some limits of a known pool or give all of a new one's
+        for pool, overrides in app.config['ADMISSION_LIMITS'].items():
+            self.limits[pool] = self.limits[pool]._replace(**overrides) if pool in self.limits else PoolLimits(**overrides)
+        url = app.config['ADMISSION_URL']
+        if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+            self.backend = RedisBackend(url)
+        else:
+            self.backend = LocalBackend()
+        app.extensions['admission'] = self
+
+    def _count(self, pool, outcome):
+        with self._lock:
+            self.outcomes[(pool, outcome)] += 1
+
+    def _service_estimate(self, pool):
+        return self.service_seconds.get(pool, 1.0)
+
+    # ----------------------
+    # Admit / Release
+    # ----------------------
+    def admit(self, pool, client):
+        """
+        Admit one request from `client` (a user id or address) to `pool`, or
+        raise Rejected. Returns the callable that gives the slots back.
+        """
+        limits = self.limits[pool]
+        backend = self.backend
+        user_key = f'{pool}:user:{client}'
+
+        if limits.rate:
+            wait = backend.take(user_key, limits.rate, limits.burst or 1)
+            if wait:
+                self._count(pool, 'rate')
+                raise Rejected(429, 'rate', 'Too many requests; please slow down.', wait)
+
+        user_token = backend.acquire(user_key, limits.per_user)
+        if user_token is None:
+            self._count(pool, 'user')
+            raise Rejected(429, 'user', 'You already have a request like this running.',
+                           self._service_estimate(pool))
+
+        token = backend.acquire(pool, limits.concurrency)
+        queued = token is None
+        if queued:
+            try:
+                token = self._wait_for_slot(pool, limits)
+            except BaseException:
+                backend.release(user_key, user_token)
+                raise
+        self._count(pool, 'queued' if queued else 'admitted')
+
+        started = time.monotonic()
+        released = []
+
+        def release():
+            if released:
+                return
+            released.append(True)
+            backend.release(pool, token)
+            backend.release(user_key, user_token)
+            elapsed = time.monotonic() - started
+            with self._lock:
+                previous = self.service_seconds.get(pool)
+                self.service_seconds[pool] = elapsed if previous is None else (
+                    previous + SERVICE_SMOOTHING * (elapsed - previous))
+        return release
+
+    def _wait_for_slot(self, pool, limits):
+        """Queue for one of the pool's slots; returns its token or raises Rejected (503)."""
+        backend = self.backend
+        busy = 'The server is busy; please try again shortly.'
+        # Roughly when the requests ahead will have finished
+        retry_after = self._service_estimate(pool) * (backend.queued(pool) + 1) / max(1, limits.concurrency)
+        if not limits.queue or not backend.join_queue(pool, limits.queue):
+            self._count(pool, 'queue_full')
+            raise Rejected(503, 'queue_full', busy, retry_after)
+        started = time.monotonic()
+        try:
+            token = backend.acquire_before(pool, limits.concurrency, started + limits.queue_timeout)
+        finally:
+            backend.leave_queue(pool)
+            with self._lock:
+                self.wait_seconds[pool] += time.monotonic() - started
+        if token is None:
+            self._count(pool, 'timeout')
+            raise Rejected(503, 'timeout', busy, retry_after)
+        return token
+
+    def limit(self, pool):
+        """Decorator admitting the view's requests to `pool` (see the module comment)."""
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                if not self.enabled:
+                    return f(*args, **kwargs)
+                release = self.admit(pool, session.get('user_id') or request.remote_addr)
+                try:
+                    response = current_app.make_response(f(*args, **kwargs))
+                except BaseException:
+                    release()
+                    raise
+                if response.is_streamed and not response.direct_passthrough:
+                    # A generator body does its work while it is sent
+                    response.call_on_close(release)
+                else:
+                    # Built in memory, or a send_file() of a finished file
+                    # (werkzeug skips close callbacks for those anyway)
+                    release()
+                return response
+            return decorated_function
+        return decorator
+
+    def stats(self):
+        pools = {}
+        for pool, limits in self.limits.items():
+            queued = self.outcomes[(pool, 'queued')]
+            service = self.service_seconds.get(pool)
+            pools[pool] = {
+                'limits': limits._asdict(),
+                'running': self.backend.running(pool),
+                'waiting': self.backend.queued(pool),
+                'users_running': self.backend.users_running(pool),
+                'outcomes': {outcome: self.outcomes[(pool, outcome)] for outcome in OUTCOMES},
+                'avg_wait_ms': round(self.wait_seconds[pool] * 1000 / queued, 1) if queued else None,
+                'avg_service_ms': round(service * 1000, 1) if service is not None else None,
+            }
+        return {'backend': type(self.backend).__name__, 'enabled': self.enabled, 'pools': pools}
+
+
+admission = AdmissionControl()
@@ -0,0 +1,150 @@
+from datetime import date, timedelta
+from sqlalchemy import case, func, select
+from models import db, MonthlyRollup
+from queries import month_key
+import categories
+import partitions
+
+# ----------------------
+# Spending Time Series
+# ----------------------
+# Daily, weekly or monthly spend per category over a date range. Bucketing,
+# running totals and period-over-period changes are all done in SQL (GROUP
+# BY plus window functions), so the work in Python is proportional to the
+# number of points returned, not the number of expenses. Whole-month
+# ranges are read from monthly_rollups instead of raw expenses.
+
+INTERVALS = ('day', 'week', 'month')
+# Day/week series need a bounded range; these are the default and the
+# largest spans (in days) accepted
+DEFAULT_SPAN = {'day': 31, 'week': 26 * 7}
+MAX_SPAN = {'day': 366, 'week': 5 * 366}
+
+
+def period_key(column, interval):
+    """SQL expression labelling a DATE column with its bucket ('YYYY-MM-DD' or 'YYYY-MM')."""
+    if interval == 'month':
+        return month_key(column)
+    postgres = db.session.get_bind().dialect.name == 'postgresql'
+    if interval == 'week':
+        # Weeks start on Monday and are labelled by that day
+        if postgres:
+            return func.to_char(func.date_trunc('week', column), 'YYYY-MM-DD')
+        return func.date(column, '-6 days', 'weekday 1')
+    if postgres:
+        return func.to_char(column, 'YYYY-MM-DD')
+    return func.strftime('%Y-%m-%d', column)
+
+
+def resolve_range(interval, start=None, end=None):
+    """Fill in default bounds for day/week series; raises ValueError for ranges that are too long."""
+    if interval not in INTERVALS:
+        raise ValueError(f"interval must be one of: {', '.join(INTERVALS)}")
+    if interval == 'month':
+        return start, end
+    if end is None:
+        end = date.today() + timedelta(days=1)
+    if start is None:
+        start = end - timedelta(days=DEFAULT_SPAN[interval])
+    if (end - start).days > MAX_SPAN[interval]:
+        raise ValueError(f'A {interval} series can cover at most {MAX_SPAN[interval]} days')
+    return start, end
+
+
+def _whole_months(start, end):
+    return all(bound is None or bound.day == 1 for bound in (start, end))
+
+
+def _grouped(user_id, interval, start, end):
+    """(bucket, category, total, count) for every non-empty bucket and category id (0 for none)."""
+    if interval == 'month' and _whole_months(start, end):
+        stmt = select(
+            MonthlyRollup.month.label('bucket'),
+            MonthlyRollup.category_id.label('category'),
+            MonthlyRollup.total.label('total'),
+            MonthlyRollup.count.label('count'),
+        ).where(MonthlyRollup.user_id == user_id)
+        if start is not None:
+            stmt = stmt.where(MonthlyRollup.month >= start.strftime('%Y-%m'))
+        if end is not None:
+            stmt = stmt.where(MonthlyRollup.month < end.strftime('%Y-%m'))
+        return stmt
+
+    expenses = partitions.expense_table(user_id, start, end)
+    bucket = period_key(expenses.c.date, interval)
+    category = func.coalesce(expenses.c.category_id, 0)
+    stmt = select(
+        bucket.label('bucket'),
+        category.label('category'),
+        func.coalesce(func.sum(expenses.c.amount), 0.0).label('total'),
+        func.count(expenses.c.id).label('count'),
+    ).where(expenses.c.user_id == user_id, expenses.c.date.isnot(None))
+    if start is not None:
+        stmt = stmt.where(expenses.c.date >= start)
+    if end is not None:
+        stmt = stmt.where(expenses.c.date < end)
+    return stmt.group_by(bucket, category)
+
+
+def _windowed(grouped, by_category):
+    """Add running total and change against the previous non-empty bucket."""
+    partition = [grouped.c.category] if by_category else None
+    previous = func.lag(grouped.c.total).over(partition_by=partition, order_by=grouped.c.bucket)
+    columns = [grouped.c.bucket, grouped.c.total, grouped.c.count]
+    if by_category:
+        columns.append(grouped.c.category)
+    return select(
+        *columns,
+        func.sum(grouped.c.total).over(partition_by=partition, order_by=grouped.c.bucket,
+                                       rows=(None, 0)).label('running_total'),
+        func.lag(grouped.c.bucket).over(partition_by=partition, order_by=grouped.c.bucket).label('previous_bucket'),
+        (grouped.c.total - previous).label('change'),
+        case((previous != 0, (grouped.c.total - previous) * 100.0 / previous), else_=None).label('change_pct'),
+    ).order_by(*([grouped.c.category] if by_category else []), grouped.c.bucket)
+
+
+def _round(value):
+    return None if value is None else round(float(value), 2)
+
+
+def _point(row):
+    return {
+        'bucket': row.bucket,
+        'total': _round(row.total),
+        'count': int(row.count),
+        'running_total': _round(row.running_total),
+        'previous_bucket': row.previous_bucket,
+        'change': _round(row.change),
+        'change_pct': _round(row.change_pct),
+    }
+
+
+def spending_series(user_id, interval='month', start=None, end=None):
+    """
+    Per-category and overall spend per bucket over [start, end). Buckets
+    with no spending are omitted; `previous_bucket` says which bucket each
+    change is measured against.
+    """
+    grouped = _grouped(user_id, interval, start, end).subquery()
+    by_bucket = select(
+        grouped.c.bucket,
+        func.sum(grouped.c.total).label('total'),
+        func.sum(grouped.c.count).label('count'),
+    ).group_by(grouped.c.bucket).subquery()
+
+    names = categories.category_names(user_id)
+    series = {}
+    for row in db.session.execute(_windowed(grouped, by_category=True)):
+        series.setdefault(names.get(row.category, ''), []).append(_point(row))
+    totals = [_point(row) for row in db.session.execute(_windowed(by_bucket, by_category=False))]
+
+    ranked = sorted(series.items(), key=lambda item: -item[1][-1]['running_total'])
+    return {
+        'interval': interval,
+        'start': start.isoformat() if start else None,
+        'end': end.isoformat() if end else None,
+        'buckets': [point['bucket'] for point in totals],
+        'series': [{'category': category, 'total': points[-1]['running_total'], 'points': points}
+                   for category, points in ranked],
+        'totals': totals,
+    }
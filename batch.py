@@ -0,0 +1,378 @@
+import math
+from datetime import date
+from sqlalchemy import bindparam, insert, select
+from models import db, Expense, parse_date
+from importer import expense_hashes
+import categories
+import partitions
+import rollups
+import sync
+
+# ----------------------
+# Batch Expense API
+# ----------------------
+# Applies a batch of create / update / recategorize / delete operations in
+# the caller's transaction. Each operation type runs as one set-based
+# statement (an executemany or an IN list), the rollup table gets a single
+# merged delta, and every item gets its own result. Invalid items are
+# reported and skipped; the caller decides whether that aborts the batch.
+#
+#   {"create":       [{"title": ..., "category": ..., "amount": ..., "date": ..., "ref": ...}],
+#    "update":       [{"id": 12, "amount": 40.5}],
+#    "recategorize": [{"ids": [12, 13], "category": "Travel"}],
+#    "delete":       [14, 15]}
+
+OPERATIONS = ('create', 'update', 'recategorize', 'delete')
+TEXT_LIMIT = 100  # title/category column width
+IN_CHUNK = 900  # ids per IN list; stays under SQLite's bound-parameter limit
+
+
+class BatchError(ValueError):
+    """The request as a whole can't be processed (bad shape, too many operations)."""
+
+
+class BatchResult:
+    def __init__(self):
+        self.results = {op: [] for op in OPERATIONS}
+        self.counts = {'created': 0, 'updated': 0, 'recategorized': 0, 'deleted': 0, 'errors': 0}
+        self.months = set()  # 'YYYY-MM' months touched, for cache invalidation
+        self.deltas = []
+
+    def add(self, op, entry, counter=None, n=1):
+        self.results[op].append(entry)
+        if counter:
+            self.counts[counter] += n
+
+    def error(self, op, entry, messages):
+        entry.update({'status': 'error', 'errors': messages})
+        self.results[op].append(entry)
+        self.counts['errors'] += 1
+
+    def track(self, rows, sign):
+        """Record (date, category_id, amount) rows added (+1) or removed (-1)."""
+        rows = list(rows)
+        self.deltas.append(rollups.expense_deltas(rows, sign))
+        self.months.update(day.strftime('%Y-%m') for day, _, _ in rows if day)
+
+    def to_dict(self):
+        results = {op: sorted(entries, key=lambda e: e['index']) for op, entries in self.results.items()}
+        return {'summary': self.counts, **results}
+
+
+# ----------------------
+# Validation
+# ----------------------
+def _text(value, field, errors):
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        errors.append(f'{field} must be a string')
+        return None
+    return value.strip()[:TEXT_LIMIT]
+
+
+def _amount(value, field, errors):
+    if value is None or value == '':
+        return 0.0
+    try:
+        if isinstance(value, bool):
+            raise ValueError
+        amount = float(value)
+        if not math.isfinite(amount):
+            raise ValueError
+        return amount
+    except (TypeError, ValueError):
+        errors.append(f'Invalid amount "{value}"')
+        return None
+
+
+def _date(value, field, errors):
+    if value is None or value == '':
+        return date.today()
+    parsed = parse_date(value) if isinstance(value, str) else None
+    if parsed is None:
+        errors.append(f'Invalid date "{value}"')
+    return parsed
+
+
+FIELDS = {'title': _text, 'category': _text, 'amount': _amount, 'date': _date}
+# Expense columns written by create/update; 'category' is stored as its id
+COLUMNS = ('title', 'category_id', 'amount', 'date')
+
+
+def coerce_fields(item, partial=False):
+    """Validate an expense payload; with `partial`, only the fields present."""
+    values, errors = {}, []
+    for field, coerce in FIELDS.items():
+        if partial and field not in item:
+            continue
+        values[field] = coerce(item.get(field), field, errors)
+    return values, errors
+
+
+def _expense_id(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return None
+
+
+def _group_ids(group):
+    ids = group.get('ids') if isinstance(group, dict) else None
+    if not isinstance(ids, list):
+        return None
+    ids = [_expense_id(value) for value in ids]
+    return None if None in ids else ids
+
+
+def _with_category_ids(user_id, rows):
+    """Swap each row's category name for its id, resolving all names in one go."""
+    ids = categories.resolve(user_id, {row['category'] for row in rows})
+    for row in rows:
+        row['category_id'] = ids[row.pop('category')]
+    return rows
+
+
+def _rehash(user_id, rows):
+    """
+    Content hashes for edited (id, title, category, amount, date) rows. Their
+    old hashes are cleared first, so a row whose content is unchanged can
+    take its own back.
+    """
+    table = Expense.__table__
+    for chunk in _chunks([row[0] for row in rows]):
+        db.session.execute(table.update().where(table.c.user_id == user_id, table.c.id.in_(chunk))
+                           .values(content_hash=None))
+    return expense_hashes(user_id, [row[1:] for row in rows])
+
+
+def _chunks(values, size=IN_CHUNK):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _load(user_id, ids):
+    """
+    Current (id -> row) for the user's expenses among `ids`, one SELECT per
+    IN chunk. Archived ones are moved back into expenses first.
+    """
+    partitions.restore(user_id, ids)
+    table = Expense.__table__
+    rows = {}
+    for chunk in _chunks(ids):
+        stmt = select(table.c.id, table.c.title, table.c.category_id, table.c.amount, table.c.date).where(
+            table.c.user_id == user_id, table.c.id.in_(chunk))
+        rows.update((row.id, row) for row in db.session.execute(stmt))
+    return rows
+
+
+# ----------------------
+# Operations
+# ----------------------
+def _create(user_id, items, result):
+    table = Expense.__table__
+    pending = []  # (result entry, row)
+    for index, item in enumerate(items):
+        entry = {'index': index}
+        if isinstance(item, dict) and 'ref' in item:
+            entry['ref'] = item['ref']
+        if not isinstance(item, dict):
+            result.error('create', entry, ['Expected an object'])
+            continue
+        values, errors = coerce_fields(item)
+        if errors:
+            result.error('create', entry, errors)
+            continue
+        pending.append((entry, dict(values, user_id=user_id)))
+    if not pending:
+        return
+
+    hashes = expense_hashes(user_id, [(row['title'], row['category'], row['amount'], row['date'])
+                                      for _, row in pending])
+    rows = _with_category_ids(user_id, [row for _, row in pending])
+    version = sync.bump(user_id)
+    for row, content_hash in zip(rows, hashes):
+        row['version'] = version
+        row['content_hash'] = content_hash
+    dialect = db.session.get_bind().dialect
+    if dialect.insert_executemany_returning_sort_by_parameter_order:
+        # Ids come back in the order of `rows`, so each maps to its entry
+        # (SQLAlchemy sends one INSERT per row on SQLite to guarantee that)
+        stmt = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+        ids = db.session.execute(stmt, rows).scalars().all()
+    else:
+        ids = [db.session.execute(insert(table), row).inserted_primary_key[0] for row in rows]
+
+    for (entry, _), new_id in zip(pending, ids):
+        entry.update({'status': 'created', 'id': new_id})
+        result.add('create', entry, 'created')
+    result.track(((row['date'], row['category_id'], row['amount']) for row in rows), 1)
+
+
+def _update(user_id, items, existing, result):
+    table = Expense.__table__
+    changes = []  # (expense id, merged fields)
+    for index, (expense_id, item) in enumerate(items):
+        entry = {'index': index, 'id': expense_id}
+        if expense_id is None:
+            result.error('update', entry, ['Missing or invalid id'])
+            continue
+        current = existing.get(expense_id)
+        if current is None:
+            result.error('update', entry, ['Expense not found'])
+            continue
+        values, errors = coerce_fields(item, partial=True)
+        if errors:
+            result.error('update', entry, errors)
+            continue
+        merged = {field: values[field] for field in FIELDS if field in values}
+        changes.append((expense_id, merged))
+        entry['status'] = 'updated'
+        result.add('update', entry, 'updated')
+    if not changes:
+        return
+
+    ids = categories.resolve(user_id, {merged['category'] for _, merged in changes if 'category' in merged})
+    names = categories.category_names(user_id)
+    version = sync.bump(user_id)
+    params, before, after, contents = [], [], [], []
+    for expense_id, merged in changes:
+        current = existing[expense_id]
+        row = {column: getattr(current, column) for column in COLUMNS}
+        row.update((field, value) for field, value in merged.items() if field != 'category')
+        if 'category' in merged:
+            row['category_id'] = ids[merged['category']]
+        params.append({'b_id': expense_id, **{f'b_{column}': row[column] for column in COLUMNS}})
+        before.append((current.date, current.category_id, current.amount))
+        after.append((row['date'], row['category_id'], row['amount']))
+        contents.append((expense_id, row['title'], names.get(row['category_id'] or 0, ''), row['amount'], row['date']))
+    for param, content_hash in zip(params, _rehash(user_id, contents)):
+        param['b_content_hash'] = content_hash
+
+    # One executemany UPDATE; every row sets all four columns so the
+    # statement shape is the same for partial and full updates
+    stmt = (table.update()
+            .where(table.c.id == bindparam('b_id'), table.c.user_id == user_id)
+            .values({column: bindparam(f'b_{column}') for column in COLUMNS})
+            .values(content_hash=bindparam('b_content_hash'), version=version))
+    db.session.execute(stmt, params)
+    result.track(before, -1)
+    result.track(after, 1)
+
+
+def _recategorize(user_id, groups, existing, result):
+    table = Expense.__table__
+    moves = []  # (category name, found ids)
+    for index, (ids, group) in enumerate(groups):
+        entry = {'index': index}
+        errors = []
+        category = _text(group.get('category'), 'category', errors)
+        if ids is None:
+            errors.append('ids must be a list of expense ids')
+        if errors:
+            result.error('recategorize', entry, errors)
+            continue
+        found = [expense_id for expense_id in ids if expense_id in existing]
+        moves.append((category, found))
+        entry.update({'status': 'recategorized', 'category': category, 'updated': len(found),
+                      'not_found': [expense_id for expense_id in ids if expense_id not in existing]})
+        result.add('recategorize', entry, 'recategorized', len(found))
+    if not any(found for _, found in moves):
+        return
+
+    category_ids = categories.resolve(user_id, {category for category, found in moves if found})
+    version = sync.bump(user_id)
+    params, before, after, contents = [], [], [], []
+    for category, found in moves:
+        for expense_id in found:
+            current = existing[expense_id]
+            params.append({'b_id': expense_id, 'b_category_id': category_ids[category]})
+            before.append((current.date, current.category_id, current.amount))
+            after.append((current.date, category_ids[category], current.amount))
+            contents.append((expense_id, current.title, category, current.amount, current.date))
+    for param, content_hash in zip(params, _rehash(user_id, contents)):
+        param['b_content_hash'] = content_hash
+
+    stmt = (table.update()
+            .where(table.c.id == bindparam('b_id'), table.c.user_id == user_id)
+            .values(category_id=bindparam('b_category_id'), content_hash=bindparam('b_content_hash'),
+                    version=version))
+    db.session.execute(stmt, params)
+    result.track(before, -1)
+    result.track(after, 1)
+
+
+def _delete(user_id, ids, existing, result):
+    table = Expense.__table__
+    found = []
+    for index, expense_id in enumerate(ids):
+        entry = {'index': index, 'id': expense_id}
+        if expense_id is None:
+            result.error('delete', entry, ['Missing or invalid id'])
+        elif expense_id not in existing:
+            result.error('delete', entry, ['Expense not found'])
+        else:
+            found.append(expense_id)
+            entry['status'] = 'deleted'
+            result.add('delete', entry, 'deleted')
+    if not found:
+        return
+
+    for chunk in _chunks(found):
+        db.session.execute(table.delete().where(table.c.user_id == user_id, table.c.id.in_(chunk)))
+    sync.record_deletes(user_id, found)
+    result.track(((existing[i].date, existing[i].category_id, existing[i].amount) for i in found), -1)
+
+
+# ----------------------
+# Entry Point
+# ----------------------
+def _list(payload, op):
+    items = payload.get(op) or []
+    if not isinstance(items, list):
+        raise BatchError(f'"{op}" must be a list')
+    return items
+
+
+def apply_batch(user_id, payload, max_operations=None):
+    """
+    Validate and apply one batch for `user_id`. Does not commit; the caller
+    owns the transaction. Returns a BatchResult.
+    """
+    if not isinstance(payload, dict):
+        raise BatchError('Expected a JSON object')
+    unknown = set(payload) - set(OPERATIONS) - {'atomic'}
+    if unknown:
+        raise BatchError(f"Unknown operations: {', '.join(sorted(unknown))}")
+    creates, updates, groups, deletes = (_list(payload, op) for op in OPERATIONS)
+
+    updates = [(_expense_id(item.get('id')) if isinstance(item, dict) else None,
+                item if isinstance(item, dict) else {}) for item in updates]
+    groups = [(_group_ids(group), group if isinstance(group, dict) else {}) for group in groups]
+    deletes = [_expense_id(item) for item in deletes]
+
+    total = len(creates) + len(updates) + sum(len(ids or ()) for ids, _ in groups) + len(deletes)
+    if max_operations and total > max_operations:
+        raise BatchError(f'Too many operations in one batch ({total}; the limit is {max_operations})')
+
+    # An expense may only be touched once per batch, otherwise the rollup
+    # deltas (computed from the rows as they were before the batch) would be wrong
+    referenced = [i for i, _ in updates] + [i for ids, _ in groups for i in ids or ()] + deletes
+    seen, repeated = set(), set()
+    for expense_id in referenced:
+        if expense_id is not None:
+            (repeated if expense_id in seen else seen).add(expense_id)
+    if repeated:
+        sample = ', '.join(str(i) for i in sorted(repeated)[:10])
+        raise BatchError(f'Expenses referenced more than once in the batch: {sample}')
+
+    result = BatchResult()
+    existing = _load(user_id, seen)
+    _create(user_id, creates, result)
+    _update(user_id, updates, existing, result)
+    _recategorize(user_id, groups, existing, result)
+    _delete(user_id, deletes, existing, result)
+    rollups.apply_deltas(user_id, rollups.merge_deltas(*result.deltas))
+    return result
@@ -0,0 +1,2 @@
+# Benchmark harness for the dashboard, import and export paths.
+# Run `python -m benchmarks.run --help` from the repository root.
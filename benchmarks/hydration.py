@@ -0,0 +1,118 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+from benchmarks.run import parse_size, size_label
+
+# ----------------------
+# Row Hydration Benchmark
+# ----------------------
+# Reads the newest N expenses of one seeded user two ways and reports CPU
+# time and memory per row:
+#
+#   orm   Expense.query with its joined Category, as pages, search and
+#         sync read expenses before queries.expense_rows()
+#   rows  queries.expense_rows(): Core column select into ExpenseRow
+#
+# Each read is serialised with app.expense_to_dict, as the routes do, and
+# the session is cleared after it, as at the end of a request.
+#
+#   python -m benchmarks.hydration --size 100k --limits 50,500,5000
+
+METHODS = ('orm', 'rows')
+
+
+def readers(user_id):
+    from models import Expense
+    from queries import expense_rows, expense_select
+
+    def orm(limit):
+        return (Expense.query.filter_by(user_id=user_id)
+                .order_by(Expense.date.desc(), Expense.id.desc()).limit(limit).all())
+
+    def rows(limit):
+        return expense_rows(expense_select(Expense).where(Expense.user_id == user_id)
+                            .order_by(Expense.date.desc(), Expense.id.desc()).limit(limit))
+
+    return {'orm': orm, 'rows': rows}
+
+
+def measure(read, limit, repeat):
+    from app import expense_to_dict
+    from models import db
+
+    cpu = []
+    for _ in range(repeat):
+        started = time.process_time()
+        [expense_to_dict(e) for e in read(limit)]
+        cpu.append(time.process_time() - started)
+        db.session.expunge_all()
+
+    # Memory: peak while the rows are held, and what is still allocated
+    # (rows plus identity map) once they are read
+    tracemalloc.start()
+    loaded = read(limit)
+    held, peak = tracemalloc.get_traced_memory()
+    tracked = len(db.session.identity_map)
+    tracemalloc.stop()
+    count = len(loaded)
+    del loaded
+    db.session.expunge_all()
+
+    return {
+        'rows': count,
+        'cpu_ms': round(statistics.median(cpu) * 1000, 2),
+        'cpu_us_per_row': round(statistics.median(cpu) * 1e6 / count, 2),
+        'held_bytes_per_row': round(held / count),
+        'peak_bytes_per_row': round(peak / count),
+        'tracked_objects': tracked,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='FinTrack row hydration benchmark')
+    parser.add_argument('--size', default='100k', help='Expenses of the seeded user (10k, 100k, 1m or a number)')
+    parser.add_argument('--limits', default='50,500,5000', help='Comma-separated rows per read')
+    parser.add_argument('--repeat', type=int, default=20, help='Timed reads per limit and method')
+    parser.add_argument('--out', default=None, help='Write results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if root not in sys.path:
+        sys.path.insert(0, root)
+    os.makedirs(os.path.join(root, 'instance'), exist_ok=True)
+    os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(root, 'instance', 'bench.db'))
+
+    from app import create_app
+    from models import db
+    from benchmarks.seed import seed_user, bench_username
+
+    app = create_app()
+    size = parse_size(args.size)
+    results = []
+    with app.app_context():
+        db.create_all()
+        user_id = seed_user(bench_username(size), size)
+        methods = readers(user_id)
+        for limit in [int(value) for value in args.limits.split(',') if value.strip()]:
+            for method in METHODS:
+                methods[method](limit)  # warm up statement caches
+                db.session.expunge_all()
+                result = dict(measure(methods[method], limit, args.repeat), method=method, limit=limit)
+                results.append(result)
+                print(f"{method:>4} x {limit}: {result['cpu_ms']} ms ({result['cpu_us_per_row']} us/row), "
+                      f"{result['held_bytes_per_row']} B/row held, {result['peak_bytes_per_row']} B/row peak, "
+                      f"{result['tracked_objects']} objects in the session")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'size': size_label(size), 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
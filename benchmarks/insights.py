@@ -0,0 +1,95 @@
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date
+
+from benchmarks.run import parse_size, size_label
+
+# ----------------------
+# Insights Benchmark
+# ----------------------
+# Times insights.compute_insights() for one seeded user per size, split into
+# loading (expenses and rollups) and the three computations, then a whole
+# `insights refresh` over every user in the database, optionally with a
+# process pool.
+#
+#   python -m benchmarks.insights --sizes 10k,100k,1m --workers 0,4
+
+STAGES = ('load', 'rollups', 'projection', 'anomalies', 'recurring')
+
+
+def time_user(user_id, as_of):
+    import categories
+    import insights
+
+    timings = {}
+    started = time.perf_counter()
+    history = insights.load_history(user_id, as_of)
+    timings['load'] = time.perf_counter()
+    totals = insights.monthly_totals(user_id, as_of)
+    timings['rollups'] = time.perf_counter()
+    names = categories.category_names(user_id)
+    insights.project_month(history, as_of)
+    timings['projection'] = time.perf_counter()
+    insights.find_anomalies(*totals, names)
+    timings['anomalies'] = time.perf_counter()
+    insights.find_recurring(history, as_of, names)
+    timings['recurring'] = time.perf_counter()
+
+    result, previous = {'history_rows': len(history.amounts)}, started
+    for stage in STAGES:
+        result[f'{stage}_ms'] = round((timings[stage] - previous) * 1000, 1)
+        previous = timings[stage]
+    result['total_ms'] = round((previous - started) * 1000, 1)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='FinTrack insights benchmark')
+    parser.add_argument('--sizes', default='10k,100k', help='Comma-separated row counts (10k, 100k, 1m or a number)')
+    parser.add_argument('--workers', default='0', help='Comma-separated process counts for the refresh (0: none)')
+    parser.add_argument('--out', default=None, help='Write results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if root not in sys.path:
+        sys.path.insert(0, root)
+    os.makedirs(os.path.join(root, 'instance'), exist_ok=True)
+    os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(root, 'instance', 'bench.db'))
+    os.environ.setdefault('JOB_WORKERS', '0')
+
+    from app import create_app
+    from models import db
+    import insights
+    from benchmarks.seed import seed_user, bench_username
+
+    app = create_app()
+    as_of = date.today()
+    users, refreshes = [], []
+    with app.app_context():
+        db.create_all()
+        for size in [parse_size(s) for s in args.sizes.split(',') if s.strip()]:
+            user_id = seed_user(bench_username(size), size)
+            time_user(user_id, as_of)  # warm up imports
+            result = dict(time_user(user_id, as_of), size=size_label(size), rows=size)
+            users.append(result)
+            stages = ', '.join(f"{stage} {result[stage + '_ms']}" for stage in STAGES)
+            print(f"user @ {size_label(size)}: {result['total_ms']} ms ({stages})")
+
+        for workers in [int(w) for w in args.workers.split(',') if w.strip()]:
+            started = time.perf_counter()
+            count = insights.refresh(as_of, workers=workers)
+            elapsed = time.perf_counter() - started
+            refreshes.append({'workers': workers, 'users': count, 'seconds': round(elapsed, 2)})
+            print(f"refresh with {workers} workers: {count} users in {elapsed:.2f} s")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'users': users, 'refresh': refreshes}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from benchmarks.run import parse_size, size_label, percentile
+
+# ----------------------
+# Overload Benchmark
+# ----------------------
+# Several clients request /export/pdf back to back from threads (what a
+# threaded gunicorn worker sees when one user keeps clicking "Export PDF")
+# while another client loads /dashboard every PROBE_INTERVAL seconds. It runs
+# once without and once with admission control, and reports the dashboard's
+# latency next to how many reports were rendered and turned away.
+#
+#   python -m benchmarks.overload --rows 10k --clients 8 --seconds 10
+#
+# Rejected clients retry after REJECT_PAUSE rather than Retry-After, like an
+# impatient user would.
+
+PROBE_INTERVAL = 0.05
+REJECT_PAUSE = 0.05
+
+
+def run_load(app, report_users, probe_user, clients, seconds):
+    stop = threading.Event()
+    statuses = Counter()
+    probe_ms = []
+
+    def client_for(user_id):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = user_id
+        return client
+
+    def reports(user_id):
+        client = client_for(user_id)
+        while not stop.is_set():
+            response = client.get('/export/pdf', headers={'Accept': 'application/json'})
+            response.get_data()
+            response.close()
+            statuses[response.status_code] += 1
+            if response.status_code != 200:
+                time.sleep(REJECT_PAUSE)
+
+    def probe():
+        client = client_for(probe_user)
+        while not stop.is_set():
+            started = time.perf_counter()
+            client.post('/dashboard', data={'month': 'lifetime'}).close()
+            probe_ms.append((time.perf_counter() - started) * 1000)
+            time.sleep(PROBE_INTERVAL)
+
+    threads = [threading.Thread(target=reports, args=(report_users[i % len(report_users)],))
+               for i in range(clients)]
+    threads.append(threading.Thread(target=probe))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return {
+        'dashboard_requests': len(probe_ms),
+        'dashboard_p50_ms': round(percentile(probe_ms, 50), 1),
+        'dashboard_p95_ms': round(percentile(probe_ms, 95), 1),
+        'dashboard_max_ms': round(max(probe_ms), 1),
+        'reports_rendered': statuses[200],
+        'reports_rejected': sum(count for status, count in statuses.items() if status in (429, 503)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='FinTrack overload benchmark')
+    parser.add_argument('--rows', default='10k', help='Expenses per report user (10k, 100k or a number)')
+    parser.add_argument('--clients', type=int, default=8, help='Threads requesting /export/pdf')
+    parser.add_argument('--users', type=int, default=1, help='Users the report clients are spread over')
+    parser.add_argument('--seconds', type=float, default=10, help='Duration of each run')
+    parser.add_argument('--out', default=None, help='Write results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if root not in sys.path:
+        sys.path.insert(0, root)
+    os.makedirs(os.path.join(root, 'instance'), exist_ok=True)
+    os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(root, 'instance', 'bench.db'))
+    os.environ.setdefault('JOB_WORKERS', '0')
+
+    from app import create_app
+    from models import db
+    from cache import dashboard_cache
+    from benchmarks.seed import seed_user, bench_username
+
+    rows = parse_size(args.rows)
+    results = []
+    for enabled in (False, True):
+        app = create_app({'ADMISSION_ENABLED': enabled})
+        with app.app_context():
+            db.create_all()
+            report_users = [seed_user(f'{bench_username(rows)}-overload{i}', rows) for i in range(args.users)]
+            probe_user = seed_user(bench_username(1000), 1000)
+        dashboard_cache.enabled = False
+        label = 'admission on' if enabled else 'admission off'
+        print(f"{label}: {args.clients} PDF clients @ {size_label(rows)} for {args.seconds:g} s ...", end=' ', flush=True)
+        result = run_load(app, report_users, probe_user, args.clients, args.seconds)
+        result.update({'admission': enabled, 'rows': rows, 'clients': args.clients, 'users': args.users})
+        results.append(result)
+        print(f"dashboard p50 {result['dashboard_p50_ms']} ms, p95 {result['dashboard_p95_ms']} ms; "
+              f"{result['reports_rendered']} reports, {result['reports_rejected']} rejected")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
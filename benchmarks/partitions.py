@@ -0,0 +1,154 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import time
+from datetime import date
+
+from benchmarks.run import parse_size, size_label
+
+# ----------------------
+# Partition Benchmark
+# ----------------------
+# Copies the bench database, then times the hot-path operations on one
+# seeded user before and after `partitions compact` moves everything older
+# than --keep-months into expenses_archive: current-month and older pages,
+# the current month's summary, single and bulk inserts, and a full
+# export. Also reports the size of the expenses table and its indexes.
+#
+#   python -m benchmarks.partitions --rows 1m --keep-months 12
+#
+# The copy (instance/bench-partitions.db) is overwritten on every run, so
+# the bench database itself is never compacted.
+
+SINGLE_INSERTS = 200  # one commit each, as /add_expense does
+BULK_INSERT = 5000  # rows in one executemany, as an import chunk
+
+
+def median_ms(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(timings), 3)
+
+
+def table_mb(table):
+    """Size of a SQLite table plus its indexes, from the dbstat virtual table."""
+    from sqlalchemy import text
+    from models import db
+
+    size = db.session.execute(text(
+        "SELECT sum(pgsize) FROM dbstat WHERE name = :table OR name IN "
+        "(SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table)"), {'table': table}).scalar()
+    return round((size or 0) / 1048576, 1)
+
+
+def timed_inserts(user_id, today):
+    """(ms per single insert and commit, ms for one bulk insert and commit); rows are removed again."""
+    from sqlalchemy import insert
+    from models import db, Expense
+
+    rows = [{'user_id': user_id, 'title': 'Bench insert', 'amount': 12.5, 'date': today}
+            for _ in range(max(SINGLE_INSERTS, BULK_INSERT))]
+    started = time.perf_counter()
+    for row in rows[:SINGLE_INSERTS]:
+        db.session.add(Expense(**row))
+        db.session.commit()
+    single = (time.perf_counter() - started) * 1000 / SINGLE_INSERTS
+    started = time.perf_counter()
+    db.session.execute(insert(Expense.__table__), rows[:BULK_INSERT])
+    db.session.commit()
+    bulk = (time.perf_counter() - started) * 1000
+    Expense.query.filter_by(user_id=user_id, title='Bench insert').delete(synchronize_session=False)
+    db.session.commit()
+    return round(single, 3), round(bulk, 1)
+
+
+def measure(user_id, today, repeat):
+    import partitions
+    from models import month_range
+    from queries import expense_page, iter_expense_rows, spending_summary
+
+    month_start, month_end = month_range(today.strftime('%Y-%m'))
+    old_start, old_end = month_range(partitions.add_months(today, -18).strftime('%Y-%m'))
+    result = {
+        'month_page_ms': median_ms(lambda: expense_page(user_id, month_start, month_end), repeat),
+        'month_summary_ms': median_ms(lambda: spending_summary(user_id, month_start, month_end), repeat),
+        'lifetime_page_ms': median_ms(lambda: expense_page(user_id), repeat),
+        'old_month_page_ms': median_ms(lambda: expense_page(user_id, old_start, old_end), repeat),
+    }
+    result['single_insert_ms'], result['bulk_insert_ms'] = timed_inserts(user_id, today)
+    started = time.perf_counter()
+    exported = sum(1 for _ in iter_expense_rows(user_id))
+    result['export_s'] = round(time.perf_counter() - started, 2)
+    result['exported_rows'] = exported
+    result['expenses_mb'] = table_mb('expenses')
+    result['archive_mb'] = table_mb('expenses_archive')
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='FinTrack partition benchmark')
+    parser.add_argument('--rows', default='1m', help='Expenses for the measured user (10k, 100k, 1m or a number)')
+    parser.add_argument('--keep-months', type=int, default=12, help='Months left in expenses by the compaction')
+    parser.add_argument('--repeat', type=int, default=50, help='Timed runs per read')
+    parser.add_argument('--out', default=None, help='Write results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if root not in sys.path:
+        sys.path.insert(0, root)
+    instance = os.path.join(root, 'instance')
+    os.makedirs(instance, exist_ok=True)
+    os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(instance, 'bench.db'))
+    os.environ.setdefault('JOB_WORKERS', '0')
+
+    from app import create_app
+    from models import db
+    import partitions
+    from benchmarks.seed import seed_user, bench_username
+
+    rows = parse_size(args.rows)
+    app = create_app({'ADMISSION_ENABLED': False})
+    with app.app_context():
+        db.create_all()
+        user_id = seed_user(bench_username(rows), rows)
+        db.session.execute(db.text('PRAGMA wal_checkpoint(TRUNCATE)'))
+        source = db.engine.url.database
+        db.session.remove()
+        db.engine.dispose()
+
+    copy = os.path.join(instance, 'bench-partitions.db')
+    shutil.copyfile(source, copy)
+    app = create_app({'ADMISSION_ENABLED': False, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + copy})
+    today = date.today()
+    results = {'rows': rows, 'keep_months': args.keep_months}
+    with app.app_context():
+        db.create_all()
+        measure(user_id, today, 3)  # warm the page cache and imports
+        results['before'] = measure(user_id, today, args.repeat)
+        started = time.perf_counter()
+        before = partitions.archive_before(today, args.keep_months)
+        results['archived_rows'] = partitions.compact(before)
+        results['compact_s'] = round(time.perf_counter() - started, 1)
+        measure(user_id, today, 3)
+        results['after'] = measure(user_id, today, args.repeat)
+
+    print(f"{size_label(rows)} rows, {results['archived_rows']} archived in {results['compact_s']} s "
+          f"(keeping {args.keep_months} months)")
+    print(f"{'':20}{'before':>12}{'after':>12}")
+    for key in results['before']:
+        print(f"{key:20}{results['before'][key]:>12}{results['after'][key]:>12}")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
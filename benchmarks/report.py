@@ -0,0 +1,94 @@
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from benchmarks.run import parse_size, size_label, reset_peak_rss, peak_rss_mb
+from benchmarks.seed import synthetic_rows
+
+# ----------------------
+# PDF Report Benchmark
+# ----------------------
+# Renders synthetic expenses straight through exports.write_pdf, without a
+# database, so the numbers are the renderer's own: time, pages, file size
+# and peak RSS. Rows are streamed from a generator, so peak RSS should stay
+# flat as the row count grows.
+#
+#   python -m benchmarks.report --sizes 10k,100k,1m --out report.json
+#
+# The end-to-end route (fetch + render) is the export_pdf scenario of
+# benchmarks.run.
+
+PAGE_OBJECT = re.compile(rb'/Type /Page\b(?!s)')
+
+
+def synthetic_report(count, seed=0):
+    """(rows generator, SpendingSummary, goals) for `count` synthetic expenses."""
+    from queries import SpendingSummary
+    from rollups import GoalProgress
+
+    totals, counts, months = defaultdict(float), Counter(), defaultdict(float)
+    for row in synthetic_rows(0, count, seed=seed):
+        totals[row['category']] += row['amount']
+        counts[row['category']] += 1
+        months[row['date'].strftime('%Y-%m')] += row['amount']
+    summary = SpendingSummary(dict(totals), dict(counts), sum(totals.values()), count)
+    goals = [GoalProgress(month, 20000.0, round(spent, 2)) for month, spent in sorted(months.items())]
+    rows = ((row['title'], row['category'], row['amount'], row['date'])
+            for row in synthetic_rows(0, count, seed=seed))
+    return rows, summary, goals
+
+
+def run_size(count):
+    from exports import write_pdf
+
+    rows, summary, goals = synthetic_report(count)
+    reset_peak_rss()
+    with tempfile.TemporaryFile() as output:
+        started = time.perf_counter()
+        write_pdf(output, rows, summary, goals)
+        elapsed = time.perf_counter() - started
+        size = output.tell()
+        output.seek(0)
+        pages = len(PAGE_OBJECT.findall(output.read()))
+    return {
+        'size': size_label(count),
+        'rows': count,
+        'seconds': round(elapsed, 3),
+        'rows_per_s': round(count / elapsed),
+        'pages': pages,
+        'file_mb': round(size / (1024 * 1024), 2),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='FinTrack PDF report benchmark')
+    parser.add_argument('--sizes', default='10k,100k', help='Comma-separated row counts (10k, 100k, 1m or a number)')
+    parser.add_argument('--out', default=None, help='Write results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if root not in sys.path:
+        sys.path.insert(0, root)
+
+    results = []
+    for size in [parse_size(s) for s in args.sizes.split(',') if s.strip()]:
+        print(f"pdf @ {size_label(size)} ...", end=' ', flush=True)
+        result = run_size(size)
+        results.append(result)
+        print(f"{result['seconds']} s, {result['pages']} pages, {result['file_mb']} MB, "
+              f"peak RSS {result['peak_rss_mb']} MB")
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,349 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+# ----------------------
+# Benchmark Runner
+# ----------------------
+# Seeds one synthetic user per dataset size into a local database, drives
+# the routes through the Flask test client and records latency
+# percentiles, throughput, SQL query counts/time and peak memory.
+#
+#   python -m benchmarks.run --sizes 1k,100k --out bench.json
+#   python -m benchmarks.run --sizes 1k,100k --compare bench.json
+#
+# The database defaults to a WAL SQLite file (instance/bench.db); pass
+# --database-url to benchmark against PostgreSQL.
+
+SIZES = {'1k': 1_000, '10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+SCENARIOS = ['dashboard', 'dashboard_cached', 'dashboard_lifetime', 'dashboard_revalidate', 'import',
+             'import_parquet', 'import_duplicate', 'batch', 'search', 'search_fuzzy', 'sync', 'export_csv', 'export_csv_revalidate',
+             'export_excel', 'export_parquet', 'export_pdf']
+BATCH_ITEMS = 1000  # expenses created (and then deleted) per batch scenario request
+# Metrics compared against a baseline; higher is worse for all of them
+COMPARED = ['p50_ms', 'p95_ms', 'peak_rss_mb', 'peak_alloc_mb', 'queries']
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    if text in SIZES:
+        return SIZES[text]
+    return int(text.replace('_', ''))
+
+
+def size_label(count):
+    for label, value in SIZES.items():
+        if value == count:
+            return label
+    return str(count)
+
+
+# ----------------------
+# Probes
+# ----------------------
+class QueryCounter:
+    """Counts statements and SQL time via SQLAlchemy engine events."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.count = 0
+        self.seconds = 0.0
+        self._started = []
+        event.listen(engine, 'before_cursor_execute', self._before)
+        event.listen(engine, 'after_cursor_execute', self._after)
+
+    def _before(self, *args):
+        self._started.append(time.perf_counter())
+
+    def _after(self, *args):
+        self.count += 1
+        if self._started:
+            self.seconds += time.perf_counter() - self._started.pop()
+
+    def reset(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+def reset_peak_rss():
+    # Writing 5 to clear_refs resets VmHWM on Linux, giving per-scenario peaks
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def percentile(values, pct):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[pct - 1]
+
+
+# ----------------------
+# Scenarios
+# ----------------------
+def build_requests(month, import_paths, parquet_paths):
+    def dashboard(client):
+        return client.post('/dashboard', data={'month': month})
+
+    def dashboard_lifetime(client):
+        return client.post('/dashboard', data={'month': 'lifetime'})
+
+    def importing(paths, filename):
+        # Each request uploads the next file; repeats of an already imported
+        # file only exercise the duplicate check
+        paths = itertools.cycle(paths)
+
+        def request_fn(client):
+            with open(next(paths), 'rb') as f:
+                return client.post('/import_excel', data={'excel_file': (f, filename)},
+                                   content_type='multipart/form-data',
+                                   headers={'Accept': 'application/json'})
+        return request_fn
+
+    def revalidate(url):
+        # Conditional GET with the ETag of the last full response; after the
+        # warmup request every timed request should be a 304
+        etags = {}
+
+        def request_fn(client):
+            response = client.get(url, headers={'If-None-Match': etags.get('etag', '')})
+            if response.status_code == 200:
+                etags['etag'] = response.headers['ETag']
+            return response
+        return request_fn
+
+    def do_batch(client):
+        # Create BATCH_ITEMS expenses and delete them again, so repeats see the same data
+        created = client.post('/api/expenses/batch', json={'create': [
+            {'title': f'Batch {i}', 'category': 'Bench', 'amount': i % 100, 'date': f'{month}-01'}
+            for i in range(BATCH_ITEMS)
+        ]})
+        ids = [item['id'] for item in created.get_json()['create']]
+        return client.post('/api/expenses/batch', json={'delete': ids})
+
+    return {
+        'dashboard': dashboard,
+        'dashboard_cached': dashboard,
+        'dashboard_lifetime': dashboard_lifetime,
+        'dashboard_revalidate': revalidate('/dashboard'),
+        'import': importing(import_paths, 'bench.csv'),
+        'import_parquet': importing(parquet_paths, 'bench.parquet'),
+        # The same file every time: after the warmup, every row is a duplicate
+        'import_duplicate': importing(import_paths[:1], 'bench.csv'),
+        'batch': do_batch,
+        'search': lambda client: client.get('/api/expenses/search', query_string={'q': 'coff'}),
+        'search_fuzzy': lambda client: client.get('/api/expenses/search',
+                                                  query_string={'q': 'electrcity', 'fuzzy': 1}),
+        'sync': lambda client: client.get('/api/sync/expenses', query_string={'limit': 500}),
+        'export_csv': lambda client: client.get('/export/csv'),
+        'export_csv_revalidate': revalidate('/export/csv'),
+        'export_excel': lambda client: client.get('/export/excel'),
+        'export_parquet': lambda client: client.get('/export/parquet'),
+        'export_pdf': lambda client: client.get('/export/pdf'),
+    }
+
+
+def run_scenario(client, request_fn, queries, repeat, warmup):
+    for _ in range(warmup):
+        request_fn(client)
+
+    latencies, query_counts, sql_seconds, sizes = [], [], [], []
+    reset_peak_rss()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        queries.reset()
+        t0 = time.perf_counter()
+        response = request_fn(client)
+        body = response.get_data()  # drain streamed bodies
+        latencies.append((time.perf_counter() - t0) * 1000)
+        if response.status_code >= 400:
+            raise RuntimeError(f"HTTP {response.status_code}: {body[:200]!r}")
+        query_counts.append(queries.count)
+        sql_seconds.append(queries.seconds)
+        sizes.append(len(body))
+    elapsed = time.perf_counter() - started
+    rss = peak_rss_mb()
+
+    # One extra traced run for Python-level allocation peak; kept out of the
+    # timed loop because tracemalloc slows everything down
+    tracemalloc.start()
+    request_fn(client).get_data()
+    _, peak_alloc = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'repeat': repeat,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'mean_ms': round(statistics.fmean(latencies), 3),
+        'throughput_rps': round(repeat / elapsed, 3) if elapsed else None,
+        'queries': max(query_counts),
+        'sql_ms': round(statistics.fmean(sql_seconds) * 1000, 3),
+        'response_bytes': max(sizes),
+        'peak_rss_mb': round(rss, 2),
+        'peak_alloc_mb': round(peak_alloc / (1024 * 1024), 2),
+    }
+
+
+# ----------------------
+# Compare
+# ----------------------
+def compare(results, baseline, threshold):
+    """Return a list of human-readable regressions against a baseline file."""
+    previous = {(r['scenario'], r['size']): r for r in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        before = previous.get((result['scenario'], result['size']))
+        if before is None:
+            continue
+        for metric in COMPARED:
+            old, new = before.get(metric), result.get(metric)
+            if old is None or new is None:
+                continue
+            limit = old if metric == 'queries' else old * (1 + threshold)
+            if new > limit:
+                change = f"+{(new - old) / old:.0%}" if old else "new"
+                regressions.append(f"{result['scenario']} @ {result['size']}: {metric} {old} -> {new} ({change})")
+    return regressions
+
+
+# ----------------------
+# Main
+# ----------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=(
+        'FinTrack route benchmarks. Seeds one synthetic user per dataset size, runs each scenario '
+        '(dashboard, import, batch, search, sync and export requests) through the Flask test client and '
+        'reports latency percentiles, throughput, SQL queries and peak memory. With --compare, a result '
+        'whose p50/p95 latency or memory is more than --threshold above the baseline from an earlier --out, '
+        'or that runs more queries, is reported as a regression and the exit status is 1.'))
+    parser.add_argument('--sizes', default='1k,100k',
+                        help='Comma-separated dataset sizes (1k, 10k, 100k, 1m or a number)')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"Comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument('--repeat', type=int, default=5, help='Timed requests per scenario')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed requests per scenario')
+    parser.add_argument('--import-rows', type=int, default=10_000, help='Rows in the import file')
+    parser.add_argument('--database-url', default=None, help='Defaults to instance/bench.db (SQLite)')
+    parser.add_argument('--out', default=None, help='Write results as JSON to this file')
+    parser.add_argument('--compare', default=None, help='Baseline JSON to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Allowed relative slowdown before a metric counts as a regression')
+    args = parser.parse_args(argv)
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        os.makedirs(os.path.join(root, 'instance'), exist_ok=True)
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(root, 'instance', 'bench.db')
+    os.environ.setdefault('JOB_WORKERS', '0')
+
+    from app import create_app
+    from models import db
+    from cache import dashboard_cache
+    import search
+    from benchmarks.seed import seed_user, bench_username, write_import_file, write_parquet_import_file
+
+    sizes = [parse_size(s) for s in args.sizes.split(',') if s.strip()]
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    workdir = tempfile.mkdtemp(prefix='fintrack-bench-')
+    # One distinct import file per request, since re-uploading a file imports nothing
+    runs = args.warmup + args.repeat if {'import', 'import_parquet'} & set(scenarios) else 1
+    import_paths = [os.path.join(workdir, f'import-{run}.csv') for run in range(runs)]
+    for run, path in enumerate(import_paths):
+        write_import_file(path, args.import_rows, seed=run + 1)
+    parquet_paths = [os.path.join(workdir, f'import-{run}.parquet') for run in range(runs)]
+    if 'import_parquet' in scenarios:
+        for run, path in enumerate(parquet_paths):
+            # Other rows than the CSV files, which may have been imported already
+            write_parquet_import_file(path, args.import_rows, seed=runs + run + 1)
+    requests = build_requests(datetime.now().strftime('%Y-%m'), import_paths, parquet_paths)
+
+    # Requests are timed one at a time; the admission rate limits would reject the repeats
+    app = create_app({'ADMISSION_ENABLED': False})
+    results = []
+    with app.app_context():
+        db.create_all()
+        search.install()
+        db.session.commit()
+        queries = QueryCounter(db.engine)
+        for size in sizes:
+            user_id = seed_user(bench_username(size), size)
+            import_user = seed_user(bench_username(size) + '-import', 0)
+            for scenario in scenarios:
+                client = app.test_client()
+                with client.session_transaction() as sess:
+                    sess['user_id'] = import_user if scenario.startswith('import') or scenario == 'batch' else user_id
+                dashboard_cache.enabled = scenario == 'dashboard_cached'
+                print(f"{scenario} @ {size_label(size)} ...", end=' ', flush=True)
+                result = run_scenario(client, requests[scenario], queries, args.repeat, args.warmup)
+                result.update({'scenario': scenario, 'size': size_label(size), 'rows': size})
+                results.append(result)
+                print(f"p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, "
+                      f"{result['queries']} queries, peak RSS {result['peak_rss_mb']} MB")
+            # Keep the import user small so later sizes start from the same state
+            seed_user(bench_username(size) + '-import', 0)
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'database': app.config['SQLALCHEMY_DATABASE_URI'].split('@')[-1],
+            'repeat': args.repeat,
+            'import_rows': args.import_rows,
+        },
+        'results': results,
+    }
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("Regressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("No regressions against baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
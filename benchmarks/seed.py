@@ -0,0 +1,88 @@
+import random
+from datetime import date, timedelta
+from sqlalchemy import insert
+from models import db, User, Expense, ExpenseArchive
+import categories
+import rollups
+
+# ----------------------
+# Synthetic Data
+# ----------------------
+CATEGORIES = ['Food', 'Groceries', 'Travel', 'Fuel', 'Shopping', 'Rent',
+              'Utilities', 'Health', 'Education', 'Entertainment']
+TITLES = ['Lunch', 'Dinner', 'Coffee', 'Taxi', 'Train ticket', 'Petrol', 'Movie',
+          'Electricity bill', 'Internet', 'Pharmacy', 'Books', 'Supermarket',
+          'Online order', 'Gym', 'Flight', 'Hotel', 'Rent', 'Snacks']
+HISTORY_DAYS = 3 * 365
+
+
+def bench_username(size):
+    return f"bench-{size}"
+
+
+def synthetic_rows(user_id, count, seed=0, today=None):
+    """Deterministic expense rows spread over the last three years."""
+    rng = random.Random(seed)
+    today = today or date.today()
+    for _ in range(count):
+        yield {
+            'user_id': user_id,
+            'title': rng.choice(TITLES),
+            'category': rng.choice(CATEGORIES),
+            'amount': round(rng.lognormvariate(5.5, 1.0), 2),
+            'date': today - timedelta(days=rng.randrange(HISTORY_DAYS)),
+        }
+
+
+def seed_user(username, count, seed=0, batch_size=20000, log=print):
+    """
+    Make sure `username` exists with exactly `count` synthetic expenses.
+    Re-seeding is skipped when the user already has that many rows.
+    """
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        user = User(username=username, password='bench')
+        db.session.add(user)
+        db.session.commit()
+
+    existing = sum(model.query.filter_by(user_id=user.id).count() for model in (Expense, ExpenseArchive))
+    if existing == count:
+        return user.id
+
+    log(f"Seeding {username} with {count} expenses")
+    for model in (Expense, ExpenseArchive):
+        model.query.filter_by(user_id=user.id).delete(synchronize_session=False)
+    category_ids = categories.resolve(user.id, CATEGORIES)
+    batch = []
+    for row in synthetic_rows(user.id, count, seed=seed):
+        row['category_id'] = category_ids[row.pop('category')]
+        batch.append(row)
+        if len(batch) >= batch_size:
+            db.session.execute(insert(Expense.__table__), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(Expense.__table__), batch)
+    rollups.rebuild(user.id)
+    db.session.commit()
+    return user.id
+
+
+def write_import_file(path, count, seed=1):
+    """Write a CSV in the import template layout."""
+    import csv
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Title', 'Category', 'Amount', 'Date (YYYY-MM-DD)'])
+        for row in synthetic_rows(0, count, seed=seed):
+            writer.writerow([row['title'], row['category'], row['amount'], row['date'].isoformat()])
+
+
+def write_parquet_import_file(path, count, seed=1):
+    """The same rows as write_import_file, as a Parquet file (needs pyarrow)."""
+    from exports import write_parquet
+
+    rows = [(row['title'], row['category'], row['amount'], row['date'])
+            for row in synthetic_rows(0, count, seed=seed)]
+    with open(path, 'wb') as f:
+        write_parquet(f, [rows])
@@ -0,0 +1,124 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# ----------------------
+# Startup Benchmark
+# ----------------------
+# Measures what a gunicorn worker pays before it can serve: importing the
+# app module, building the app with create_app(), and the first request in
+# a freshly forked child. Each sample runs in a new interpreter so module
+# caches don't leak between runs.
+#
+#   python -m benchmarks.startup --repeat 5 --out startup.json
+#
+# It also checks that the heavy import/export libraries stay unloaded until
+# a route that needs them is hit.
+
+HEAVY_MODULES = ['pandas', 'numpy', 'openpyxl', 'reportlab']
+
+PROBE = r'''
+import json, os, sys, time
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return None
+
+t0 = time.perf_counter()
+import app as module
+t1 = time.perf_counter()
+application = module.create_app({'TESTING': True})
+t2 = time.perf_counter()
+loaded = [name for name in HEAVY if name in sys.modules]
+rss = rss_mb()
+
+# Fork like a pre-fork server would and time the first request in the child
+read_fd, write_fd = os.pipe()
+t3 = time.perf_counter()
+pid = os.fork()
+if pid == 0:
+    os.close(read_fd)
+    t_start = time.perf_counter()
+    response = application.test_client().get('/login')
+    elapsed = time.perf_counter() - t_start
+    os.write(write_fd, json.dumps({'status': response.status_code, 'first_request_s': elapsed,
+                                   'rss_mb': rss_mb()}).encode())
+    os._exit(0)
+os.close(write_fd)
+os.waitpid(pid, 0)
+child = json.loads(os.read(read_fd, 65536))
+t4 = time.perf_counter()
+
+print(json.dumps({
+    'import_s': t1 - t0,
+    'create_app_s': t2 - t1,
+    'fork_first_request_s': t4 - t3,
+    'first_request_s': child['first_request_s'],
+    'first_request_status': child['status'],
+    'rss_mb': rss,
+    'child_rss_mb': child['rss_mb'],
+    'heavy_loaded': loaded,
+}))
+'''
+
+
+def run_probe(root, env):
+    code = f'HEAVY = {HEAVY_MODULES!r}\n' + PROBE
+    out = subprocess.run([sys.executable, '-c', code], cwd=root, env=env,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def summarize(samples, key):
+    values = [s[key] for s in samples if s.get(key) is not None]
+    if not values:
+        return None
+    scale = 1000 if key.endswith('_s') else 1  # seconds are reported as ms
+    return {'median': round(statistics.median(values) * scale, 2), 'max': round(max(values) * scale, 2)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='FinTrack startup benchmark')
+    parser.add_argument('--repeat', type=int, default=5, help='Fresh interpreters to sample')
+    parser.add_argument('--database-url', default=None, help='Defaults to a throwaway SQLite file')
+    parser.add_argument('--out', default=None, help='Write results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['DATABASE_URL'] = args.database_url or 'sqlite:///' + os.path.join(
+        tempfile.mkdtemp(prefix='fintrack-startup-'), 'startup.db')
+    env.setdefault('JOB_WORKERS', '0')
+
+    samples = [run_probe(root, env) for _ in range(args.repeat)]
+    heavy = sorted({name for s in samples for name in s['heavy_loaded']})
+    report = {
+        'repeat': args.repeat,
+        'import_ms': summarize(samples, 'import_s'),
+        'create_app_ms': summarize(samples, 'create_app_s'),
+        'fork_first_request_ms': summarize(samples, 'fork_first_request_s'),
+        'first_request_ms': summarize(samples, 'first_request_s'),
+        'rss_mb': summarize(samples, 'rss_mb'),
+        'child_rss_mb': summarize(samples, 'child_rss_mb'),
+        'heavy_modules_loaded': heavy,
+    }
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if heavy:
+        print(f"Heavy modules loaded at startup: {', '.join(heavy)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
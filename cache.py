@@ -0,0 +1,195 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+# ----------------------
+# Dashboard Cache
+# ----------------------
+# Dashboard results are cached per (user_id, month). Each user also has a
+# generation number that is part of every key, so "drop everything for this
+# user" (e.g. after an import) is a single counter bump on any backend.
+# Analytics series can span any range, so they carry a second per-user
+# counter that every write bumps instead of being deleted month by month.
+
+
+class LocalBackend:
+    """In-process LRU cache with per-entry TTL. One per gunicorn worker."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.counters = {}  # kept out of the LRU so generations are never evicted
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def counter(self, key):
+        return self.counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+            return self.counters[key]
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+
+class RedisBackend:
+    """Shared backend so every gunicorn worker sees the same entries and invalidations."""
+
+    def __init__(self, url, prefix='fintrack:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("DASHBOARD_CACHE_URL points at Redis but the 'redis' package is not installed")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.evictions = 0  # Redis evicts on its own; see INFO stats
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, json.dumps(value), ex=int(ttl) if ttl else None)
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+    def counter(self, key):
+        return int(self.client.get(self.prefix + key) or 0)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+class DashboardCache:
+    def __init__(self, app=None):
+        self.backend = None
+        self.ttl = None
+        self.enabled = False
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('DASHBOARD_CACHE_ENABLED', True)
+        app.config.setdefault('DASHBOARD_CACHE_TTL', 300)
+        app.config.setdefault('DASHBOARD_CACHE_SIZE', 1024)
+        app.config.setdefault('DASHBOARD_CACHE_URL', None)
+        self.enabled = app.config['DASHBOARD_CACHE_ENABLED']
+        self.ttl = app.config['DASHBOARD_CACHE_TTL']
+        url = app.config['DASHBOARD_CACHE_URL']
+        if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+            self.backend = RedisBackend(url)
+        else:
+            self.backend = LocalBackend(app.config['DASHBOARD_CACHE_SIZE'])
+        app.extensions['dashboard_cache'] = self
+
+    def _generation(self, user_id):
+        return self.backend.counter(f"gen:{user_id}")
+
+    def _key(self, user_id, month):
+        return f"dash:{user_id}:{self._generation(user_id)}:{month}"
+
+    def _series_key(self, user_id, key):
+        return f"series:{user_id}:{self._generation(user_id)}:{self.backend.counter(f'sgen:{user_id}')}:{key}"
+
+    def get(self, user_id, month):
+        if not self.enabled:
+            return None
+        value = self.backend.get(self._key(user_id, month))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, user_id, month, value):
+        if self.enabled:
+            self.backend.set(self._key(user_id, month), value, self.ttl)
+
+    def get_series(self, user_id, key):
+        if not self.enabled:
+            return None
+        value = self.backend.get(self._series_key(user_id, key))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set_series(self, user_id, key, value):
+        if self.enabled:
+            self.backend.set(self._series_key(user_id, key), value, self.ttl)
+
+    def invalidate(self, user_id, months):
+        """Drop the given 'YYYY-MM' months (and the lifetime view) for a user."""
+        if not self.enabled:
+            return
+        keys = {self._key(user_id, month) for month in months if month}
+        keys.add(self._key(user_id, 'lifetime'))
+        self.backend.delete(*keys)
+        self.backend.incr(f"sgen:{user_id}")
+        self.invalidations += 1
+
+    def invalidate_user(self, user_id):
+        if not self.enabled:
+            return
+        self.backend.incr(f"gen:{user_id}")
+        self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'invalidations': self.invalidations,
+            'evictions': self.backend.evictions,
+            'entries': len(self.backend.entries) if isinstance(self.backend, LocalBackend) else None,
+        }
+
+
+def month_of(day):
+    return day.strftime('%Y-%m') if day else None
+
+
+dashboard_cache = DashboardCache()
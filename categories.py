@@ -0,0 +1,138 @@
+import threading
+from collections import OrderedDict
+from sqlalchemy import event, insert, select
+from sqlalchemy.orm import Session
+from models import db, Category, category_key, category_name
+
+# ----------------------
+# Category Lookup
+# ----------------------
+# Write paths turn category names into ids with resolve(). A category id
+# never changes once committed, so each worker keeps a (user_id, key) -> id
+# map and only asks the database about spellings it hasn't seen yet.
+# Categories created inside a transaction are held on the session and only
+# enter the shared map once that transaction commits.
+
+CACHE_SIZE = 50000
+
+
+class CategoryCache:
+    """Per-process LRU of (user_id, key) -> category id."""
+
+    def __init__(self, max_entries=CACHE_SIZE):
+        self.max_entries = max_entries
+        self.ids = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, user_id, key):
+        with self._lock:
+            category_id = self.ids.get((user_id, key))
+            if category_id is None:
+                self.misses += 1
+                return None
+            self.ids.move_to_end((user_id, key))
+            self.hits += 1
+            return category_id
+
+    def put(self, entries):
+        with self._lock:
+            for cache_key, category_id in entries:
+                self.ids[cache_key] = category_id
+                self.ids.move_to_end(cache_key)
+            while len(self.ids) > self.max_entries:
+                self.ids.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.ids.clear()
+
+
+category_cache = CategoryCache()
+
+
+def _pending(session=None):
+    return (session or db.session).info.setdefault('new_categories', {})
+
+
+@event.listens_for(Session, 'after_commit')
+def _promote_new_categories(session):
+    created = session.info.pop('new_categories', None)
+    if created:
+        category_cache.put(created.items())
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_new_categories(session):
+    session.info.pop('new_categories', None)
+
+
+def _insert_missing(rows):
+    # Another request may create the same category concurrently; the
+    # unique (user_id, key) constraint decides and both read back one id
+    table = Category.__table__
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as upsert
+        db.session.execute(upsert(table).on_conflict_do_nothing(index_elements=['user_id', 'key']), rows)
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as upsert
+        db.session.execute(upsert(table).on_conflict_do_nothing(index_elements=['user_id', 'key']), rows)
+    else:
+        db.session.execute(insert(table), rows)
+
+
+def _fetch(user_id, keys):
+    table = Category.__table__
+    stmt = select(table.c.key, table.c.id).where(table.c.user_id == user_id, table.c.key.in_(list(keys)))
+    return dict(db.session.execute(stmt).all())
+
+
+def resolve(user_id, names, create=True):
+    """
+    Map category names to ids for `user_id`, creating categories that don't
+    exist yet (unless `create` is false). Blank names map to None, as do
+    unknown names when not creating. Runs in the caller's transaction.
+    """
+    pending = _pending()
+    result, missing = {}, {}  # missing: key -> first spelling seen
+    for name in names:
+        if name in result:
+            continue
+        key = category_key(name)
+        category_id = None
+        if key:
+            category_id = pending.get((user_id, key)) or category_cache.get(user_id, key)
+            if category_id is None:
+                missing.setdefault(key, name)
+        result[name] = category_id
+    if not missing:
+        return result
+
+    found = _fetch(user_id, missing)
+    category_cache.put(((user_id, key), category_id) for key, category_id in found.items())
+    new = [key for key in missing if key not in found]
+    if new and create:
+        _insert_missing([{'user_id': user_id, 'key': key, 'name': category_name(missing[key])} for key in new])
+        created = _fetch(user_id, new)
+        pending.update(((user_id, key), category_id) for key, category_id in created.items())
+        found.update(created)
+
+    for name in result:
+        if result[name] is None and category_key(name):
+            result[name] = found.get(category_key(name))
+    return result
+
+
+def resolve_one(user_id, name, create=True):
+    return resolve(user_id, [name], create).get(name)
+
+
+def category_names(user_id):
+    """{id: name} for all of a user's categories (0, the rollup "none" id, maps to '')."""
+    table = Category.__table__
+    names = dict(db.session.execute(
+        select(table.c.id, table.c.name).where(table.c.user_id == user_id)).all())
+    names[0] = ''
+    return names
@@ -0,0 +1,112 @@
+import os
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+# ----------------------
+# Database Engine Configuration
+# ----------------------
+# DATABASE_URL selects the backend. Without it the app runs on a local
+# SQLite file in the instance folder, so development, tests and benchmarks
+# need no network. Pool and timeout settings are read from the environment:
+#
+#   DB_POOL_SIZE, DB_MAX_OVERFLOW   connections per worker process; the server
+#                                   sees workers x (size + overflow) at peak
+#   DB_POOL_TIMEOUT                 seconds to wait for a free connection
+#   DB_POOL_RECYCLE                 seconds before a connection is replaced
+#   DB_POOL_PRE_PING                check connections before use (1/0)
+#   DB_STATEMENT_TIMEOUT_MS         PostgreSQL statement_timeout
+#   SQLITE_BUSY_TIMEOUT_MS, SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE_KB
+
+
+def _env_int(name, default):
+    value = os.getenv(name)
+    return int(value) if value not in (None, '') else default
+
+
+def _env_bool(name, default):
+    value = os.getenv(name)
+    if value in (None, ''):
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def database_url(app):
+    url = os.getenv('DATABASE_URL')
+    if url:
+        # Heroku-style URLs use the deprecated postgres:// scheme
+        if url.startswith('postgres://'):
+            url = 'postgresql+psycopg2://' + url[len('postgres://'):]
+        return url
+    os.makedirs(app.instance_path, exist_ok=True)
+    return 'sqlite:///' + os.path.join(app.instance_path, 'fintrack.db')
+
+
+def engine_options(url):
+    backend = make_url(url).get_backend_name()
+    if backend == 'sqlite':
+        return {
+            'connect_args': {
+                'timeout': _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000) / 1000,
+                # Job threads share the pool with request threads
+                'check_same_thread': False,
+            },
+        }
+
+    options = {
+        'pool_size': _env_int('DB_POOL_SIZE', 5),
+        'max_overflow': _env_int('DB_MAX_OVERFLOW', 5),
+        'pool_timeout': _env_int('DB_POOL_TIMEOUT', 10),
+        'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': _env_bool('DB_POOL_PRE_PING', True),
+    }
+    timeout = _env_int('DB_STATEMENT_TIMEOUT_MS', 30000)
+    if backend == 'postgresql' and timeout:
+        options['connect_args'] = {'options': f'-c statement_timeout={timeout}'}
+    return options
+
+
+def sqlite_pragmas():
+    return {
+        # WAL lets readers run while a writer commits
+        'journal_mode': 'WAL',
+        # Safe with WAL: a power loss can drop the last commits, never corrupt
+        'synchronous': 'NORMAL',
+        'busy_timeout': _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000),
+        'mmap_size': _env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+        'cache_size': -_env_int('SQLITE_CACHE_SIZE_KB', 64 * 1024),
+        'temp_store': 'MEMORY',
+    }
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in sqlite_pragmas().items():
+            cursor.execute(f'PRAGMA {name}={value}')
+    finally:
+        cursor.close()
+
+
+def configure_database(app, url=None):
+    """Set the database URI and engine options on `app` before db.init_app()."""
+    url = url or database_url(app)
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(url)
+
+
+def install_engine_hooks(engine):
+    """Per-connection setup that engine options can't express."""
+    if engine.dialect.name == 'sqlite' and engine.url.database not in (None, '', ':memory:'):
+        event.listen(engine, 'connect', _set_sqlite_pragmas)
+
+
+def describe_engine(engine):
+    info = {'url': engine.url.render_as_string(hide_password=True), 'dialect': engine.dialect.name}
+    pool = engine.pool
+    if hasattr(pool, 'size'):
+        info['pool'] = pool.status()
+    if engine.dialect.name == 'sqlite':
+        with engine.connect() as conn:
+            for name in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size', 'cache_size'):
+                info[name] = conn.exec_driver_sql(f'PRAGMA {name}').scalar()
+    return info
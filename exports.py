@@ -0,0 +1,396 @@
+import csv
+import io
+import zlib
+from datetime import timedelta
+
+# ----------------------
+# Export Writers
+# ----------------------
+EXPORT_HEADER = ['Title', 'Category', 'Amount', 'Date']
+
+
+def csv_chunks(rows, chunk_size=64 * 1024):
+    """Render rows as CSV, yielding text chunks of roughly `chunk_size` chars."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_HEADER)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def encode_chunks(chunks, encoding='utf-8'):
+    for chunk in chunks:
+        yield chunk.encode(encoding)
+
+
+def gzip_chunks(chunks, level=6):
+    """Gzip a stream of byte chunks without buffering the whole body."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+# ----------------------
+# Excel
+# ----------------------
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def write_excel(output, rows, summary=None, per_month=False):
+    """
+    Write rows to an .xlsx file using a write-only workbook, which streams
+    each row to disk instead of keeping a cell object per value. Amounts are
+    written as numbers and dates as real date cells. With `per_month`, rows
+    (which must arrive in date order) are split into one sheet per month.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+
+    wb = Workbook(write_only=True)
+
+    def new_sheet(title):
+        ws = wb.create_sheet(title)
+        ws.append(EXPORT_HEADER)
+        return ws
+
+    def date_cell(ws, value):
+        cell = WriteOnlyCell(ws, value=value)
+        cell.number_format = 'yyyy-mm-dd'
+        return cell
+
+    ws = None if per_month else new_sheet("Expenses")
+    current_month = None
+    for title, category, amount, day in rows:
+        if per_month:
+            month = day.strftime('%Y-%m') if day else 'Undated'
+            if month != current_month:
+                ws = new_sheet(month)
+                current_month = month
+        amount = float(amount) if amount is not None else None
+        ws.append([title, category, amount, date_cell(ws, day)])
+    if ws is None:
+        new_sheet("Expenses")
+
+    if summary is not None:
+        summary_ws = wb.create_sheet("Summary")
+        summary_ws.append(['Category', 'Count', 'Total Amount'])
+        for category, total in summary.category_totals.items():
+            summary_ws.append([category, summary.category_counts[category], total])
+        summary_ws.append(['Total', summary.count, summary.total_spent])
+
+    wb.save(output)
+
+
+# ----------------------
+# Parquet
+# ----------------------
+# Columnar export for large pulls. Each batch from the export query is
+# transposed into column lists and written out as Arrow row groups, so
+# memory is bounded by one row group however many rows are exported.
+# pyarrow is optional; without it the Parquet export and import are
+# unavailable and everything else works as before.
+PARQUET_MIMETYPE = 'application/vnd.apache.parquet'
+PARQUET_COLUMNS = ['title', 'category', 'amount', 'date']
+PARQUET_ROW_GROUP_SIZE = 128 * 1024
+
+
+class ParquetUnavailable(RuntimeError):
+    pass
+
+
+def arrow_modules():
+    """(pyarrow, pyarrow.parquet), or ParquetUnavailable if pyarrow isn't installed."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ParquetUnavailable('Parquet support needs the pyarrow package')
+    return pyarrow, pyarrow.parquet
+
+
+def write_parquet(output, batches, row_group_size=PARQUET_ROW_GROUP_SIZE, compression='zstd'):
+    """
+    Write batches of (title, category, amount, date) rows to a Parquet file.
+    Categories repeat heavily, so the dictionary encoding Parquet applies by
+    default keeps that column to a few bytes per row.
+    """
+    pa, pq = arrow_modules()
+    schema = pa.schema([
+        ('title', pa.string()),
+        ('category', pa.string()),
+        ('amount', pa.float64()),
+        ('date', pa.date32()),
+    ])
+    columns = [[] for _ in schema]
+
+    def flush():
+        arrays = [pa.array(values, type=field.type) for values, field in zip(columns, schema)]
+        writer.write_table(pa.Table.from_arrays(arrays, schema=schema), row_group_size=row_group_size)
+        for values in columns:
+            values.clear()
+
+    writer = pq.ParquetWriter(output, schema, compression=compression)
+    try:
+        for batch in batches:
+            for values, column in zip(columns, zip(*batch)):
+                values.extend(column)
+            if len(columns[0]) >= row_group_size:
+                flush()
+        if columns[0]:
+            flush()
+    finally:
+        writer.close()
+
+
+# ----------------------
+# PDF
+# ----------------------
+# The report is drawn straight onto a reportlab canvas as rows stream in,
+# rather than built from platypus Table flowables, which hold every row in
+# memory and lay the whole table out before the first page is written.
+# Rows have a fixed height, so a page break is a y-coordinate check, and
+# each page's text goes out as one text object. Cells too long for their
+# column are cut short with an ellipsis.
+PDF_MARGIN = 40
+PDF_BOTTOM = 50  # lowest row edge; the page number sits below it
+PDF_ROW_HEIGHT = 15
+PDF_CELL_PADDING = 4
+PDF_FONT = 'Helvetica'
+PDF_BOLD_FONT = 'Helvetica-Bold'
+PDF_FONT_SIZE = 8.5
+PDF_STRIPE = 0.95  # grey level of alternate rows
+PDF_HEADING_FILL = 0.85
+
+# (heading, width in points, alignment); each table spans the 532pt between margins
+EXPENSE_COLUMNS = [('Date', 66, 'left'), ('Title', 240, 'left'), ('Category', 140, 'left'), ('Amount', 86, 'right')]
+CATEGORY_COLUMNS = [('Category', 232, 'left'), ('Expenses', 100, 'right'), ('Total', 100, 'right'),
+                    ('Share', 100, 'right')]
+GOAL_COLUMNS = [('Month', 132, 'left'), ('Goal', 100, 'right'), ('Spent', 100, 'right'),
+                ('Remaining', 100, 'right'), ('Status', 100, 'right')]
+FIT_CACHE_SIZE = 10000
+
+
+def format_amount(value):
+    return '' if value is None else f'{value:,.2f}'
+
+
+def describe_period(start=None, end=None):
+    """Label for the half-open range [start, end) as the inclusive dates it covers."""
+    last = end - timedelta(days=1) if end is not None else None
+    if start is None and last is None:
+        return 'All time'
+    if last is None:
+        return f'From {start.isoformat()}'
+    if start is None:
+        return f'Up to {last.isoformat()}'
+    return f'{start.isoformat()} to {last.isoformat()}'
+
+
+class PdfReport:
+    """
+    Fixed-height table rows on a reportlab canvas. row() starts a new page
+    (repeating the column headings) when the current one is full, leaving
+    `footer_rows` rows at the foot of each page for the table's footer,
+    which is called as footer(last) when a page or the table ends.
+    """
+
+    def __init__(self, output, title, subtitle=''):
+        from reportlab.lib.pagesizes import letter
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+        from reportlab.pdfgen import canvas
+
+        self.width, self.height = letter
+        self.canvas = canvas.Canvas(output, pagesize=letter, pageCompression=1)
+        self.canvas.setTitle(title)
+        self.title = title
+        self.subtitle = subtitle
+        self.string_width = stringWidth
+        self.page = 0
+        self.text = None
+        self.font = None
+        self.y = 0
+        self.columns = None
+        self.footer = None
+        self.footer_rows = 0
+        self.striped = 0
+        self._fitted = {}
+
+    # Pages
+    def new_page(self):
+        if self.text is not None:
+            if self.footer:
+                self.footer(False)
+            self.canvas.drawText(self.text)
+            self.canvas.showPage()
+        self.page += 1
+        self.text = self.canvas.beginText()
+        self.text.setFillGray(0)
+        self.font = None
+        top = self.height - PDF_MARGIN
+        self._draw_text(PDF_MARGIN, top - 12, self.title, PDF_BOLD_FONT, 13)
+        self._draw_text(self.width - PDF_MARGIN, top - 12, self.subtitle, PDF_FONT, 9, 'right')
+        self._draw_text(self.width - PDF_MARGIN, PDF_BOTTOM - 24, f'Page {self.page}', PDF_FONT, 8, 'right')
+        self.y = top - 26
+        self.striped = 0
+        if self.columns:
+            self._heading_row()
+
+    def close(self):
+        self.end_table()
+        if self.text is not None:
+            self.canvas.drawText(self.text)
+            self.canvas.showPage()
+        self.canvas.save()
+
+    def _fits(self, rows):
+        return self.y - (rows + self.footer_rows) * PDF_ROW_HEIGHT >= PDF_BOTTOM
+
+    def heading(self, title):
+        """A section title, kept on the same page as the two rows after it."""
+        self.end_table()
+        if self.text is None or not self._fits(4):
+            self.new_page()
+        self.y -= 6
+        self._draw_text(PDF_MARGIN, self.y - 12, title, PDF_BOLD_FONT, 11)
+        self.y -= 20
+
+    # Tables
+    def table(self, columns, footer=None, footer_rows=0):
+        self.end_table()
+        # Room for the headings, one row and the footer, else start on a new page
+        if self.text is None or self.y - (2 + footer_rows) * PDF_ROW_HEIGHT < PDF_BOTTOM:
+            self.new_page()
+        self.columns = columns
+        self.footer = footer
+        self.footer_rows = footer_rows
+        self.striped = 0
+        self._heading_row()
+
+    def end_table(self):
+        if self.columns is None:
+            return
+        if self.footer:
+            self.footer(True)
+        self.columns = None
+        self.footer = None
+        self.footer_rows = 0
+        self.y -= PDF_ROW_HEIGHT
+
+    def row(self, values, bold=False, rule=False, stripe=True):
+        """A body row (alternate ones shaded), on a new page if this one is full."""
+        if not self._fits(1):
+            self.new_page()
+        self.striped += 1
+        fill = PDF_STRIPE if stripe and self.striped % 2 == 0 else None
+        self.draw_row(values, bold=bold, fill=fill, rule=rule)
+
+    def draw_row(self, values, bold=False, fill=None, rule=False):
+        """Draw a row at the current position, whether or not it fits (used by footers)."""
+        canvas = self.canvas
+        right = self.width - PDF_MARGIN
+        bottom = self.y - PDF_ROW_HEIGHT
+        if fill is not None:
+            canvas.setFillGray(fill)
+            canvas.rect(PDF_MARGIN, bottom, right - PDF_MARGIN, PDF_ROW_HEIGHT, stroke=0, fill=1)
+        if rule:
+            canvas.setLineWidth(0.5)
+            canvas.line(PDF_MARGIN, self.y, right, self.y)
+        font = PDF_BOLD_FONT if bold else PDF_FONT
+        x = PDF_MARGIN
+        for value, (_, width, align) in zip(values, self.columns):
+            if value != '' and value is not None:
+                # Right-aligned columns hold numbers, which always fit
+                if align == 'right':
+                    self._draw_text(x + width - PDF_CELL_PADDING, bottom + 4.5, str(value), font, PDF_FONT_SIZE, align)
+                else:
+                    text = self._fit(str(value), width - 2 * PDF_CELL_PADDING, font)
+                    self._draw_text(x + PDF_CELL_PADDING, bottom + 4.5, text, font, PDF_FONT_SIZE)
+            x += width
+        self.y = bottom
+
+    def _heading_row(self):
+        self.draw_row([heading for heading, _, _ in self.columns], bold=True, fill=PDF_HEADING_FILL)
+
+    # Text
+    def _draw_text(self, x, y, value, font, size, align='left'):
+        if align == 'right':
+            x -= self.string_width(value, font, size)
+        if self.font != (font, size):
+            self.text.setFont(font, size)
+            self.font = (font, size)
+        self.text.setTextOrigin(x, y)
+        self.text.textOut(value)
+
+    def _fit(self, value, width, font):
+        key = (value, width, font)
+        fitted = self._fitted.get(key)
+        if fitted is None:
+            fitted = value
+            if self.string_width(value, font, PDF_FONT_SIZE) > width:
+                while fitted and self.string_width(fitted + '...', font, PDF_FONT_SIZE) > width:
+                    fitted = fitted[:-1]
+                fitted = fitted.rstrip() + '...'
+            if len(self._fitted) >= FIT_CACHE_SIZE:
+                self._fitted.clear()
+            self._fitted[key] = fitted
+        return fitted
+
+
+def write_pdf(output, rows, summary, goals=(), period='All time'):
+    """
+    Expense report: the (title, category, amount, date) rows, in date order,
+    as a paginated table with each page's total and the running total at
+    its foot, then a summary of spend by category and of monthly goals
+    (rollups.goal_progress) against what was spent.
+    """
+    report = PdfReport(output, 'Expense Report', period)
+    totals = {'page': 0.0, 'all': 0.0, 'count': 0}
+
+    def expense_footer(last):
+        report.draw_row(['', 'Page total', '', format_amount(totals['page'])], bold=True, rule=True)
+        if last:
+            label = f"Total ({totals['count']} expenses)"
+        else:
+            label = 'Running total'
+        report.draw_row(['', label, '', format_amount(totals['all'])], bold=True)
+        totals['page'] = 0.0
+
+    report.table(EXPENSE_COLUMNS, footer=expense_footer, footer_rows=2)
+    for title, category, amount, day in rows:
+        report.row([day.isoformat() if day else '', title, category, format_amount(amount)])
+        if amount is not None:
+            totals['page'] += amount
+            totals['all'] += amount
+        totals['count'] += 1
+    if not totals['count']:
+        report.row(['', 'No expenses in this period', '', ''])
+
+    report.end_table()
+    report.new_page()
+    report.heading('Spending by category')
+    report.table(CATEGORY_COLUMNS)
+    ranked = sorted(summary.category_totals.items(), key=lambda item: -item[1])
+    for category, total in ranked:
+        share = f'{total * 100 / summary.total_spent:.1f}%' if summary.total_spent else ''
+        report.row([category or 'Uncategorised', summary.category_counts[category], format_amount(total), share])
+    report.row(['Total', summary.count, format_amount(summary.total_spent), '100.0%' if ranked else ''],
+               bold=True, rule=True, stripe=False)
+
+    report.heading('Monthly goals')
+    report.table(GOAL_COLUMNS)
+    for goal in goals:
+        remaining = goal.goal - goal.spent
+        report.row([goal.month, format_amount(goal.goal), format_amount(goal.spent), format_amount(remaining),
+                    'Within goal' if remaining >= 0 else 'Over goal'])
+    if not goals:
+        report.row(['No goals set for this period', '', '', '', ''])
+    report.close()
@@ -0,0 +1,424 @@
+import hashlib
+import io
+import os
+from datetime import date
+from sqlalchemy import insert, select
+from models import db, Expense, DATE_FORMATS
+from exports import arrow_modules, ParquetUnavailable
+import categories
+import partitions
+import rollups
+import sync
+
+# ----------------------
+# Bulk Import Engine
+# ----------------------
+# Spreadsheets (and Parquet files) are read in chunks of rows, each chunk is normalised and
+# validated as whole pandas columns, and the valid rows are written with one
+# bulk INSERT (or COPY on PostgreSQL) per chunk. Category names are mapped
+# to category ids once per distinct spelling in the chunk. The whole import
+# runs in the caller's transaction; rows that fail validation are reported,
+# not inserted, and rows the user already has are counted as duplicates.
+
+CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 200
+TEXT_LIMIT = 100  # title/category column width
+# Hashes looked up per query when skipping duplicates; keeps under SQLite's
+# bound-parameter limit
+HASH_LOOKUP_SIZE = 900
+
+# Header spellings we accept, after lower-casing and stripping
+COLUMN_ALIASES = {
+    'date (yyyy-mm-dd)': 'date',
+    'expense': 'title',
+    'description': 'title',
+    'amount (₹)': 'amount',
+}
+COLUMNS = ['title', 'category', 'amount', 'date']
+# Parquet column types accepted besides text, which is parsed like CSV cells
+PARQUET_TYPES = {'title': 'text', 'category': 'text', 'amount': 'a number', 'date': 'a date or timestamp'}
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+class ImportReport:
+    def __init__(self):
+        self.total_rows = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.error_count = 0
+        self.errors = []  # [{'row': spreadsheet row number, 'errors': [...]}]
+
+    def add_error(self, row, messages):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row, 'errors': messages})
+
+    def to_dict(self):
+        return {
+            'total_rows': self.total_rows,
+            'inserted': self.inserted,
+            'duplicates': self.duplicates,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+
+# ----------------------
+# Readers
+# ----------------------
+def _file_kind(filename):
+    ext = os.path.splitext(filename or '')[1].lower()
+    if ext == '.csv':
+        return 'csv'
+    if ext == '.parquet':
+        return 'parquet'
+    if ext in ('.xlsx', '.xlsm', ''):
+        return 'xlsx'
+    raise ImportFormatError(f'Unsupported file type "{ext}". Upload an .xlsx, .csv or .parquet file.')
+
+
+def _iter_xlsx_chunks(fileobj, chunk_size):
+    import pandas as pd
+    from openpyxl import load_workbook
+
+    # read_only mode parses the sheet lazily instead of building every cell
+    wb = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = None
+        for values in rows:
+            if any(v is not None and str(v).strip() for v in values):
+                header = ['' if v is None else str(v) for v in values]
+                break
+        if header is None:
+            return
+        chunk = []
+        for values in rows:
+            chunk.append(values[:len(header)])
+            if len(chunk) >= chunk_size:
+                yield pd.DataFrame(chunk, columns=header, dtype=object)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=header, dtype=object)
+    finally:
+        wb.close()
+
+
+def _iter_csv_chunks(fileobj, chunk_size):
+    import pandas as pd
+
+    if isinstance(fileobj.read(0), bytes):
+        fileobj = io.TextIOWrapper(fileobj, encoding='utf-8-sig')
+    # Read everything as text; coercion happens in normalize_chunk
+    yield from pd.read_csv(fileobj, dtype=str, keep_default_na=False, chunksize=chunk_size)
+
+
+def check_parquet_schema(schema):
+    """Map a Parquet file's columns onto ours, rejecting column types we can't import."""
+    import pyarrow.types as types
+
+    mapping = _map_columns(schema.names)
+    problems = []
+    for name, column in mapping.items():
+        kind = schema.field(name).type
+        if types.is_dictionary(kind):
+            kind = kind.value_type
+        if types.is_null(kind) or types.is_string(kind) or types.is_large_string(kind):
+            continue
+        if column == 'amount' and (types.is_integer(kind) or types.is_floating(kind) or types.is_decimal(kind)):
+            continue
+        if column == 'date' and (types.is_date(kind) or types.is_timestamp(kind)):
+            continue
+        problems.append(f'column "{name}" is {kind}, expected {PARQUET_TYPES[column]} or text')
+    if problems:
+        raise ImportFormatError('Unsupported Parquet schema: ' + '; '.join(problems))
+    return mapping
+
+
+def _iter_parquet_chunks(fileobj, chunk_size):
+    try:
+        pa, pq = arrow_modules()
+    except ParquetUnavailable as e:
+        raise ImportFormatError(str(e))
+    try:
+        parquet = pq.ParquetFile(fileobj)
+    except (pa.ArrowException, OSError):
+        raise ImportFormatError('Invalid Parquet file.')
+    columns = list(check_parquet_schema(parquet.schema_arrow))
+    # Only the mapped columns are read; typed dates and amounts come through
+    # as datetime64/float columns and skip the text parsing in normalize_chunk
+    for batch in parquet.iter_batches(batch_size=chunk_size, columns=columns):
+        yield batch.to_pandas(date_as_object=False)
+
+
+def iter_chunks(fileobj, filename, chunk_size=CHUNK_SIZE):
+    kind = _file_kind(filename)
+    if kind == 'csv':
+        return _iter_csv_chunks(fileobj, chunk_size)
+    if kind == 'parquet':
+        return _iter_parquet_chunks(fileobj, chunk_size)
+    return _iter_xlsx_chunks(fileobj, chunk_size)
+
+
+# ----------------------
+# Normalisation
+# ----------------------
+def _map_columns(columns):
+    mapping = {}
+    for col in columns:
+        key = str(col).strip().lower()
+        key = COLUMN_ALIASES.get(key, key)
+        if key in COLUMNS and key not in mapping.values():
+            mapping[col] = key
+    if 'date' not in mapping.values() and 'title' not in mapping.values():
+        raise ImportFormatError('Invalid file format. Please use the provided template.')
+    return mapping
+
+
+def _parse_dates(values):
+    import pandas as pd
+
+    if pd.api.types.is_datetime64_any_dtype(values):
+        if getattr(values.dt, 'tz', None) is not None:
+            values = values.dt.tz_localize(None)
+        return values, values.isna()
+    text = values.astype('string').str.strip()
+    parsed = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    for fmt in DATE_FORMATS:
+        missing = parsed.isna() & text.notna() & (text != '')
+        if not missing.any():
+            break
+        parsed[missing] = pd.to_datetime(text[missing], format=fmt, errors='coerce')
+    blank = text.isna() | (text == '') | text.str.lower().isin(['nan', 'nat', 'none'])
+    return parsed, blank
+
+
+def normalize_chunk(frame, first_row):
+    """
+    Coerce one raw chunk into (records DataFrame, [(row, [errors])]).
+    `first_row` is the spreadsheet row number of the chunk's first line.
+    """
+    import pandas as pd
+
+    frame = frame.rename(columns=_map_columns(frame.columns))
+    frame = frame.loc[:, ~frame.columns.duplicated()]
+    for col in COLUMNS:
+        if col not in frame.columns:
+            frame[col] = None
+    frame = frame[COLUMNS]
+    frame.index = pd.RangeIndex(first_row, first_row + len(frame))
+
+    # Skip rows that are completely empty (trailing blank lines in Excel).
+    # Only text columns can hold whitespace; typed (Parquet) ones are just null.
+    empty = pd.Series(True, index=frame.index)
+    for col in COLUMNS:
+        values = frame[col]
+        blank = values.isna()
+        if pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values):
+            blank |= values.astype('string').str.strip() == ''
+        empty &= blank
+    frame = frame[~empty]
+
+    out = pd.DataFrame(index=frame.index)
+    for col in ('title', 'category'):
+        out[col] = frame[col].astype('string').fillna('').str.strip().str.slice(0, TEXT_LIMIT)
+
+    amount = frame['amount']
+    if pd.api.types.is_numeric_dtype(amount) and not pd.api.types.is_bool_dtype(amount):
+        out['amount'] = amount.astype(float).fillna(0.0)
+    else:
+        amount_text = amount.astype('string').str.replace(r'[₹,\s]', '', regex=True)
+        amount_blank = amount_text.isna() | (amount_text == '')
+        out['amount'] = pd.to_numeric(amount_text.where(~amount_blank, '0'), errors='coerce')
+    bad_amount = out['amount'].isna()
+
+    parsed, date_blank = _parse_dates(frame['date'])
+    bad_date = parsed.isna() & ~date_blank
+    out['date'] = parsed.dt.date.where(~date_blank, date.today())
+
+    errors = []
+    for row in out.index[bad_amount | bad_date]:
+        messages = []
+        if bad_amount[row]:
+            messages.append(f'Invalid amount "{frame.at[row, "amount"]}"')
+        if bad_date[row]:
+            messages.append(f'Invalid date "{frame.at[row, "date"]}"')
+        errors.append((int(row), messages))
+    return out[~(bad_amount | bad_date)], errors
+
+
+# ----------------------
+# Duplicate Detection
+# ----------------------
+# Each expense is stored with a hash of its normalised content, and
+# (user_id, content_hash) is unique. The n-th identical row of a file gets
+# a different hash from the first, so two genuine identical expenses in
+# one file both import, while uploading the same file again matches every
+# row against what is already there. Expenses added or edited by hand or
+# through the batch API are hashed too (see expense_hashes), so importing
+# an export of them finds them however they were created.
+
+def content_keys(records):
+    """Normalised title/category/amount/date of each row, as one string."""
+    def text(values):
+        return values.astype('string').fillna('').str.split().str.join(' ').str.casefold().str.slice(0, TEXT_LIMIT)
+
+    import pandas as pd
+
+    amount = records['amount'].astype(float).round(2).map('{:.2f}'.format)
+    # str() of a date is its ISO form, which is also how raw SQL reads it back on SQLite
+    day = records['date'].map(lambda value: '' if pd.isna(value) else str(value))
+    return text(records['title']) + '\x1f' + text(records['category']) + '\x1f' + amount + '\x1f' + day
+
+
+def content_hashes(records, seen):
+    """
+    Content hash of each row. `seen` maps content digests to how often they
+    have occurred so far in the file; pass the same dict for every chunk.
+    """
+    hashes = []
+    for key in content_keys(records):
+        digest = _digest(key)
+        occurrence = seen.get(digest, 0)
+        seen[digest] = occurrence + 1
+        hashes.append(_occurrence_hash(digest, occurrence))
+    return hashes
+
+
+def _digest(key):
+    return hashlib.blake2b(key.encode(), digest_size=16).digest()
+
+
+def _occurrence_hash(digest, occurrence):
+    if occurrence:
+        digest = hashlib.blake2b(digest + str(occurrence).encode(), digest_size=16).digest()
+    return digest.hex()
+
+
+def existing_hashes(user_id, hashes):
+    """The ones among `hashes` the user's expenses (archived ones included) already have."""
+    existing = set()
+    for model in partitions.expense_models(user_id):
+        table = model.__table__
+        for i in range(0, len(hashes), HASH_LOOKUP_SIZE):
+            existing.update(db.session.execute(
+                select(table.c.content_hash)
+                .where(table.c.user_id == user_id, table.c.content_hash.in_(hashes[i:i + HASH_LOOKUP_SIZE]))
+            ).scalars())
+    return existing
+
+
+def expense_hashes(user_id, rows):
+    """
+    Content hashes for (title, category, amount, date) rows added or edited
+    outside an import. Each takes the lowest occurrence of its content the
+    user doesn't hold yet, the way a file holding all of the user's
+    expenses would number them. Edited rows must have had their old hash
+    cleared first.
+    """
+    import pandas as pd
+
+    records = pd.DataFrame(rows, columns=['title', 'category', 'amount', 'date'])
+    pending = {}  # digest -> positions of the rows still without a hash
+    for position, key in enumerate(content_keys(records)):
+        pending.setdefault(_digest(key), []).append(position)
+    hashes = [None] * len(records)
+    tried = dict.fromkeys(pending, 0)  # digest -> occurrences looked up so far
+    while pending:
+        candidates = {}  # hash -> digest, in occurrence order
+        for digest, positions in pending.items():
+            for occurrence in range(tried[digest], tried[digest] + len(positions)):
+                candidates[_occurrence_hash(digest, occurrence)] = digest
+            tried[digest] += len(positions)
+        taken = existing_hashes(user_id, list(candidates))
+        for content_hash, digest in candidates.items():
+            if content_hash not in taken and pending[digest]:
+                hashes[pending[digest].pop(0)] = content_hash
+        pending = {digest: positions for digest, positions in pending.items() if positions}
+    return hashes
+
+
+def drop_existing(user_id, records):
+    """The rows whose content hash the user doesn't have yet."""
+    if records.empty:
+        return records
+    existing = existing_hashes(user_id, records['content_hash'].tolist())
+    if not existing:
+        return records
+    return records[~records['content_hash'].isin(existing)]
+
+
+# ----------------------
+# Writers
+# ----------------------
+INSERT_COLUMNS = ['user_id', 'title', 'category_id', 'amount', 'date', 'version', 'content_hash']
+
+
+def with_category_ids(user_id, records):
+    """Replace the chunk's category names with category ids (creating new categories)."""
+    if records.empty:
+        return records.assign(category_id=None)
+    ids = categories.resolve(user_id, records['category'].unique())
+    category_id = records['category'].map(ids).astype('Int64')
+    return records.drop(columns='category').assign(category_id=category_id)
+
+
+def _copy_records(conn, records):
+    # COPY is several times faster than INSERT for large batches on PostgreSQL
+    buffer = io.StringIO()
+    records.to_csv(buffer, header=False, index=False, columns=INSERT_COLUMNS)
+    buffer.seek(0)
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(
+            'COPY expenses (user_id, title, category_id, amount, "date", version, content_hash) FROM STDIN WITH (FORMAT csv)',
+            buffer,
+        )
+    finally:
+        cursor.close()
+
+
+def insert_records(user_id, records):
+    """Bulk insert one chunk (after with_category_ids) inside the current session transaction."""
+    if records.empty:
+        return 0
+    records = records.assign(user_id=user_id, version=sync.bump(user_id))
+    conn = db.session.connection()
+    if conn.dialect.name == 'postgresql' and conn.dialect.driver == 'psycopg2':
+        _copy_records(conn, records)
+    else:
+        frame = records[INSERT_COLUMNS].astype(object)
+        frame = frame.where(frame.notna(), None)
+        rows = [dict(zip(INSERT_COLUMNS, values)) for values in frame.itertuples(index=False, name=None)]
+        conn.execute(insert(Expense.__table__), rows)
+    return len(records)
+
+
+def import_expenses(user_id, fileobj, filename, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Parse, validate and bulk insert a spreadsheet of expenses. Does not
+    commit; the caller owns the transaction. Rows the user already has
+    (see content_hashes) are skipped. `progress(rows_done)` is called after
+    each chunk.
+    """
+    report = ImportReport()
+    next_row = 2  # row 1 is the header
+    seen = {}
+    for frame in iter_chunks(fileobj, filename, chunk_size):
+        records, errors = normalize_chunk(frame, next_row)
+        next_row += len(frame)
+        report.total_rows += len(records) + len(errors)
+        for row, messages in errors:
+            report.add_error(row, messages)
+        records = records.assign(content_hash=content_hashes(records, seen))
+        new = drop_existing(user_id, records)
+        report.duplicates += len(records) - len(new)
+        records = with_category_ids(user_id, new)
+        report.inserted += insert_records(user_id, records)
+        rollups.apply_deltas(user_id, rollups.frame_deltas(records))
+        if progress:
+            progress(report.total_rows)
+    return report
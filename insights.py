@@ -0,0 +1,426 @@
+import calendar
+import multiprocessing
+import warnings
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from sqlalchemy import Integer, cast, func, insert, literal_column, or_, select
+from flask import current_app
+from models import db, User, MonthlyRollup, UserInsights
+import categories
+import partitions
+
+# ----------------------
+# Spending Insights
+# ----------------------
+# Month-end projections, per-category anomalies and recurring charges. They
+# are computed per user with NumPy/pandas over whole arrays of the user's
+# history, by a nightly batch (`flask insights refresh`), and stored in
+# user_insights; the dashboard only reads that row by primary key.
+#
+#   projection  this month's spend so far divided by the share of a month's
+#               spend that has usually happened by today (median over the
+#               last PROFILE_MONTHS months; the quartiles give the range).
+#               Early in the month it expects a typical month, and without
+#               history it extrapolates the daily run rate.
+#   anomalies   category-months at least ANOMALY_Z standard deviations above
+#               the TRAILING_MONTHS before them and beyond their Q3 + 1.5 IQR
+#               fence. Monthly totals come from monthly_rollups, so the whole
+#               history costs O(categories x months); the last
+#               ANOMALY_MONTHS months are stored.
+#   recurring   titles charged at a steady interval (weekly to quarterly) and
+#               a steady amount over the last RECURRING_MONTHS, and still due.
+
+PROFILE_MONTHS = 6
+MIN_PROFILE_MONTHS = 2
+MIN_SHARE = 0.1  # below this share of a typical month, expect a typical month instead
+TRAILING_MONTHS = 6
+MIN_TRAILING = 3  # months of history a category needs before it can be anomalous
+ANOMALY_Z = 2.5
+ANOMALY_MIN_EXCESS = 100.0  # ignore spikes smaller than this over the trailing mean
+ANOMALY_MONTHS = 3
+RECURRING_MONTHS = 13
+RECURRING_MIN_CHARGES = 3
+RECURRING_REGULARITY = 0.75  # share of intervals (and amounts) that must be steady
+RECURRING_AMOUNT_TOLERANCE = 0.15
+RECURRING_SLACK_DAYS = 3
+RECURRING_LIMIT = 20
+# (label, shortest and longest median interval in days, charges a month)
+PERIODS = (('weekly', 6, 8, 52 / 12), ('fortnightly', 13, 16, 26 / 12), ('monthly', 26, 35, 1), ('quarterly', 85, 97, 1 / 3))
+TITLE_NOISE = r'[\W\d_]+'  # "NETFLIX.COM 0423" and "Netflix" are the same charge
+BATCH_CHUNK = 50  # users per unit of work (and per commit) in a refresh
+
+History = namedtuple('History', ['days', 'amounts', 'category_ids', 'titles'])
+
+EPOCH = date(1970, 1, 1)
+
+
+def _month_index(day):
+    return day.year * 12 + day.month - 1
+
+
+def _month_label(index):
+    return f'{index // 12:04d}-{index % 12 + 1:02d}'
+
+
+def _day(days_since_epoch):
+    return (EPOCH + timedelta(days=int(days_since_epoch))).isoformat()
+
+
+def _next_charge(last, period, interval):
+    """ISO date after `last` (days since the epoch) when a charge is due next."""
+    last = EPOCH + timedelta(days=int(last))
+    months = {'monthly': 1, 'quarterly': 3}.get(period)
+    if months is None:
+        return (last + timedelta(days=round(interval))).isoformat()
+    # Same day of the month (or the month's last day), like a billing cycle
+    index = _month_index(last) + months
+    year, month = index // 12, index % 12 + 1
+    return date(year, month, min(last.day, calendar.monthrange(year, month)[1])).isoformat()
+
+
+def _money(value):
+    return round(float(value), 2)
+
+
+# ----------------------
+# Loading
+# ----------------------
+def monthly_totals(user_id, as_of):
+    """(category_ids, first_month, totals): totals[c, m] is category c's spend in month first_month + m, up to as_of."""
+    import numpy as np
+
+    table = MonthlyRollup.__table__
+    rows = db.session.execute(
+        select(table.c.month, table.c.category_id, table.c.total)
+        .where(table.c.user_id == user_id, table.c.month <= as_of.strftime('%Y-%m'))).all()
+    if not rows:
+        return np.zeros(0, dtype=np.int64), _month_index(as_of), np.zeros((0, 1))
+    months, category_ids, totals = zip(*rows)
+    months = np.array([int(month[:4]) * 12 + int(month[5:7]) - 1 for month in months])
+    category_ids, rows_of = np.unique(np.array(category_ids, dtype=np.int64), return_inverse=True)
+    first = int(months.min())
+    matrix = np.zeros((len(category_ids), _month_index(as_of) - first + 1))
+    matrix[rows_of, months - first] = totals
+    return category_ids, first, matrix
+
+
+def epoch_day(column):
+    """SQL expression for a DATE column as whole days since 1970-01-01."""
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return column - literal_column("DATE '1970-01-01'")
+    return cast(func.julianday(column) - 2440587.5, Integer)
+
+
+def load_history(user_id, as_of):
+    """
+    The user's expenses from RECURRING_MONTHS ago to the end of as_of's
+    month, as arrays. Dates arrive as day numbers computed by the database,
+    which skips building a date object per row.
+    """
+    import numpy as np
+
+    since = _month_index(as_of) - (max(RECURRING_MONTHS, PROFILE_MONTHS + 1) - 1)
+    start = date(since // 12, since % 12 + 1, 1)
+    end = date(as_of.year, as_of.month, calendar.monthrange(as_of.year, as_of.month)[1]) + timedelta(days=1)
+    table = partitions.expense_table(user_id, start, end)
+    rows = db.session.execute(
+        select(epoch_day(table.c.date), table.c.amount, func.coalesce(table.c.category_id, 0), table.c.title)
+        .where(table.c.user_id == user_id, table.c.date >= start, table.c.date < end,
+               table.c.amount.isnot(None))).all()
+    count = len(rows)
+    return History(
+        days=np.fromiter((row[0] for row in rows), dtype=np.int64, count=count),
+        amounts=np.fromiter((row[1] for row in rows), dtype=np.float64, count=count),
+        category_ids=np.fromiter((row[2] for row in rows), dtype=np.int64, count=count),
+        titles=np.array([row[3] for row in rows], dtype=object),
+    )
+
+
+# ----------------------
+# Month-End Projection
+# ----------------------
+def project_month(history, as_of):
+    import numpy as np
+
+    days = history.days.astype('datetime64[D]')
+    months = days.astype('datetime64[M]')
+    offset = (months - np.datetime64(as_of, 'M')).astype(np.int64)  # 0 this month, -1 last month...
+    day_of_month = (days - months.astype('datetime64[D]')).astype(np.int64)  # 0-based
+    today = as_of.day - 1
+
+    this_month = offset == 0
+    spent = float(history.amounts[this_month & (day_of_month <= today)].sum())
+    scheduled = float(history.amounts[this_month & (day_of_month > today)].sum())
+
+    # Cumulative spend by day of month for each of the profile months
+    past = (offset < 0) & (offset >= -PROFILE_MONTHS)
+    cells = (offset[past] + PROFILE_MONTHS) * 31 + day_of_month[past]
+    by_day = np.bincount(cells, weights=history.amounts[past], minlength=PROFILE_MONTHS * 31)
+    cumulative = by_day.reshape(PROFILE_MONTHS, 31).cumsum(axis=1)
+    month_totals = cumulative[:, -1]
+    active = month_totals > 0
+    shares = np.clip(cumulative[active, today] / month_totals[active], 0, 1)
+
+    if len(shares) >= MIN_PROFILE_MONTHS:
+        low_share, share, high_share = np.percentile(shares, [25, 50, 75])
+        if share >= MIN_SHARE:
+            method = 'history'
+            projected, low, high = spent / share, spent / high_share, spent / max(low_share, MIN_SHARE)
+        else:
+            # Too early in the month to extrapolate from; expect a typical month
+            method = 'typical'
+            low, projected, high = (max(spent, total) for total in np.percentile(month_totals[active], [25, 50, 75]))
+    else:
+        method = 'run_rate'
+        days_in_month = calendar.monthrange(as_of.year, as_of.month)[1]
+        projected = low = high = spent * days_in_month / (today + 1)
+
+    return {
+        'month': as_of.strftime('%Y-%m'),
+        'spent': _money(spent),
+        'scheduled': _money(scheduled),
+        'projected': _money(projected + scheduled),
+        'low': _money(low + scheduled),
+        'high': _money(high + scheduled),
+        'method': method,
+        'history_months': int(len(shares)),
+    }
+
+
+# ----------------------
+# Category Anomalies
+# ----------------------
+def find_anomalies(category_ids, first_month, totals, names):
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+
+    count, months = totals.shape
+    if not count:
+        return []
+    # Months before the first rollup are unknown rather than zero
+    padded = np.concatenate([np.full((count, TRAILING_MONTHS), np.nan), totals], axis=1)
+    trailing = sliding_window_view(padded, TRAILING_MONTHS, axis=1)[:, :-1]  # the months before each month
+    with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+        warnings.simplefilter('ignore', RuntimeWarning)
+        known = (~np.isnan(trailing)).sum(axis=2)
+        mean = np.nanmean(trailing, axis=2)
+        std = np.nanstd(trailing, axis=2, ddof=1)
+        q1, median, q3 = np.nanpercentile(trailing, [25, 50, 75], axis=2)
+        z = (totals - mean) / std
+        flagged = ((known >= MIN_TRAILING) & (std > 0) & (z >= ANOMALY_Z)
+                   & (totals > q3 + 1.5 * (q3 - q1)) & (totals - mean >= ANOMALY_MIN_EXCESS))
+    flagged[:, :max(0, months - ANOMALY_MONTHS)] = False
+
+    anomalies = []
+    for row, column in zip(*np.nonzero(flagged)):
+        anomalies.append({
+            'month': _month_label(first_month + int(column)),
+            'category': names.get(int(category_ids[row]), ''),
+            'total': _money(totals[row, column]),
+            'typical': _money(median[row, column]),
+            'z': round(float(z[row, column]), 1),
+        })
+    anomalies.sort(key=lambda a: (a['month'], a['z']), reverse=True)
+    return anomalies
+
+
+# ----------------------
+# Recurring Charges
+# ----------------------
+def find_recurring(history, as_of, names):
+    import numpy as np
+    import pandas as pd
+
+    today = (as_of - EPOCH).days
+    # Normalise each distinct title once, then map the rows through the codes
+    title_codes, titles = pd.factorize(history.titles)  # -1 for a missing title
+    keys = pd.Series(titles, dtype=object).str.casefold().str.replace(TITLE_NOISE, ' ', regex=True).str.strip()
+    key_codes, _ = pd.factorize(keys.mask(keys == ''))  # -1 for titles with no letters
+    key = np.append(key_codes, -1)[title_codes]
+
+    frame = pd.DataFrame({'key': key, 'day': history.days, 'amount': history.amounts,
+                          'category_id': history.category_ids, 'title': title_codes})
+    frame = frame[(key >= 0) & (history.days <= today)].sort_values(['key', 'day'], kind='stable')
+    if frame.empty:
+        return []
+    frame['interval'] = frame.groupby('key')['day'].diff()
+
+    groups = frame.groupby('key')
+    stats = groups.agg(charges=('day', 'size'), last=('day', 'max'), interval=('interval', 'median'),
+                       amount=('amount', 'median'), category_id=('category_id', 'last'), title=('title', 'last'))
+    stats = stats[stats['charges'] >= RECURRING_MIN_CHARGES]
+    if stats.empty:
+        return []
+    frame = frame[frame['key'].isin(stats.index)]
+
+    # Share of intervals near the median interval, and of amounts near the median amount
+    interval = frame['key'].map(stats['interval'])
+    amount = frame['key'].map(stats['amount'])
+    frame = frame.assign(
+        steady_interval=(frame['interval'] - interval).abs() <= np.maximum(RECURRING_SLACK_DAYS, 0.2 * interval),
+        steady_amount=(frame['amount'] - amount).abs() <= RECURRING_AMOUNT_TOLERANCE * amount.abs(),
+    )
+    steady = frame.groupby('key')[['steady_interval', 'steady_amount']].sum()
+    stats = stats.join(steady)
+
+    matches = [stats['interval'].between(shortest, longest) for _, shortest, longest, _ in PERIODS]
+    stats['period'] = np.select(matches, [label for label, _, _, _ in PERIODS], default='')
+    stats['per_month'] = np.select(matches, [per_month for _, _, _, per_month in PERIODS], default=0.0)
+    recurring = stats[
+        (stats['period'] != '')
+        & (stats['steady_interval'] >= RECURRING_REGULARITY * (stats['charges'] - 1))
+        & (stats['steady_amount'] >= RECURRING_REGULARITY * stats['charges'])
+        # Still being charged: the next one isn't long overdue
+        & (today - stats['last'] <= 1.5 * stats['interval'] + RECURRING_SLACK_DAYS)
+    ]
+    recurring = recurring.assign(monthly_cost=recurring['amount'] * recurring['per_month'])
+    recurring = recurring.sort_values('monthly_cost', ascending=False).head(RECURRING_LIMIT)
+
+    return [{
+        'title': str(titles[int(row.title)]),
+        'category': names.get(int(row.category_id), ''),
+        'amount': _money(row.amount),
+        'period': row.period,
+        'interval_days': round(float(row.interval), 1),
+        'charges': int(row.charges),
+        'last_date': _day(row.last),
+        'next_date': _next_charge(row.last, row.period, row.interval),
+        'monthly_cost': _money(row.monthly_cost),
+    } for row in recurring.itertuples()]
+
+
+# ----------------------
+# Compute / Store
+# ----------------------
+def compute_insights(user_id, as_of=None):
+    """One user's insights as a user_insights row (a dict); reads only."""
+    as_of = as_of or date.today()
+    version = db.session.execute(select(User.data_version).where(User.id == user_id)).scalar()
+    names = categories.category_names(user_id)
+    history = load_history(user_id, as_of)
+    category_ids, first_month, totals = monthly_totals(user_id, as_of)
+    return {
+        'user_id': user_id,
+        'as_of': as_of,
+        'data_version': version or 0,
+        'projection': project_month(history, as_of),
+        'anomalies': find_anomalies(category_ids, first_month, totals, names),
+        'recurring': find_recurring(history, as_of, names),
+    }
+
+
+def store(results):
+    """Replace the stored insights of the users in `results`. Does not commit."""
+    if not results:
+        return
+    table = UserInsights.__table__
+    now = datetime.utcnow()
+    db.session.execute(table.delete().where(table.c.user_id.in_([r['user_id'] for r in results])))
+    db.session.execute(insert(table), [dict(r, computed_at=now) for r in results])
+
+
+def stored(user_id):
+    return db.session.get(UserInsights, user_id)
+
+
+def users_to_refresh(as_of, user_id=None, stale_only=False):
+    """Ids of the users a refresh should compute; stale_only skips users refreshed for as_of with no changes since."""
+    users, rows = User.__table__, UserInsights.__table__
+    stmt = select(users.c.id).order_by(users.c.id)
+    if user_id is not None:
+        stmt = stmt.where(users.c.id == user_id)
+    if stale_only:
+        stmt = stmt.outerjoin(rows, rows.c.user_id == users.c.id).where(or_(
+            rows.c.user_id.is_(None), rows.c.as_of < as_of, rows.c.data_version != users.c.data_version))
+    return db.session.execute(stmt).scalars().all()
+
+
+# ----------------------
+# Nightly Batch
+# ----------------------
+# Users are computed in chunks of BATCH_CHUNK, each stored and committed
+# as it completes. With workers > 1 the chunks are computed in a pool of
+# processes (each with its own app and connections) while this process does
+# all the writing, so SQLite still sees a single writer.
+
+_worker_app = None
+
+
+def _start_worker(config):
+    global _worker_app
+    from app import create_app
+    _worker_app = create_app(config)
+    _worker_app.app_context().push()
+
+
+def _compute_chunk(user_ids, as_of):
+    try:
+        return [compute_insights(user_id, as_of) for user_id in user_ids]
+    finally:
+        db.session.remove()
+
+
+def refresh(as_of=None, user_id=None, stale_only=False, workers=0, log=None):
+    """Recompute and store insights (for every user by default); returns the number of users refreshed."""
+    as_of = as_of or date.today()
+    user_ids = users_to_refresh(as_of, user_id, stale_only)
+    chunks = [user_ids[i:i + BATCH_CHUNK] for i in range(0, len(user_ids), BATCH_CHUNK)]
+    db.session.commit()
+
+    def save(results, done):
+        store(results)
+        db.session.commit()
+        if log:
+            log(f'{done}/{len(user_ids)} users')
+
+    done = 0
+    if workers > 1 and len(chunks) > 1:
+        config = {'SQLALCHEMY_DATABASE_URI': current_app.config['SQLALCHEMY_DATABASE_URI'], 'JOB_WORKERS': 0}
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_start_worker, initargs=(config,)) as pool:
+            for results in pool.map(_compute_chunk, chunks, [as_of] * len(chunks)):
+                done += len(results)
+                save(results, done)
+    else:
+        for chunk in chunks:
+            done += len(chunk)
+            save(_compute_chunk(chunk, as_of), done)
+    return done
+
+
+# ----------------------
+# Dashboard Messages
+# ----------------------
+def _category(name):
+    return name or 'Uncategorised'
+
+
+def describe(row, selected_month, goal_amount=None, today=None):
+    """Insight lines for the dashboard from a stored user_insights row (None gives none)."""
+    if row is None:
+        return []
+    today = today or date.today()
+    current = today.strftime('%Y-%m')
+    messages = []
+
+    projection = row.projection or {}
+    if selected_month == current and projection.get('month') == current and projection.get('spent'):
+        line = f"📈 On pace to spend ₹{projection['projected']} this month"
+        if projection['high'] > projection['low']:
+            line += f" (₹{projection['low']}–₹{projection['high']})"
+        if goal_amount and projection['projected'] > goal_amount:
+            line += f", ₹{round(projection['projected'] - goal_amount, 2)} over your goal"
+        messages.append(line + '.')
+
+    for anomaly in row.anomalies or []:
+        if anomaly['month'] == selected_month:
+            messages.append(f"⚠️ {_category(anomaly['category'])} spending is ₹{anomaly['total']}, "
+                            f"well above the usual ₹{anomaly['typical']} a month.")
+
+    recurring = row.recurring or []
+    if recurring and selected_month in (current, 'lifetime'):
+        monthly = round(sum(charge['monthly_cost'] for charge in recurring), 2)
+        top = ', '.join(f"{charge['title']} (₹{charge['amount']} {charge['period']})" for charge in recurring[:3])
+        messages.append(f"🔁 {len(recurring)} recurring charges, about ₹{monthly} a month: {top}.")
+    return messages
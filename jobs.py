@@ -0,0 +1,321 @@
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert, literal, select, update
+from models import db, Job, User, parse_date
+from importer import import_expenses
+from exports import write_excel, write_parquet, write_pdf, describe_period, XLSX_MIMETYPE, PARQUET_MIMETYPE
+from queries import iter_expense_rows, iter_expense_batches, spending_summary
+from cache import dashboard_cache
+from metrics import metrics
+import rollups
+
+# ----------------------
+# Background Jobs
+# ----------------------
+# Imports and exports that can take longer than a request are run on a
+# local thread pool. Job state lives in the `jobs` table so any worker can
+# answer a poll; result files are written to JOB_DIR.
+
+ACTIVE_STATUSES = ('queued', 'running')
+PROGRESS_EVERY = 1000  # rows between progress writes
+STALE_AFTER = timedelta(hours=1)  # for jobs whose owning process can't be checked
+
+
+def _start_time(pid):
+    # Field 22 of /proc/<pid>/stat, so a reused pid isn't taken for the old process
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+
+def process_tag(pid=None):
+    """Identify a process across restarts: "host:pid:start time"."""
+    pid = pid or os.getpid()
+    return f"{socket.gethostname()}:{pid}:{_start_time(pid) or ''}"
+
+
+def process_alive(tag):
+    """Whether the process `tag` names is still running; None if that can't be told from here."""
+    host, pid, started = tag.rsplit(':', 2)
+    if host != socket.gethostname() or not started:
+        return None
+    return _start_time(int(pid)) == started
+
+
+class JobLimitError(Exception):
+    pass
+
+
+class JobRunner:
+    def __init__(self, app=None):
+        self.app = None
+        self.handlers = {}
+        self.executor = None
+        self.progress = {}  # job id -> rows done, for jobs running in this process
+        self.recovered = False
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('JOB_WORKERS', 2)
+        app.config.setdefault('JOB_USER_LIMIT', 2)
+        app.config.setdefault('JOB_DIR', os.path.join(app.instance_path, 'jobs'))
+        app.config.setdefault('JOB_RESULT_TTL', timedelta(hours=24))
+        self.app = app
+        if app.config['JOB_WORKERS'] > 0:
+            self.executor = ThreadPoolExecutor(max_workers=app.config['JOB_WORKERS'],
+                                               thread_name_prefix='fintrack-job')
+        app.extensions['jobs'] = self
+
+    def handler(self, kind):
+        """
+        Register `fn(job, report_progress)` as the runner for a job kind. The
+        handler may return a callable to run once its work has been committed.
+        """
+        def decorator(fn):
+            self.handlers[kind] = fn
+            return fn
+        return decorator
+
+    def job_path(self, job_id, suffix):
+        os.makedirs(self.app.config['JOB_DIR'], exist_ok=True)
+        return os.path.join(self.app.config['JOB_DIR'], f"{job_id}{suffix}")
+
+    def output_path(self, job, suffix):
+        """
+        Path for the job's result file, recorded on the job (and committed)
+        before anything is written, so a file left by a failed or
+        interrupted job is still found and deleted.
+        """
+        job.file_path = self.job_path(job.id, suffix)
+        db.session.commit()
+        return job.file_path
+
+    @staticmethod
+    def new_id():
+        return uuid.uuid4().hex
+
+    # ----------------------
+    # Submit / Poll
+    # ----------------------
+    def submit(self, user_id, kind, params=None, job_id=None):
+        """
+        Queue a job; raises JobLimitError if the user already has too many
+        active. An uploaded input file can be passed as params['upload'] and
+        is deleted once the job finishes.
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind {kind!r}")
+        with self._lock:
+            if not self.recovered:
+                # Once per process: fail interrupted jobs and drop expired ones
+                self.recover()
+                self.purge_expired()
+                self.recovered = True
+            job = self._insert_within_limit(user_id, job_id or self.new_id(), kind, params or {})
+
+        if self.executor is None:
+            self._run(job.id)
+            db.session.refresh(job)
+        else:
+            self.executor.submit(self._run, job.id)
+        return job
+
+    def _insert_within_limit(self, user_id, job_id, kind, params):
+        # Other workers submit too, so the count and the insert are one
+        # statement (atomic under SQLite's write lock), with the user's row
+        # locked first on servers where concurrent inserts could both pass
+        jobs, users = Job.__table__, User.__table__
+        limit = self.app.config['JOB_USER_LIMIT']
+        db.session.execute(select(users.c.id).where(users.c.id == user_id).with_for_update())
+        active = (select(func.count()).select_from(jobs)
+                  .where(jobs.c.user_id == user_id, jobs.c.status.in_(ACTIVE_STATUSES)).scalar_subquery())
+        now = datetime.utcnow()
+        values = {'id': job_id, 'user_id': user_id, 'kind': kind, 'status': 'queued', 'progress': 0,
+                  'params': params, 'worker': process_tag(), 'created_at': now, 'updated_at': now}
+        row = select(*[literal(value, jobs.c[name].type) for name, value in values.items()]).where(active < limit)
+        inserted = db.session.execute(insert(jobs).from_select(list(values), row)).rowcount
+        if not inserted:
+            db.session.rollback()
+            active = Job.query.filter(Job.user_id == user_id, Job.status.in_(ACTIVE_STATUSES)).count()
+            raise JobLimitError(f"You already have {active} jobs running. Try again when one finishes.")
+        db.session.commit()
+        return db.session.get(Job, job_id)
+
+    def current_progress(self, job):
+        return max(job.progress or 0, self.progress.get(job.id, 0))
+
+    def to_dict(self, job):
+        return {
+            'id': job.id,
+            'kind': job.kind,
+            'status': job.status,
+            'progress': self.current_progress(job),
+            'result': job.result,
+            'error': job.error,
+            'created_at': job.created_at.isoformat() if job.created_at else None,
+            'updated_at': job.updated_at.isoformat() if job.updated_at else None,
+        }
+
+    # ----------------------
+    # Execution
+    # ----------------------
+    def _report_progress(self, job_id, rows):
+        self.progress[job_id] = rows
+        # SQLite allows a single writer, and the job's own transaction holds
+        # it, so progress is only persisted on servers with MVCC writes.
+        if db.engine.dialect.name == 'sqlite':
+            return
+        with db.engine.begin() as conn:
+            conn.execute(update(Job.__table__).where(Job.__table__.c.id == job_id)
+                         .values(progress=rows, updated_at=datetime.utcnow()))
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            job = db.session.get(Job, job_id)
+            upload = (job.params or {}).get('upload')
+            job.status = 'running'
+            db.session.commit()
+            try:
+                after_commit = self.handlers[job.kind](job, lambda rows: self._report_progress(job_id, rows))
+                job.status = 'done'
+                job.progress = self.progress.get(job_id, job.progress)
+                db.session.commit()
+                if after_commit:
+                    after_commit()
+            except Exception as e:
+                self.app.logger.exception(f"Job {job_id} ({job.kind}) failed")
+                db.session.rollback()
+                job = db.session.get(Job, job_id)
+                job.status = 'failed'
+                job.error = str(e)
+                # Drop whatever part of the result file was written
+                if job.file_path and os.path.exists(job.file_path):
+                    os.remove(job.file_path)
+                job.file_path = None
+                db.session.commit()
+            finally:
+                self.progress.pop(job_id, None)
+                if upload and os.path.exists(upload):
+                    os.remove(upload)
+                db.session.remove()
+
+    def recover(self):
+        """
+        Mark jobs left active by a process that has exited as failed. Jobs of
+        a live worker are left alone, however long they run; ones whose
+        process can't be checked (another host) fail after STALE_AFTER
+        without an update.
+        """
+        stale = datetime.utcnow() - STALE_AFTER
+        active = db.session.execute(select(Job.id, Job.worker, Job.updated_at)
+                                    .where(Job.status.in_(ACTIVE_STATUSES))).all()
+        interrupted = []
+        for job_id, worker, updated_at in active:
+            alive = process_alive(worker) if worker else None
+            if alive is False or (alive is None and updated_at < stale):
+                interrupted.append(job_id)
+        if interrupted:
+            Job.query.filter(Job.id.in_(interrupted), Job.status.in_(ACTIVE_STATUSES)) \
+                .update({'status': 'failed', 'error': 'Interrupted by a restart'}, synchronize_session=False)
+        db.session.commit()
+
+    def purge_expired(self):
+        """Delete finished jobs (and their result files) older than JOB_RESULT_TTL."""
+        cutoff = datetime.utcnow() - self.app.config['JOB_RESULT_TTL']
+        expired = Job.query.filter(Job.status.notin_(ACTIVE_STATUSES), Job.updated_at < cutoff).all()
+        for job in expired:
+            if job.file_path and os.path.exists(job.file_path):
+                os.remove(job.file_path)
+            db.session.delete(job)
+        db.session.commit()
+        return len(expired)
+
+
+def counting(rows, report_progress, every=PROGRESS_EVERY):
+    """Pass rows through, reporting how many have gone by every `every` rows."""
+    count = 0
+    for row in rows:
+        yield row
+        count += 1
+        if count % every == 0:
+            report_progress(count)
+    report_progress(count)
+
+
+def counting_batches(batches, report_progress):
+    """Pass batches of rows through, reporting the running row count after each."""
+    count = 0
+    for batch in batches:
+        yield batch
+        count += len(batch)
+        report_progress(count)
+    report_progress(count)
+
+
+# ----------------------
+# Job Handlers
+# ----------------------
+runner = JobRunner()
+
+
+def _range(params):
+    return parse_date(params.get('start')), parse_date(params.get('end'))
+
+
+@runner.handler('import')
+def run_import(job, report_progress):
+    with open(job.params['upload'], 'rb') as f:
+        report = import_expenses(job.user_id, f, job.params.get('filename'),
+                                 chunk_size=runner.app.config['IMPORT_CHUNK_SIZE'],
+                                 progress=report_progress)
+    job.result = report.to_dict()
+    metrics.record_import(report, os.path.getsize(job.params['upload']))
+    return lambda: dashboard_cache.invalidate_user(job.user_id)
+
+
+@runner.handler('export_excel')
+def run_export_excel(job, report_progress):
+    start, end = _range(job.params)
+    rows = iter_expense_rows(job.user_id, start, end, batch_size=runner.app.config['EXPORT_BATCH_SIZE'])
+    path = runner.output_path(job, '.xlsx')
+    with open(path, 'wb') as output:
+        write_excel(output, metrics.counted_rows(counting(rows, report_progress), 'xlsx'),
+                    summary=spending_summary(job.user_id, start, end),
+                    per_month=job.params.get('per_month', False))
+        metrics.record_export_file(output, 'xlsx')
+    job.download_name = 'expenses.xlsx'
+    job.mimetype = XLSX_MIMETYPE
+
+
+@runner.handler('export_parquet')
+def run_export_parquet(job, report_progress):
+    start, end = _range(job.params)
+    batches = iter_expense_batches(job.user_id, start, end, batch_size=runner.app.config['EXPORT_BATCH_SIZE'])
+    path = runner.output_path(job, '.parquet')
+    with open(path, 'wb') as output:
+        write_parquet(output, metrics.counted_batches(counting_batches(batches, report_progress), 'parquet'))
+        metrics.record_export_file(output, 'parquet')
+    job.download_name = 'expenses.parquet'
+    job.mimetype = PARQUET_MIMETYPE
+
+
+@runner.handler('export_pdf')
+def run_export_pdf(job, report_progress):
+    start, end = _range(job.params)
+    rows = iter_expense_rows(job.user_id, start, end, batch_size=runner.app.config['EXPORT_BATCH_SIZE'])
+    path = runner.output_path(job, '.pdf')
+    with open(path, 'wb') as output:
+        write_pdf(output, metrics.counted_rows(counting(rows, report_progress), 'pdf'),
+                  spending_summary(job.user_id, start, end), rollups.goal_progress(job.user_id, start, end),
+                  period=describe_period(start, end))
+        metrics.record_export_file(output, 'pdf')
+    job.download_name = 'expenses.pdf'
+    job.mimetype = 'application/pdf'
@@ -0,0 +1,262 @@
+import threading
+import time
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+
+# ----------------------
+# Metrics Registry
+# ----------------------
+# A small in-process registry rendered in the Prometheus text format. Each
+# gunicorn worker keeps its own numbers; scrape every worker (or sum them
+# on the Prometheus side) for fleet-wide totals.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 1000)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key):
+    if not key:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in key) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.values = {}  # label key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, state in self.values.items():
+                for i, bound in enumerate(self.buckets):
+                    out.append((f'{self.name}_bucket', key + (('le', bound),), state[i]))
+                out.append((f'{self.name}_bucket', key + (('le', '+Inf'),), state[-1]))
+                out.append((f'{self.name}_sum', key, state[-2]))
+                out.append((f'{self.name}_count', key, state[-1]))
+        return out
+
+
+class Gauge:
+    """Value(s) read at scrape time: fn() -> iterable of (labels dict, value)."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, fn):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def samples(self):
+        return [(self.name, _label_key(labels), value) for labels, value in self.fn()]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, key, value in metric.samples():
+                if value is None:
+                    continue
+                lines.append(f'{name}{_format_labels(key)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+# ----------------------
+# Request Instrumentation
+# ----------------------
+class Metrics:
+    def __init__(self):
+        self.app = None
+        self.registry = Registry()
+        r = self.registry
+        self.request_seconds = r.register(Histogram(
+            'fintrack_request_duration_seconds', 'Time to build the response, by route.'))
+        self.request_sql_statements = r.register(Histogram(
+            'fintrack_request_sql_statements', 'SQL statements executed per request.', COUNT_BUCKETS))
+        self.request_sql_seconds = r.register(Histogram(
+            'fintrack_request_sql_seconds', 'Time spent in SQL per request.'))
+        self.template_seconds = r.register(Histogram(
+            'fintrack_template_render_seconds', 'Jinja render time, by template.'))
+        self.sql_statements = r.register(Counter(
+            'fintrack_sql_statements_total', 'SQL statements executed, including background jobs.'))
+        self.export_rows = r.register(Counter(
+            'fintrack_export_rows_total', 'Expense rows written to exports, by format.'))
+        self.export_bytes = r.register(Counter(
+            'fintrack_export_bytes_total', 'Bytes of export files produced, by format.'))
+        self.import_rows = r.register(Counter(
+            'fintrack_import_rows_total', 'Imported spreadsheet rows, by outcome.'))
+        self.import_bytes = r.register(Counter(
+            'fintrack_import_bytes_total', 'Bytes of uploaded import files.'))
+        self.batch_items = r.register(Counter(
+            'fintrack_batch_items_total', 'Items applied through the batch API, by outcome.'))
+
+    def init_app(self, app, db):
+        app.config.setdefault('SLOW_REQUEST_MS', None)
+        app.config.setdefault('SLOW_REQUEST_MAX_QUERIES', 20)
+        self.app = app
+        app.extensions['metrics'] = self
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, 'before_cursor_execute', self._before_cursor)
+                event.listen(engine, 'after_cursor_execute', self._after_cursor)
+
+    def add_gauge(self, name, help, fn):
+        # Re-registering (e.g. a second create_app() in tests) replaces the callback
+        self.registry.metrics = [m for m in self.registry.metrics if m.name != name]
+        return self.registry.register(Gauge(name, help, fn))
+
+    def render(self):
+        return self.registry.render()
+
+    # Per-request state lives on flask.g
+    def _before_request(self):
+        g._metrics_start = time.perf_counter()
+        g._metrics_sql = {'count': 0, 'seconds': 0.0, 'statements': []}
+
+    def _after_request(self, response):
+        start = getattr(g, '_metrics_start', None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = request.endpoint or 'unknown'
+        sql = g._metrics_sql
+        self.request_seconds.observe(elapsed, endpoint=endpoint, method=request.method,
+                                     status=response.status_code)
+        self.request_sql_statements.observe(sql['count'], endpoint=endpoint)
+        self.request_sql_seconds.observe(sql['seconds'], endpoint=endpoint)
+
+        slow_ms = self.app.config['SLOW_REQUEST_MS']
+        if slow_ms and elapsed * 1000 >= slow_ms:
+            self._log_slow(endpoint, elapsed, sql)
+        return response
+
+    def _log_slow(self, endpoint, elapsed, sql):
+        worst = sorted(sql['statements'], key=lambda s: s[0], reverse=True)
+        worst = worst[:self.app.config['SLOW_REQUEST_MAX_QUERIES']]
+        lines = [f"Slow request {request.method} {request.path} ({endpoint}): {elapsed * 1000:.1f} ms, "
+                 f"{sql['count']} SQL statements in {sql['seconds'] * 1000:.1f} ms"]
+        for seconds, statement in worst:
+            lines.append(f"  {seconds * 1000:8.1f} ms  {' '.join(statement.split())[:500]}")
+        self.app.logger.warning('\n'.join(lines))
+
+    def _before_render(self, sender, template, context, **extra):
+        if has_request_context():
+            g.setdefault('_metrics_templates', []).append(time.perf_counter())
+
+    def _after_render(self, sender, template, context, **extra):
+        if has_request_context() and g.get('_metrics_templates'):
+            started = g._metrics_templates.pop()
+            self.template_seconds.observe(time.perf_counter() - started, template=template.name or 'string')
+
+    def _before_cursor(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_metrics_query_start', []).append(time.perf_counter())
+
+    def _after_cursor(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get('_metrics_query_start')
+        elapsed = time.perf_counter() - started.pop() if started else 0.0
+        self.sql_statements.inc()
+        if has_request_context() and hasattr(g, '_metrics_sql'):
+            sql = g._metrics_sql
+            sql['count'] += 1
+            sql['seconds'] += elapsed
+            # Only the statements are kept for the slow log, never parameters
+            if self.app.config['SLOW_REQUEST_MS']:
+                sql['statements'].append((elapsed, statement))
+
+    # ----------------------
+    # Import / Export Counters
+    # ----------------------
+    def counted_rows(self, rows, fmt):
+        count = 0
+        try:
+            for row in rows:
+                count += 1
+                yield row
+        finally:
+            self.export_rows.inc(count, format=fmt)
+
+    def counted_batches(self, batches, fmt):
+        for batch in batches:
+            self.export_rows.inc(len(batch), format=fmt)
+            yield batch
+
+    def counted_bytes(self, chunks, fmt):
+        for chunk in chunks:
+            self.export_bytes.inc(len(chunk), format=fmt)
+            yield chunk
+
+    def record_export_file(self, fileobj, fmt):
+        self.export_bytes.inc(fileobj.tell(), format=fmt)
+
+    def record_import(self, report, nbytes=None):
+        self.import_rows.inc(report.inserted, outcome='inserted')
+        self.import_rows.inc(report.duplicates, outcome='duplicate')
+        self.import_rows.inc(report.error_count, outcome='rejected')
+        if nbytes:
+            self.import_bytes.inc(nbytes)
+
+    def record_batch(self, counts):
+        for outcome, count in counts.items():
+            if count:
+                self.batch_items.inc(count, outcome=outcome)
+
+
+metrics = Metrics()
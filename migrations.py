@@ -0,0 +1,422 @@
+from datetime import date
+from sqlalchemy import Date, bindparam, inspect, text
+from models import (db, User, Category, Expense, ExpenseArchive, ExpenseTombstone, Job, MonthlyRollup, parse_date,
+                    category_key, category_name)
+import partitions
+import rollups
+import search
+import sync
+
+# ----------------------
+# Schema Migrations
+# ----------------------
+# Hand-rolled, idempotent migrations for databases created before a model
+# change. Each one is exposed as a `flask --app app <name>` command.
+#
+# Upgrading an existing database: run `init-db` (creates the new tables),
+# then the migrations pending_migrations() lists, in that order, then `init-db`
+# again to fill the rollup table and the search index.
+
+BATCH_SIZE = 5000
+
+
+def _column_type(table, column):
+    for col in inspect(db.engine).get_columns(table):
+        if col['name'] == column:
+            return col['type']
+    return None
+
+
+def _columns(table):
+    return {col['name'] for col in inspect(db.engine).get_columns(table)}
+
+
+def _has_index(table, name):
+    return any(ix['name'] == name for ix in inspect(db.engine).get_indexes(table))
+
+
+def _create_index(model, name, log):
+    if _has_index(model.__tablename__, name):
+        log(f"{name} already exists")
+        return
+    for index in model.__table__.indexes:
+        if index.name == name:
+            index.create(db.engine)
+    log(f"{name} created")
+
+
+def _add_column(conn, model, name):
+    """ALTER TABLE ... ADD COLUMN from the model's definition of the column."""
+    column = model.__table__.c[name]
+    ddl = f'ALTER TABLE {model.__tablename__} ADD COLUMN {name} {column.type.compile(conn.dialect)}'
+    if column.server_default is not None:
+        ddl += f" NOT NULL DEFAULT {column.server_default.arg}"
+    conn.execute(text(ddl))
+
+
+def pending_migrations():
+    """The migration commands the database still needs, in the order to run them."""
+    if not inspect(db.engine).has_table('expenses'):
+        return []
+    needed = []
+    if inspect(db.engine).has_table('jobs') and 'worker' not in _columns('jobs'):
+        needed.append('migrate-job-workers')
+    columns = _columns('expenses')
+    if not isinstance(_column_type('expenses', 'date'), Date):
+        needed.append('migrate-expense-dates')
+    if 'category' in columns or 'category_id' not in columns:
+        needed.append('migrate-categories')
+    if 'version' not in columns:
+        needed.append('migrate-data-versions')
+    if 'content_hash' not in columns:
+        needed.append('migrate-content-hashes')
+    with db.engine.connect() as conn:
+        if partitions.reuses_ids(conn):
+            needed.append('migrate-expense-ids')
+    return needed
+
+
+def migrate_expense_dates(dry_run=False, default_date=None, log=print):
+    """
+    Convert expenses.date from free-text strings to a DATE column.
+
+    Every stored value is parsed with the same rules the app uses for new
+    input. Unparseable values abort the migration (and are listed) unless
+    `default_date` is given, in which case they are set to that date.
+    """
+    col_type = _column_type('expenses', 'date')
+    if col_type is None:
+        raise RuntimeError("expenses.date column not found")
+
+    if isinstance(col_type, Date):
+        log("expenses.date is already a DATE column")
+    else:
+        parsed, invalid = [], []
+        with db.engine.connect() as conn:
+            result = conn.execution_options(yield_per=BATCH_SIZE).execute(
+                text('SELECT id, "date" FROM expenses')
+            )
+            for row_id, raw in result:
+                value = parse_date(raw)
+                if value is None:
+                    invalid.append((row_id, raw))
+                    value = default_date
+                parsed.append({'row_id': row_id, 'value': value})
+
+        log(f"{len(parsed)} rows scanned, {len(invalid)} with unreadable dates")
+        for row_id, raw in invalid[:50]:
+            log(f"  id={row_id}: {raw!r}")
+        if invalid and default_date is None:
+            raise RuntimeError(
+                "Unreadable dates found; fix them or pass a default date to backfill them"
+            )
+        if dry_run:
+            log("Dry run, no changes written")
+            return
+
+        with db.engine.begin() as conn:
+            conn.execute(text('ALTER TABLE expenses ADD COLUMN date_parsed DATE'))
+            update = text('UPDATE expenses SET date_parsed = :value WHERE id = :row_id').bindparams(
+                bindparam('value', type_=Date())
+            )
+            for i in range(0, len(parsed), BATCH_SIZE):
+                conn.execute(update, parsed[i:i + BATCH_SIZE])
+            conn.execute(text('ALTER TABLE expenses DROP COLUMN "date"'))
+            conn.execute(text('ALTER TABLE expenses RENAME COLUMN date_parsed TO "date"'))
+        log("expenses.date converted to DATE")
+
+    if dry_run:
+        return
+    index_name = 'ix_expenses_user_id_date'
+    if _has_index('expenses', index_name):
+        log(f"{index_name} already exists")
+    else:
+        for index in Expense.__table__.indexes:
+            if index.name == index_name:
+                index.create(db.engine)
+        log(f"{index_name} created")
+
+
+def _rebuild_rollups():
+    # Rebuilds read expenses_archive too, which databases this old don't have yet
+    ExpenseArchive.__table__.create(db.engine, checkfirst=True)
+    MonthlyRollup.__table__.create(db.engine)
+    rollups.rebuild()
+    db.session.commit()
+
+
+def migrate_categories(log=print):
+    """
+    Move expenses.category strings into the categories table.
+
+    Spellings that differ only in case or whitespace become one category,
+    named after the earliest expense that used it. Blank categories become
+    NULL. monthly_rollups is rebuilt on category ids and the search index
+    is recreated, since both depended on the old column.
+    """
+    columns = _columns('expenses')
+    converted = 'category' in columns
+    if not converted:
+        log("expenses.category has already been migrated")
+    else:
+        with db.engine.begin() as conn:
+            Category.__table__.create(conn, checkfirst=True)
+            # The search triggers and view name expenses.category
+            search.drop(conn)
+            if 'category_id' not in columns:
+                conn.execute(text('ALTER TABLE expenses ADD COLUMN category_id INTEGER REFERENCES categories(id)'))
+
+            # Distinct spellings per user, earliest first, so the first one seen names the category
+            spellings = conn.execute(text(
+                "SELECT user_id, category, min(id) AS first_id FROM expenses "
+                "WHERE category IS NOT NULL GROUP BY user_id, category ORDER BY first_id"
+            )).all()
+            names = {}  # (user_id, key) -> name
+            for user_id, raw, _ in spellings:
+                key = category_key(raw)
+                if key:
+                    names.setdefault((user_id, key), category_name(raw))
+            existing = {(user_id, key) for user_id, key in conn.execute(text('SELECT user_id, "key" FROM categories'))}
+            new = [{'user_id': user_id, 'key': key, 'name': name}
+                   for (user_id, key), name in names.items() if (user_id, key) not in existing]
+            for i in range(0, len(new), BATCH_SIZE):
+                conn.execute(Category.__table__.insert(), new[i:i + BATCH_SIZE])
+            ids = {(user_id, key): category_id for category_id, user_id, key in
+                   conn.execute(text('SELECT id, user_id, "key" FROM categories'))}
+            log(f"{len(spellings)} spellings mapped to {len(names)} categories ({len(new)} new)")
+
+            # One set-based UPDATE through a temporary (user_id, spelling) -> id map
+            conn.execute(text('CREATE TEMPORARY TABLE category_map ('
+                              'user_id INTEGER NOT NULL, raw VARCHAR(100) NOT NULL, category_id INTEGER NOT NULL, '
+                              'PRIMARY KEY (user_id, raw))'))
+            mapping = [{'user_id': user_id, 'raw': raw, 'category_id': ids[(user_id, category_key(raw))]}
+                       for user_id, raw, _ in spellings if category_key(raw)]
+            for i in range(0, len(mapping), BATCH_SIZE):
+                conn.execute(text('INSERT INTO category_map (user_id, raw, category_id) '
+                                  'VALUES (:user_id, :raw, :category_id)'), mapping[i:i + BATCH_SIZE])
+            updated = conn.execute(text(
+                'UPDATE expenses SET category_id = (SELECT m.category_id FROM category_map m '
+                'WHERE m.user_id = expenses.user_id AND m.raw = expenses.category) '
+                'WHERE category IS NOT NULL'
+            )).rowcount
+            conn.execute(text('DROP TABLE category_map'))
+            conn.execute(text('ALTER TABLE expenses DROP COLUMN category'))
+        log(f"{updated} expenses pointed at their category")
+
+    if not inspect(db.engine).has_table('monthly_rollups'):
+        _rebuild_rollups()
+        log("monthly_rollups created from expenses")
+    elif 'category' in _columns('monthly_rollups'):
+        MonthlyRollup.__table__.drop(db.engine)
+        _rebuild_rollups()
+        log("monthly_rollups rebuilt on category ids")
+    elif converted:
+        # Created (by init-db) before the expenses had category ids to group on
+        rollups.rebuild()
+        db.session.commit()
+        log("monthly_rollups rebuilt from the converted expenses")
+
+    _create_index(Expense, 'ix_expenses_user_id_category_id', log)
+
+    search.install(log=log)
+    db.session.commit()
+
+
+def migrate_data_versions(log=print):
+    """
+    Add users.data_version/data_changed_at/sync_floor, expenses.version and
+    the expense_tombstones table. Existing expenses start at version 0, so
+    the first sync of every client still picks them up.
+    """
+    with db.engine.begin() as conn:
+        for model, names in ((User, ('data_version', 'data_changed_at', 'sync_floor')), (Expense, ('version',))):
+            existing = _columns(model.__tablename__)
+            for name in names:
+                if name in existing:
+                    log(f"{model.__tablename__}.{name} already exists")
+                else:
+                    _add_column(conn, model, name)
+                    log(f"{model.__tablename__}.{name} added")
+        ExpenseTombstone.__table__.create(conn, checkfirst=True)
+    _create_index(Expense, 'ix_expenses_user_id_version', log)
+
+
+def migrate_content_hashes(log=print):
+    """
+    Add expenses.content_hash, hash every existing expense the way imports
+    do and create the unique (user_id, content_hash) index. Rows are hashed
+    per user in id order, so re-uploading a file that was imported before
+    the migration matches the rows it created.
+    """
+    import pandas as pd
+    from importer import content_hashes
+
+    if 'content_hash' in _columns('expenses'):
+        log("expenses.content_hash already exists")
+    else:
+        with db.engine.begin() as conn:
+            _add_column(conn, Expense, 'content_hash')
+            user_ids = conn.execute(text('SELECT DISTINCT user_id FROM expenses')).scalars().all()
+            update = text('UPDATE expenses SET content_hash = :content_hash WHERE id = :row_id')
+            hashed = 0
+            page = text(
+                'SELECT e.id, e.title, c.name AS category, e.amount, e."date" FROM expenses e '
+                'LEFT JOIN categories c ON c.id = e.category_id '
+                'WHERE e.user_id = :user_id AND e.id > :after ORDER BY e.id LIMIT :limit')
+            for user_id in user_ids:
+                seen, after = {}, 0
+                while True:
+                    rows = conn.execute(page, {'user_id': user_id, 'after': after, 'limit': BATCH_SIZE}).all()
+                    if not rows:
+                        break
+                    records = pd.DataFrame(rows, columns=['id', 'title', 'category', 'amount', 'date'])
+                    records['amount'] = records['amount'].fillna(0.0)
+                    conn.execute(update, [{'content_hash': content_hash, 'row_id': int(row_id)} for row_id, content_hash
+                                          in zip(records['id'], content_hashes(records, seen))])
+                    hashed += len(rows)
+                    after = rows[-1].id
+            log(f"{hashed} expenses hashed for {len(user_ids)} users")
+    _create_index(Expense, 'ix_expenses_user_id_content_hash', log)
+
+
+def migrate_job_workers(log=print):
+    """Add jobs.worker, the process that owns a queued or running job."""
+    if 'worker' in _columns('jobs'):
+        log("jobs.worker already exists")
+        return
+    with db.engine.begin() as conn:
+        _add_column(conn, Job, 'worker')
+    log("jobs.worker added")
+
+
+def _partition_by_month(conn, model, through, log):
+    """Rebuild `model`'s table as PARTITION BY RANGE (date), with monthly partitions up to `through`."""
+    name = model.__tablename__
+    if partitions.is_partitioned(conn, name):
+        log(f"{name} is already partitioned")
+        return
+    if conn.execute(text(f'SELECT 1 FROM {name} WHERE "date" IS NULL LIMIT 1')).first():
+        raise RuntimeError(f"{name} has rows without a date; run migrate-expense-dates --default-date first")
+    old = f'{name}_unpartitioned'
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {'table': name}).scalar()
+    conn.execute(text(f'ALTER TABLE {name} RENAME TO {old}'))
+    conn.execute(text(f'ALTER TABLE {old} RENAME CONSTRAINT {name}_pkey TO {old}_pkey'))
+    for index in model.__table__.indexes:
+        conn.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+
+    conn.execute(text(f'CREATE TABLE {name} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE ("date")'))
+    # A partitioned table's primary key and unique indexes must include the date
+    conn.execute(text(
+        f'ALTER TABLE {name} ALTER COLUMN "date" SET NOT NULL, ADD PRIMARY KEY (id, "date"), '
+        f'ADD FOREIGN KEY (user_id) REFERENCES users (id), '
+        f'ADD FOREIGN KEY (category_id) REFERENCES categories (id)'))
+    if sequence:
+        conn.execute(text(f'ALTER SEQUENCE {sequence} OWNED BY {name}.id'))
+    for index in model.__table__.indexes:
+        columns = [column.name for column in index.columns]
+        if index.unique and 'date' not in columns:
+            # The content hash covers the date, so (user_id, content_hash, date) is just as strict
+            columns.append('date')
+        listed = ', '.join(f'"{column}"' for column in columns)
+        conn.execute(text(f'CREATE {"UNIQUE " if index.unique else ""}INDEX {index.name} ON {name} ({listed})'))
+    conn.execute(text(f'CREATE TABLE {name}_default PARTITION OF {name} DEFAULT'))
+
+    # A partition per month from the oldest row to the newest, or to `through`
+    days = [day for day in conn.execute(text(f'SELECT min("date"), max("date") FROM {old}')).one() if day]
+    if through:
+        days += [date.today(), through]
+    month = partitions.add_months(min(days), 0) if days else None
+    while month and month <= max(days):
+        partitions.add_partition(conn, name, month)
+        month = partitions.add_months(month, 1)
+
+    listed = ', '.join(f'"{column}"' for column in partitions.COLUMNS)
+    copied = conn.execute(text(f'INSERT INTO {name} ({listed}) SELECT {listed} FROM {old}')).rowcount
+    conn.execute(text(f'DROP TABLE {old}'))
+    log(f"{name} partitioned by month ({copied} rows copied)")
+
+
+def migrate_partitioned_expenses(log=print):
+    """
+    Turn expenses and expenses_archive into tables partitioned by month
+    (PostgreSQL only). Every row is copied once inside one transaction, so
+    run it while the app is quiet. Afterwards `flask partitions compact`
+    archives cold months by moving whole partitions.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        log("Monthly partitions need PostgreSQL; on SQLite `flask partitions compact` "
+            "archives cold months without them")
+        return
+    through = partitions.add_months(date.today(), partitions.MONTHS_AHEAD)
+    with db.engine.begin() as conn:
+        ExpenseArchive.__table__.create(conn, checkfirst=True)
+        # The trigram indexes are recreated on the new tables below
+        search.drop(conn)
+        _partition_by_month(conn, Expense, through, log)
+        _partition_by_month(conn, ExpenseArchive, None, log)
+    search.install(log=log)
+    db.session.commit()
+
+
+def _renumber_reused_ids(conn, next_id, log):
+    """
+    Give expenses that took the id of an archived one a fresh id. Both rows
+    get a new version so sync clients, which saw them under one id, fetch
+    them again. Returns the next free id.
+    """
+    taken = conn.execute(text(
+        'SELECT e.id, e.user_id, a.user_id FROM expenses e JOIN expenses_archive a ON a.id = e.id ORDER BY e.id')).all()
+    for expense_id, user_id, archived_user_id in taken:
+        conn.execute(text('UPDATE expenses SET id = :new_id, version = :version WHERE id = :expense_id'),
+                     {'new_id': next_id, 'version': sync.bump(user_id), 'expense_id': expense_id})
+        conn.execute(text('UPDATE expenses_archive SET version = :version WHERE id = :expense_id'),
+                     {'version': sync.bump(archived_user_id), 'expense_id': expense_id})
+        if archived_user_id != user_id:
+            # This user's clients know the row by the old id, which isn't theirs anymore
+            sync.record_deletes(user_id, [expense_id])
+        next_id += 1
+    if taken:
+        search.rebuild()
+        log(f"{len(taken)} expenses that reused an archived id renumbered")
+    return next_id
+
+
+def migrate_expense_ids(log=print):
+    """
+    Rebuild expenses with AUTOINCREMENT (SQLite), so a new expense never
+    gets the id of an archived or deleted one, and renumber any that
+    already did. PostgreSQL ids come from a sequence and are never reused.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        log("expenses.id comes from a sequence; nothing to do")
+        return
+    missing = {column.name for column in Expense.__table__.c} - _columns('expenses')
+    if missing:
+        raise RuntimeError(f"expenses has no {', '.join(sorted(missing))} column yet; run the earlier migrations first")
+
+    conn = db.session.connection()
+    ExpenseArchive.__table__.create(conn, checkfirst=True)
+    if not partitions.reuses_ids(conn):
+        log("expenses already uses AUTOINCREMENT")
+    else:
+        # The search view and triggers name the table; install() recreates them
+        search.drop(conn)
+        conn.execute(text('ALTER TABLE expenses RENAME TO expenses_reused_ids'))
+        for index in Expense.__table__.indexes:
+            conn.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+        Expense.__table__.create(conn)
+        listed = ', '.join(f'"{column}"' for column in partitions.COLUMNS)
+        copied = conn.execute(text(f'INSERT INTO expenses ({listed}) SELECT {listed} FROM expenses_reused_ids')).rowcount
+        conn.execute(text('DROP TABLE expenses_reused_ids'))
+        search.install(log=log)
+        log(f"expenses rebuilt with AUTOINCREMENT ({copied} rows copied)")
+
+    # Start past every id handed out so far, archived and deleted ones included
+    last_id = conn.execute(text(
+        "SELECT max(coalesce((SELECT seq FROM sqlite_sequence WHERE name = 'expenses'), 0), "
+        "coalesce((SELECT max(id) FROM expenses), 0), coalesce((SELECT max(id) FROM expenses_archive), 0), "
+        "coalesce((SELECT max(expense_id) FROM expense_tombstones), 0))")).scalar()
+    last_id = _renumber_reused_ids(conn, last_id + 1, log) - 1
+    conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'expenses'"))
+    conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('expenses', :seq)"), {'seq': last_id})
+    db.session.commit()
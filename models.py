@@ -0,0 +1,236 @@
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import declared_attr
+from datetime import date, datetime
+
+db = SQLAlchemy()
+
+
+# ----------------------
+# Database Models
+# ----------------------
+class User(db.Model):
+    __tablename__ = 'users'
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(100), unique=True, nullable=False)
+    password = db.Column(db.String(100), nullable=False)
+    # Bumped by every expense/goal write (see sync.py); drives ETags and delta sync
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    data_changed_at = db.Column(db.DateTime)
+    # Highest version whose tombstones have been pruned; older sync cursors must resync
+    sync_floor = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    expenses = db.relationship('Expense', backref='user', lazy=True)
+    goals = db.relationship('Goal', backref='user', lazy=True)
+
+
+class Category(db.Model):
+    # One row per distinct category per user; expenses point at it by id.
+    # `key` is the normalised spelling (see category_key) that makes
+    # "Food", "food " and "FOOD" the same category; `name` is the first
+    # spelling seen and is what gets displayed.
+    __tablename__ = 'categories'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    key = db.Column(db.String(100), nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key', name='uq_categories_user_id_key'),
+    )
+
+
+class ExpenseColumns:
+    # Columns shared by expenses and expenses_archive (see partitions.py)
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(100))
+    amount = db.Column(db.Float)
+    date = db.Column(db.Date)
+    # The user's data_version as of this row's last insert/update
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Fingerprint of the row's content (see importer.content_hashes) so a
+    # file uploaded twice isn't imported twice. Set on every insert and
+    # recomputed on every edit, whether by import, form or batch API.
+    content_hash = db.Column(db.String(32))
+
+    @declared_attr
+    def user_id(cls):
+        return db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+
+    @declared_attr
+    def category_id(cls):
+        # NULL means uncategorised
+        return db.Column(db.Integer, db.ForeignKey('categories.id'))
+
+    @declared_attr
+    def category_ref(cls):
+        return db.relationship('Category', lazy='joined')
+
+    @property
+    def category(self):
+        return self.category_ref.name if self.category_ref else ''
+
+
+class Expense(ExpenseColumns, db.Model):
+    __tablename__ = 'expenses'
+
+    # Every dashboard/export query is "this user, this date range"
+    __table_args__ = (
+        db.Index('ix_expenses_user_id_date', 'user_id', 'date'),
+        db.Index('ix_expenses_user_id_category_id', 'user_id', 'category_id'),
+        # Sync pages seek (user_id, version) and then walk ids within a version
+        db.Index('ix_expenses_user_id_version', 'user_id', 'version', 'id'),
+        db.Index('ix_expenses_user_id_content_hash', 'user_id', 'content_hash', unique=True),
+        # Without AUTOINCREMENT SQLite hands out max(id) + 1 again, which can be
+        # the id of an archived or deleted expense (see migrate-expense-ids)
+        {'sqlite_autoincrement': True},
+    )
+
+
+class ExpenseArchive(ExpenseColumns, db.Model):
+    # Cold months moved out of expenses by `flask partitions compact`. Rows
+    # keep their ids, so the id is never generated here.
+    __tablename__ = 'expenses_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+
+    # Only the reads that reach old months: history pages, sync and import dedup
+    __table_args__ = (
+        db.Index('ix_expenses_archive_user_id_date', 'user_id', 'date'),
+        db.Index('ix_expenses_archive_user_id_version', 'user_id', 'version', 'id'),
+        db.Index('ix_expenses_archive_user_id_content_hash', 'user_id', 'content_hash'),
+    )
+
+
+class ExpenseTombstone(db.Model):
+    # One row per deleted expense so sync clients can learn about deletes.
+    # `version` is the user's data_version of the deleting write.
+    __tablename__ = 'expense_tombstones'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    expense_id = db.Column(db.Integer, nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_expense_tombstones_user_id_version', 'user_id', 'version', 'expense_id'),
+    )
+
+
+class Goal(db.Model):
+    __tablename__ = 'goals'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    month = db.Column(db.String(20))
+    amount = db.Column(db.Float)
+
+
+class MonthlyRollup(db.Model):
+    # Per-user, per-month, per-category spend, kept in step with expenses
+    # by rollups.apply_deltas() in the same transaction as each write.
+    # category_id 0 stands for uncategorised (primary keys can't be NULL).
+    __tablename__ = 'monthly_rollups'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    month = db.Column(db.String(7), primary_key=True)
+    category_id = db.Column(db.Integer, primary_key=True)
+    total = db.Column(db.Float, nullable=False, default=0.0)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class UserInsights(db.Model):
+    # Spending insights precomputed by `flask insights refresh` (see
+    # insights.py), one row per user. data_version is the user's version
+    # the row was computed from, so a refresh can skip unchanged users.
+    __tablename__ = 'user_insights'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    as_of = db.Column(db.Date, nullable=False)
+    data_version = db.Column(db.Integer, nullable=False, default=0)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    projection = db.Column(db.JSON)
+    anomalies = db.Column(db.JSON)
+    recurring = db.Column(db.JSON)
+
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    kind = db.Column(db.String(30), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    params = db.Column(db.JSON)
+    result = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    file_path = db.Column(db.String(500))
+    download_name = db.Column(db.String(200))
+    mimetype = db.Column(db.String(100))
+    # "host:pid:start time" of the process that queued (and runs) the job,
+    # so a restart only fails jobs whose process is gone
+    worker = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_jobs_user_id_status', 'user_id', 'status'),
+    )
+
+
+# ----------------------
+# Date Helpers
+# ----------------------
+# Formats seen in form posts and spreadsheets (pandas renders cells as
+# "2025-10-27 00:00:00" when the column is parsed as datetime)
+DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y/%m/%d', '%d-%m-%Y', '%d/%m/%Y')
+
+
+def parse_date(value):
+    """Coerce a form/spreadsheet value to a date, or None if it can't be read."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value).strip()
+    if not text or text.lower() in ('nan', 'nat', 'none'):
+        return None
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def month_range(month):
+    """Half-open [start, end) bounds for a 'YYYY-MM' month string."""
+    start = datetime.strptime(month, '%Y-%m').date()
+    if start.month == 12:
+        end = date(start.year + 1, 1, 1)
+    else:
+        end = date(start.year, start.month + 1, 1)
+    return start, end
+
+
+def date_filter(query, start=None, end=None, model=Expense):
+    """Restrict an Expense (or ExpenseArchive) query to start <= date < end (either bound optional)."""
+    if start is not None:
+        query = query.filter(model.date >= start)
+    if end is not None:
+        query = query.filter(model.date < end)
+    return query
+
+
+# ----------------------
+# Category Helpers
+# ----------------------
+CATEGORY_LIMIT = 100  # categories.name/key column width
+
+
+def category_name(value):
+    """Display form of a category: surrounding and repeated whitespace removed."""
+    if value is None:
+        return ''
+    return ' '.join(str(value).split())[:CATEGORY_LIMIT]
+
+
+def category_key(value):
+    """Normalised form two spellings must share to be the same category."""
+    return category_name(value).casefold()[:CATEGORY_LIMIT]
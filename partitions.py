@@ -0,0 +1,282 @@
+import re
+from datetime import date
+from sqlalchemy import and_, func, insert, select, text, union_all
+from models import db, Expense, ExpenseArchive
+
+# ----------------------
+# Expense Partitions
+# ----------------------
+# Expenses live in two tables with the same columns: `expenses` holds the
+# recent ("hot") months that the dashboard, imports and edits work on, and
+# `expenses_archive` holds the cold months `flask partitions compact` has
+# moved out. Moving a row changes nothing about it, so monthly rollups,
+# versions, ETags and cached pages all stay valid.
+#
+#   PostgreSQL  after `flask migrate-partitions` both tables are partitioned
+#               by month (PARTITION BY RANGE (date)), with a DEFAULT
+#               partition for dates outside them. Compacting a month
+#               detaches its partition from expenses and attaches it to
+#               expenses_archive, which moves no rows. Compaction also
+#               creates the next MONTHS_AHEAD partitions.
+#   SQLite      compacting moves rows with INSERT ... SELECT and DELETE,
+#               COMPACT_BATCH rows per transaction. The search triggers
+#               skip rows that are only moving (see search.py).
+#
+# Reads that can reach archived months (history pages, exports, search,
+# sync, import dedup, rollup rebuilds) cover both tables; when a user has
+# nothing archived in the range that costs one index probe. Archived rows
+# are not edited in place: restore() moves them back into expenses first.
+
+COMPACT_BATCH = 5000  # rows moved per transaction on SQLite
+IN_CHUNK = 900  # ids per IN list; stays under SQLite's bound-parameter limit
+MONTHS_AHEAD = 3  # PostgreSQL partitions created past the current month
+COLUMNS = [column.name for column in Expense.__table__.c]
+
+BOUND = re.compile(r"FROM \('([\d-]+)'\) TO \('([\d-]+)'\)")
+
+
+def add_months(day, months):
+    """First day of the month `months` after (or before) day's month."""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def archive_before(today, keep_months):
+    """First day of the oldest month compaction keeps in expenses."""
+    return add_months(today, 1 - keep_months)
+
+
+# ----------------------
+# Reads
+# ----------------------
+def _in_range(stmt, table, user_id, start, end):
+    if user_id is not None:
+        stmt = stmt.where(table.c.user_id == user_id)
+    if start is not None:
+        stmt = stmt.where(table.c.date >= start)
+    if end is not None:
+        stmt = stmt.where(table.c.date < end)
+    return stmt
+
+
+def archived(user_id=None, start=None, end=None):
+    """Whether expenses_archive holds any of the user's expenses in [start, end)."""
+    table = ExpenseArchive.__table__
+    stmt = _in_range(select(table.c.id), table, user_id, start, end)
+    return db.session.execute(stmt.limit(1)).first() is not None
+
+
+def newest_archived(user_id, start=None, end=None):
+    """Date of the user's newest archived expense in [start, end), or None if there is none."""
+    table = ExpenseArchive.__table__
+    return db.session.execute(_in_range(select(func.max(table.c.date)), table, user_id, start, end)).scalar()
+
+
+def archive_first(user_id, start=None, end=None):
+    """
+    Whether every archived expense of the user's in [start, end) is dated
+    before every one still in expenses, so a read in date order can take
+    the archive and then expenses instead of merging them. That is the
+    usual case; rows dated into archived months later break it.
+    """
+    hot = Expense.__table__
+    newest = newest_archived(user_id, start, end)
+    oldest = db.session.execute(_in_range(select(func.min(hot.c.date)), hot, user_id, start, end)).scalar()
+    if newest is not None and oldest is not None and newest >= oldest:
+        return False
+    # Undated rows sort first on SQLite; they only match an unbounded read
+    if start is None and end is None:
+        undated = select(hot.c.id).where(hot.c.user_id == user_id, hot.c.date.is_(None)).limit(1)
+        return db.session.execute(undated).first() is None
+    return True
+
+
+def expense_models(user_id, start=None, end=None):
+    """The models a read of the user's expenses in [start, end) has to query."""
+    if archived(user_id, start, end):
+        return (Expense, ExpenseArchive)
+    return (Expense,)
+
+
+def expense_table(user_id=None, start=None, end=None):
+    """
+    `expenses`, or `expenses UNION ALL expenses_archive` under the same name
+    and column names when the read reaches archived rows. For aggregates;
+    callers still apply their own filters, which also works on the table.
+    """
+    if not archived(user_id, start, end):
+        return Expense.__table__
+    parts = []
+    for model in (Expense, ExpenseArchive):
+        table = model.__table__
+        parts.append(_in_range(select(*[table.c[name] for name in COLUMNS]), table, user_id, start, end))
+    return union_all(*parts).subquery('expenses')
+
+
+def find_expense(user_id, expense_id):
+    """The user's expense with this id, from expenses or the archive, or None."""
+    for model in (Expense, ExpenseArchive):
+        expense = model.query.filter_by(id=expense_id, user_id=user_id).first()
+        if expense:
+            return expense
+    return None
+
+
+# ----------------------
+# Moving Rows
+# ----------------------
+def _move(source, target, condition):
+    """Move the rows of `source` matching `condition` into `target`; returns how many."""
+    src = source.__table__
+    copied = db.session.execute(insert(target.__table__).from_select(
+        COLUMNS, select(*[src.c[name] for name in COLUMNS]).where(condition))).rowcount
+    if copied:
+        db.session.execute(src.delete().where(condition))
+    return copied
+
+
+def restore(user_id, ids):
+    """
+    Move any of the user's expenses among `ids` that are archived back into
+    expenses, so the usual write paths find them. Does not commit.
+    """
+    table = ExpenseArchive.__table__
+    ids = list(ids)
+    restored = 0
+    for i in range(0, len(ids), IN_CHUNK):
+        restored += _move(ExpenseArchive, Expense,
+                          and_(table.c.user_id == user_id, table.c.id.in_(ids[i:i + IN_CHUNK])))
+    return restored
+
+
+def _move_rows(before, batch_size, log):
+    # Walk expenses in id order so each batch picks up where the last one
+    # stopped instead of rescanning the rows it kept
+    table = Expense.__table__
+    last_id, moved = 0, 0
+    while True:
+        ids = db.session.execute(
+            select(table.c.id).where(table.c.id > last_id, table.c.date < before)
+            .order_by(table.c.id).limit(batch_size)).scalars().all()
+        if not ids:
+            return moved
+        moved += _move(Expense, ExpenseArchive,
+                       and_(table.c.id >= ids[0], table.c.id <= ids[-1], table.c.date < before))
+        db.session.commit()
+        last_id = ids[-1]
+        log(f'Archived {moved} rows')
+
+
+def reuses_ids(conn):
+    """
+    Whether expenses was created without AUTOINCREMENT (SQLite), so a new
+    expense could take the id of one that has been archived.
+    """
+    if conn.dialect.name != 'sqlite':
+        return False
+    sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'expenses'")).scalar()
+    return 'AUTOINCREMENT' not in (sql or '').upper()
+
+
+def compact(before, batch_size=COMPACT_BATCH, log=None):
+    """
+    Move every expense dated before `before` (a month start) into
+    expenses_archive, committing as it goes. Returns the number of rows moved.
+    """
+    log = log or (lambda message: None)
+    if reuses_ids(db.session.connection()):
+        raise RuntimeError('expenses would reuse archived ids; run `flask migrate-expense-ids` first')
+    moved = 0
+    if is_partitioned(db.session.connection(), 'expenses'):
+        ensure_partitions(db.session.connection(), date.today())
+        db.session.commit()
+        moved += _move_partitions(before, log)
+    # SQLite, and rows in PostgreSQL's default partition
+    return moved + _move_rows(before, batch_size, log)
+
+
+def status():
+    """(table, rows, oldest date, newest date, partitions) for both expense tables."""
+    conn = db.session.connection()
+    rows = []
+    for model in (Expense, ExpenseArchive):
+        table = model.__table__
+        count, oldest, newest = db.session.execute(
+            select(func.count(), func.min(table.c.date), func.max(table.c.date)).select_from(table)).one()
+        months = len(month_partitions(conn, table.name)) if is_partitioned(conn, table.name) else None
+        rows.append((table.name, count, oldest, newest, months))
+    return rows
+
+
+# ----------------------
+# PostgreSQL Partitions
+# ----------------------
+def is_partitioned(conn, table):
+    if conn.dialect.name != 'postgresql':
+        return False
+    return conn.execute(text('SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:name)'),
+                        {'name': table}).first() is not None
+
+
+def month_partitions(conn, table):
+    """(name, start, end) of each monthly partition of `table`, oldest first; not the default one."""
+    rows = conn.execute(text(
+        'SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i '
+        'JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(:name)'), {'name': table})
+    found = []
+    for name, bound in rows:
+        match = BOUND.search(bound or '')
+        if match:
+            found.append((name, date.fromisoformat(match.group(1)), date.fromisoformat(match.group(2))))
+    return sorted(found, key=lambda partition: partition[1])
+
+
+def add_partition(conn, table, start):
+    """
+    Create and attach `table`'s partition for the month starting at `start`,
+    taking over any of its rows that had landed in the default partition.
+    """
+    end = add_months(start, 1)
+    name = f'{table}_{start:%Y_%m}'
+    columns = ', '.join(f'"{column}"' for column in COLUMNS)
+    conn.execute(text(f'CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+    conn.execute(text(
+        f'WITH moved AS (DELETE FROM {table}_default WHERE "date" >= :start AND "date" < :end '
+        f'RETURNING {columns}) INSERT INTO {name} ({columns}) SELECT {columns} FROM moved'),
+        {'start': start, 'end': end})
+    conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')"))
+    return name
+
+
+def ensure_partitions(conn, today, months_ahead=MONTHS_AHEAD):
+    """Create expenses' partitions from today's month to `months_ahead` months later. Does not commit."""
+    existing = {start for _, start, _ in month_partitions(conn, 'expenses')}
+    for offset in range(months_ahead + 1):
+        start = add_months(today, offset)
+        if start not in existing:
+            add_partition(conn, 'expenses', start)
+
+
+def _move_partitions(before, log):
+    # A month the archive already has a partition for (rows dated into it
+    # after it was archived) is copied over; the rest are re-attached.
+    conn = db.session.connection()
+    archived_months = {start for _, start, _ in month_partitions(conn, 'expenses_archive')}
+    columns = ', '.join(f'"{column}"' for column in COLUMNS)
+    moved = 0
+    for name, start, end in month_partitions(conn, 'expenses'):
+        if end > before:
+            continue
+        conn.execute(text(f'ALTER TABLE expenses DETACH PARTITION {name}'))
+        if start in archived_months:
+            moved += conn.execute(text(
+                f'INSERT INTO expenses_archive ({columns}) SELECT {columns} FROM {name}')).rowcount
+            conn.execute(text(f'DROP TABLE {name}'))
+        else:
+            conn.execute(text(
+                f"ALTER TABLE expenses_archive ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')"))
+            moved += conn.execute(text(f'SELECT count(*) FROM {name}')).scalar()
+        db.session.commit()
+        conn = db.session.connection()
+        log(f'Archived {start:%Y-%m} ({moved} rows so far)')
+    return moved
@@ -0,0 +1,196 @@
+import heapq
+from collections import namedtuple
+from datetime import date
+from itertools import islice
+from sqlalchemy import and_, func, or_, select
+from models import db, Category, Expense, ExpenseArchive, date_filter
+import partitions
+
+# ----------------------
+# Aggregations
+# ----------------------
+def month_key(column):
+    """SQL expression rendering a DATE column as 'YYYY-MM'."""
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return func.to_char(column, 'YYYY-MM')
+    return func.strftime('%Y-%m', column)
+
+
+SpendingSummary = namedtuple('SpendingSummary', ['category_totals', 'category_counts', 'total_spent', 'count'])
+
+
+def spending_summary(user_id, start=None, end=None):
+    """
+    Per-category totals and counts for one user over [start, end), computed
+    by a single GROUP BY so the cost follows the number of categories rather
+    than the number of expenses.
+    """
+    expenses = partitions.expense_table(user_id, start, end)
+    name = func.coalesce(Category.name, '')
+    stmt = select(
+        name,
+        func.coalesce(func.sum(expenses.c.amount), 0.0),
+        func.count(expenses.c.id),
+    ).select_from(expenses).outerjoin(Category, Category.id == expenses.c.category_id)
+    stmt = stmt.where(expenses.c.user_id == user_id)
+    if start is not None:
+        stmt = stmt.where(expenses.c.date >= start)
+    if end is not None:
+        stmt = stmt.where(expenses.c.date < end)
+    # Grouping happens on the integer id; names are only joined for display
+    rows = db.session.execute(stmt.group_by(expenses.c.category_id, Category.name).order_by(name)).all()
+
+    category_totals = {}
+    category_counts = {}
+    for category, total, count in rows:
+        category_totals[category] = float(total)
+        category_counts[category] = count
+    return SpendingSummary(
+        category_totals=category_totals,
+        category_counts=category_counts,
+        total_spent=sum(category_totals.values()),
+        count=sum(category_counts.values()),
+    )
+
+
+# ----------------------
+# Read-only Rows
+# ----------------------
+# Pages, search results and sync deltas are only read and serialised, so
+# they are selected as plain columns through Core and returned as
+# ExpenseRow tuples: no Expense instances, identity map entries, change
+# tracking or joined Category objects are built for them. Writes still go
+# through the ORM models.
+ExpenseRow = namedtuple('ExpenseRow', ['id', 'title', 'category', 'amount', 'date', 'version'])
+
+
+def expense_select(model):
+    """SELECT of ExpenseRow's columns from `model`'s table, with the category name ('' if none)."""
+    table = model.__table__
+    return (select(table.c.id, table.c.title, func.coalesce(Category.name, '').label('category'),
+                   table.c.amount, table.c.date, table.c.version)
+            .outerjoin(Category, Category.id == table.c.category_id))
+
+
+def expense_rows(stmt):
+    """Run an expense_select() statement; returns a list of ExpenseRow."""
+    return [ExpenseRow._make(row) for row in db.session.execute(stmt)]
+
+
+# ----------------------
+# Keyset Pagination
+# ----------------------
+# Expense tables are paged newest-first on (date, id). A cursor is the
+# "date:id" of the row at the edge of a page, so fetching any page is an
+# index range scan on (user_id, date) no matter how deep into the history
+# it is, unlike OFFSET which has to walk every skipped row.
+ExpensePage = namedtuple('ExpensePage', ['expenses', 'next_cursor', 'prev_cursor'])
+
+
+def encode_cursor(expense):
+    return f"{expense.date.isoformat()}:{expense.id}"
+
+
+def decode_cursor(cursor):
+    """Parse a 'YYYY-MM-DD:id' cursor; raises ValueError if malformed."""
+    day, _, row_id = (cursor or '').partition(':')
+    return date.fromisoformat(day), int(row_id)
+
+
+def page_order_key(day, row_id):
+    # Matches ORDER BY date, id (NULL dates first, as on SQLite)
+    return (day is not None, day or date.min, row_id)
+
+
+def page_order(expense):
+    """Sort key for merging pages read from expenses and expenses_archive."""
+    return page_order_key(expense.date, expense.id)
+
+
+def _page_query(model, user_id, start, end, after, before):
+    query = date_filter(expense_select(model).where(model.user_id == user_id), start, end, model)
+    if before:
+        cursor_date, cursor_id = decode_cursor(before)
+        return query.filter(or_(
+            model.date > cursor_date,
+            and_(model.date == cursor_date, model.id > cursor_id),
+        )).order_by(model.date.asc(), model.id.asc())
+    if after:
+        cursor_date, cursor_id = decode_cursor(after)
+        query = query.filter(or_(
+            model.date < cursor_date,
+            and_(model.date == cursor_date, model.id < cursor_id),
+        ))
+    return query.order_by(model.date.desc(), model.id.desc())
+
+
+def expense_page(user_id, start=None, end=None, after=None, before=None, limit=50):
+    """
+    One page of a user's expenses (as ExpenseRow), newest first. Pass the
+    previous page's `next_cursor` as `after` to move forward, or its
+    `prev_cursor` as `before` to move back.
+    """
+    # Fetch one extra row to learn whether there is anything past this page
+    rows = expense_rows(_page_query(Expense, user_id, start, end, after, before).limit(limit + 1))
+    # Archived rows are read, and merged in, only when they could be on the
+    # page: paging back, or when expenses can't fill it with newer rows
+    newest = partitions.newest_archived(user_id, start, end)
+    if newest is not None and (before or len(rows) <= limit or rows[-1].date is None or rows[-1].date <= newest):
+        rows += expense_rows(_page_query(ExpenseArchive, user_id, start, end, after, before).limit(limit + 1))
+        rows = sorted(rows, key=page_order, reverse=not before)[:limit + 1]
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before:
+        rows.reverse()
+
+    if not rows:
+        return ExpensePage([], None, None)
+    if before:
+        next_cursor = encode_cursor(rows[-1])
+        prev_cursor = encode_cursor(rows[0]) if has_more else None
+    else:
+        next_cursor = encode_cursor(rows[-1]) if has_more else None
+        prev_cursor = encode_cursor(rows[0]) if after else None
+    return ExpensePage(rows, next_cursor, prev_cursor)
+
+
+# ----------------------
+# Batched Export Reads
+# ----------------------
+def _batch_stmt(model, user_id, start, end, *extra):
+    stmt = (select(model.title, func.coalesce(Category.name, ''), model.amount, model.date, *extra)
+            .outerjoin(Category, Category.id == model.category_id)
+            .where(model.user_id == user_id))
+    if start is not None:
+        stmt = stmt.where(model.date >= start)
+    if end is not None:
+        stmt = stmt.where(model.date < end)
+    return stmt.order_by(model.date, model.id)
+
+
+def iter_expense_batches(user_id, start=None, end=None, batch_size=2000):
+    """
+    Yield lists of up to `batch_size` (title, category, amount, date) tuples
+    in date order. Results are fetched through a server-side cursor where
+    the driver supports one, so memory stays flat however many rows match.
+    """
+    models = partitions.expense_models(user_id, start, end)
+    if len(models) == 1 or partitions.archive_first(user_id, start, end):
+        # One table, or an archive that is all older: read them one after the other
+        for model in reversed(models):
+            stmt = _batch_stmt(model, user_id, start, end).execution_options(yield_per=batch_size)
+            yield from db.session.execute(stmt).partitions()
+        return
+    # Rows dated into archived months since they were compacted: merge the
+    # two ordered streams on (date, id)
+    streams = [db.session.execute(_batch_stmt(model, user_id, start, end, model.id)
+                                  .execution_options(yield_per=batch_size)) for model in models]
+    rows = (row[:4] for row in heapq.merge(*streams, key=lambda row: page_order_key(row[3], row[4])))
+    while batch := list(islice(rows, batch_size)):
+        yield batch
+
+
+def iter_expense_rows(user_id, start=None, end=None, batch_size=2000):
+    """Yield (title, category, amount, date) tuples in date order; see iter_expense_batches."""
+    for batch in iter_expense_batches(user_id, start, end, batch_size):
+        yield from batch
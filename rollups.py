@@ -0,0 +1,184 @@
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+from sqlalchemy import func, insert, select
+from models import db, Category, Goal, MonthlyRollup
+from queries import SpendingSummary, month_key
+import partitions
+
+# ----------------------
+# Monthly Rollups
+# ----------------------
+# monthly_rollups holds (user_id, month, category_id) -> total, count. Every
+# write path computes the change it makes as a dict of deltas and applies
+# it with apply_deltas() before committing, so dashboard reads can come
+# from O(categories x months) rollup rows instead of raw expenses.
+
+TOLERANCE = 0.005  # float drift allowed when verifying totals
+
+GoalProgress = namedtuple('GoalProgress', ['month', 'goal', 'spent'])
+
+
+def _key(day, category_id):
+    return (day.strftime('%Y-%m') if day else '', category_id or 0)
+
+
+def expense_deltas(rows, sign=1):
+    """Deltas for an iterable of (date, category_id, amount) tuples."""
+    deltas = defaultdict(lambda: [0.0, 0])
+    for day, category_id, amount in rows:
+        delta = deltas[_key(day, category_id)]
+        delta[0] += sign * (amount or 0.0)
+        delta[1] += sign
+    return deltas
+
+
+def frame_deltas(records):
+    """Deltas for a normalised import chunk (see importer.normalize_chunk)."""
+    deltas = defaultdict(lambda: [0.0, 0])
+    if records.empty:
+        return deltas
+    months = records['date'].map(lambda d: d.strftime('%Y-%m'))
+    category_ids = records['category_id'].fillna(0).astype(int)
+    grouped = records.groupby([months, category_ids])['amount'].agg(['sum', 'count'])
+    for (month, category_id), total, count in grouped.itertuples(name=None):
+        deltas[(month, int(category_id))] = [float(total), int(count)]
+    return deltas
+
+
+def merge_deltas(*parts):
+    merged = defaultdict(lambda: [0.0, 0])
+    for part in parts:
+        for key, (total, count) in part.items():
+            merged[key][0] += total
+            merged[key][1] += count
+    return merged
+
+
+def apply_deltas(user_id, deltas):
+    """Add deltas to the user's rollup rows inside the current transaction."""
+    rows = [
+        {'user_id': user_id, 'month': month, 'category_id': category_id, 'total': total, 'count': count}
+        for (month, category_id), (total, count) in deltas.items()
+        if count or total
+    ]
+    if not rows:
+        return
+
+    table = MonthlyRollup.__table__
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        stmt = upsert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'month', 'category_id'],
+            set_={'total': table.c.total + stmt.excluded.total,
+                  'count': table.c.count + stmt.excluded.count},
+        )
+        db.session.execute(stmt, rows)
+    else:
+        for row in rows:
+            updated = db.session.execute(
+                table.update()
+                .where(table.c.user_id == user_id, table.c.month == row['month'],
+                       table.c.category_id == row['category_id'])
+                .values(total=table.c.total + row['total'], count=table.c.count + row['count'])
+            )
+            if updated.rowcount == 0:
+                db.session.execute(insert(table), row)
+
+    db.session.execute(table.delete().where(table.c.user_id == user_id, table.c.count <= 0))
+
+
+# ----------------------
+# Reads
+# ----------------------
+def rollup_summary(user_id, month=None):
+    """Category totals for one 'YYYY-MM' month, or all months when None."""
+    name = func.coalesce(Category.name, '')
+    query = db.session.query(
+        name,
+        func.sum(MonthlyRollup.total),
+        func.sum(MonthlyRollup.count),
+    ).select_from(MonthlyRollup).outerjoin(Category, Category.id == MonthlyRollup.category_id)
+    query = query.filter(MonthlyRollup.user_id == user_id)
+    if month is not None:
+        query = query.filter(MonthlyRollup.month == month)
+    rows = query.group_by(MonthlyRollup.category_id, Category.name).order_by(name).all()
+
+    category_totals = {category: round(float(total), 2) for category, total, _ in rows}
+    category_counts = {category: int(count) for category, _, count in rows}
+    return SpendingSummary(
+        category_totals=category_totals,
+        category_counts=category_counts,
+        total_spent=round(sum(category_totals.values()), 2),
+        count=sum(category_counts.values()),
+    )
+
+
+def goal_progress(user_id, start=None, end=None):
+    """The user's monthly goals for months overlapping [start, end), each with that whole month's spend."""
+    spent = (select(func.sum(MonthlyRollup.total))
+             .where(MonthlyRollup.user_id == user_id, MonthlyRollup.month == Goal.month)
+             .scalar_subquery())
+    query = db.session.query(Goal.month, Goal.amount, func.coalesce(spent, 0.0)).filter(
+        Goal.user_id == user_id, Goal.amount > 0)
+    if start is not None:
+        query = query.filter(Goal.month >= start.strftime('%Y-%m'))
+    if end is not None:
+        query = query.filter(Goal.month <= (end - timedelta(days=1)).strftime('%Y-%m'))
+    return [GoalProgress(month, float(goal), round(float(total), 2))
+            for month, goal, total in query.order_by(Goal.month)]
+
+
+# ----------------------
+# Rebuild / Verify
+# ----------------------
+def _grouped_expenses(user_id=None):
+    # Archived months are still counted: compaction moves rows, not totals
+    expenses = partitions.expense_table(user_id)
+    month = month_key(expenses.c.date)
+    category_id = func.coalesce(expenses.c.category_id, 0)
+    stmt = select(
+        expenses.c.user_id, month.label('month'), category_id.label('category_id'),
+        func.coalesce(func.sum(expenses.c.amount), 0.0).label('total'),
+        func.count(expenses.c.id).label('count'),
+    ).where(expenses.c.date.isnot(None))
+    if user_id is not None:
+        stmt = stmt.where(expenses.c.user_id == user_id)
+    return stmt.group_by(expenses.c.user_id, month, category_id)
+
+
+def rebuild(user_id=None):
+    """Recompute rollups from raw expenses (one user, or everyone). Does not commit."""
+    table = MonthlyRollup.__table__
+    delete = table.delete()
+    if user_id is not None:
+        delete = delete.where(table.c.user_id == user_id)
+    db.session.execute(delete)
+    grouped = _grouped_expenses(user_id)
+    db.session.execute(
+        insert(table).from_select(['user_id', 'month', 'category_id', 'total', 'count'], grouped)
+    )
+
+
+def verify(user_id=None):
+    """Return a list of (user_id, month, category_id, expected, actual) mismatches."""
+    expected = {
+        (row.user_id, row.month, row.category_id): (float(row.total), row.count)
+        for row in db.session.execute(_grouped_expenses(user_id))
+    }
+    query = MonthlyRollup.query
+    if user_id is not None:
+        query = query.filter_by(user_id=user_id)
+    actual = {(r.user_id, r.month, r.category_id): (r.total, r.count) for r in query}
+
+    mismatches = []
+    for key in sorted(set(expected) | set(actual), key=str):
+        want = expected.get(key, (0.0, 0))
+        got = actual.get(key, (0.0, 0))
+        if want[1] != got[1] or abs(want[0] - got[0]) > TOLERANCE:
+            mismatches.append((*key, want, got))
+    return mismatches
@@ -0,0 +1,300 @@
+import re
+from sqlalchemy import and_, column, func, literal, literal_column, or_, select, table, text
+from models import db, Category, date_filter
+from queries import ExpensePage, encode_cursor, decode_cursor, expense_rows, expense_select, page_order
+import categories
+import partitions
+
+# ----------------------
+# Expense Search
+# ----------------------
+# Word-prefix and fuzzy search over expense titles and categories.
+#
+#   PostgreSQL  a pg_trgm GIN index on (user_id, lower(title)) of expenses and
+#               of expenses_archive. A prefix match is a regex on a word
+#               boundary and a fuzzy match is word_similarity (<%). The
+#               trigram index serves both; category names are matched in the
+#               (small) categories table and joined back by id.
+#   SQLite      an FTS5 table over expenses, archived ones included, and their
+#               category names, kept in step by triggers. A prefix match is
+#               an FTS prefix query. A fuzzy match adds nearby spellings
+#               taken from the FTS vocabulary.
+#
+# `flask init-db` installs the index. Results come back newest first and
+# use the same (date, id) cursors as the expense table.
+
+MAX_TERMS = 8
+FUZZY_MIN_LENGTH = 4  # shorter terms match too much when misspelt
+FUZZY_CANDIDATES = 5000  # vocabulary rows scanned per fuzzy term on SQLite
+FUZZY_EXPANSIONS = 10  # nearby spellings OR'ed into the query per term
+# SQLite: up to this many matches are fetched by rowid and sorted; beyond
+# it the (user_id, date) index is walked newest first until a page is full
+DIRECT_LOOKUP_LIMIT = 2000
+
+SEARCH_TEXT = "lower(coalesce({table}.title, ''))"
+TABLES = ('expenses', 'expenses_archive')  # see partitions.py
+
+# The FTS table indexes an "owner" token (u<user_id>) next to the text, so
+# MATCH itself narrows to one user's rows. Its content comes from a view
+# that adds that column, which keeps 'rebuild' working.
+CATEGORY_NAME = "coalesce((SELECT name FROM categories WHERE id = {row}.category_id), '')"
+
+
+def _sqlite_triggers(table, other):
+    # Both tables feed the same index under the expense id. A row moving
+    # between them (partitions.py inserts the copy, then deletes the
+    # original) is already indexed, so the triggers skip it.
+    moving_in = f'WHEN NOT EXISTS (SELECT 1 FROM {other} WHERE id = new.id)'
+    moving_out = f'WHEN NOT EXISTS (SELECT 1 FROM {other} WHERE id = old.id)'
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_fts_ai AFTER INSERT ON {table} {moving_in} BEGIN
+            INSERT INTO expenses_fts(rowid, title, category, owner)
+            VALUES (new.id, new.title, {CATEGORY_NAME.format(row='new')}, 'u' || new.user_id);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_fts_ad AFTER DELETE ON {table} {moving_out} BEGIN
+            INSERT INTO expenses_fts(expenses_fts, rowid, title, category, owner)
+            VALUES ('delete', old.id, old.title, {CATEGORY_NAME.format(row='old')}, 'u' || old.user_id);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_fts_au AFTER UPDATE OF title, category_id, user_id ON {table} BEGIN
+            INSERT INTO expenses_fts(expenses_fts, rowid, title, category, owner)
+            VALUES ('delete', old.id, old.title, {CATEGORY_NAME.format(row='old')}, 'u' || old.user_id);
+            INSERT INTO expenses_fts(rowid, title, category, owner)
+            VALUES (new.id, new.title, {CATEGORY_NAME.format(row='new')}, 'u' || new.user_id);
+        END""",
+    ]
+
+
+SQLITE_DDL = [
+    """CREATE VIEW IF NOT EXISTS expenses_search_source AS
+        SELECT e.id, e.title, coalesce(c.name, '') AS category, 'u' || e.user_id AS owner
+        FROM expenses e LEFT JOIN categories c ON c.id = e.category_id
+        UNION ALL
+        SELECT a.id, a.title, coalesce(c.name, '') AS category, 'u' || a.user_id AS owner
+        FROM expenses_archive a LEFT JOIN categories c ON c.id = a.category_id""",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS expenses_fts USING fts5(
+        title, category, owner, content='expenses_search_source', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS expenses_fts_vocab USING fts5vocab(expenses_fts, 'col')",
+    *_sqlite_triggers('expenses', 'expenses_archive'),
+    *_sqlite_triggers('expenses_archive', 'expenses'),
+]
+SQLITE_TRIGGERS = [f'{table}_fts_{event}' for table in TABLES for event in ('ai', 'ad', 'au')]
+
+POSTGRES_DDL = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    # Lets the GIN index also carry user_id, so one index scan serves "this user's matches"
+    'CREATE EXTENSION IF NOT EXISTS btree_gin',
+    *[f'CREATE INDEX IF NOT EXISTS ix_{table}_search_trgm ON {table} '
+      f'USING gin (user_id, ({SEARCH_TEXT.format(table=table)}) gin_trgm_ops)' for table in TABLES],
+]
+
+fts = table('expenses_fts', column('rowid'))
+
+
+class SearchUnavailable(RuntimeError):
+    pass
+
+
+def _dialect():
+    return db.session.get_bind().dialect.name
+
+
+def install(log=None):
+    """Create the search index for the current backend if missing. Does not commit."""
+    dialect = _dialect()
+    if dialect == 'sqlite':
+        conn = db.session.connection()
+        created = not conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE name = 'expenses_fts'").first()
+        # The view and triggers are cheap to replace, which picks up changes to them
+        _drop_sources(conn)
+        for statement in SQLITE_DDL:
+            conn.exec_driver_sql(statement)
+        if created:
+            # Index the rows that existed before the triggers did
+            conn.exec_driver_sql("INSERT INTO expenses_fts(expenses_fts) VALUES ('rebuild')")
+            if log:
+                log('Built the expense search index')
+    elif dialect == 'postgresql':
+        for statement in POSTGRES_DDL:
+            db.session.execute(text(statement))
+    elif log:
+        log(f'No search index for {dialect}; search is unavailable')
+
+
+def _drop_sources(conn):
+    for name in SQLITE_TRIGGERS:
+        conn.exec_driver_sql(f'DROP TRIGGER IF EXISTS {name}')
+    conn.exec_driver_sql('DROP VIEW IF EXISTS expenses_search_source')
+
+
+def drop(conn):
+    """Remove the search index and its triggers; install() recreates them."""
+    if conn.dialect.name != 'sqlite':
+        for table in TABLES:
+            conn.exec_driver_sql(f'DROP INDEX IF EXISTS ix_{table}_search_trgm')
+        return
+    _drop_sources(conn)
+    conn.exec_driver_sql('DROP TABLE IF EXISTS expenses_fts_vocab')
+    conn.exec_driver_sql('DROP TABLE IF EXISTS expenses_fts')
+
+
+def rebuild():
+    """Re-index every expense from scratch (SQLite). Does not commit."""
+    if _dialect() == 'sqlite':
+        db.session.execute(text("INSERT INTO expenses_fts(expenses_fts) VALUES ('rebuild')"))
+    else:
+        for table in TABLES:
+            db.session.execute(text(f'REINDEX INDEX ix_{table}_search_trgm'))
+
+
+def _installed():
+    if _dialect() == 'sqlite':
+        sql = "SELECT 1 FROM sqlite_master WHERE name = 'expenses_fts'"
+    elif _dialect() == 'postgresql':
+        sql = "SELECT 1 FROM pg_indexes WHERE indexname = 'ix_expenses_search_trgm'"
+    else:
+        return False
+    return db.session.execute(text(sql)).first() is not None
+
+
+# ----------------------
+# Query Building
+# ----------------------
+def parse_terms(query):
+    """Lower-cased word terms of a search box string, de-duplicated, at most MAX_TERMS."""
+    terms = []
+    for term in re.findall(r'\w+', (query or '').lower()):
+        if term not in terms:
+            terms.append(term)
+    return terms[:MAX_TERMS]
+
+
+def edit_distance(a, b, limit):
+    """
+    Optimal string alignment distance between a and b (Levenshtein, with a
+    swap of adjacent letters counted as one edit), or limit + 1 once it is
+    known to exceed limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before, previous = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+def _max_distance(term):
+    return 1 if len(term) <= 5 else 2
+
+
+def _near_terms(term):
+    """Indexed words within a small edit distance of `term` (SQLite vocabulary)."""
+    limit = _max_distance(term)
+    rows = db.session.execute(text(
+        "SELECT DISTINCT term FROM expenses_fts_vocab WHERE term >= :lo AND term < :hi "
+        "AND col IN ('title', 'category') AND length(term) BETWEEN :shortest AND :longest LIMIT :cap"
+    ), {'lo': term[0], 'hi': term[0] + '\U0010ffff', 'shortest': len(term) - limit,
+        'longest': len(term) + limit, 'cap': FUZZY_CANDIDATES})
+    near = []
+    for (word,) in rows:
+        distance = edit_distance(term, word, limit)
+        if word != term and distance <= limit:
+            near.append((distance, word))
+    return [word for _, word in sorted(near)[:FUZZY_EXPANSIONS]]
+
+
+def fts_query(terms, fuzzy=False):
+    """FTS5 MATCH expression: every term as a prefix, plus near spellings when fuzzy."""
+    parts = []
+    for term in terms:
+        options = [f'"{term}"*']
+        if fuzzy and len(term) >= FUZZY_MIN_LENGTH:
+            options += [f'"{word}"' for word in _near_terms(term)]
+        parts.append('{title category}: ' + (options[0] if len(options) == 1 else '(' + ' OR '.join(options) + ')'))
+    return ' AND '.join(parts)
+
+
+def _postgres_filter(model, user_id, terms, fuzzy=False):
+    search_text = literal_column(SEARCH_TEXT.format(table=model.__tablename__))
+    category_name = func.lower(Category.name)
+    clauses = []
+    for term in terms:
+        # \m anchors at the start of a word; terms are \w+ so need no escaping
+        match = search_text.op('~')(r'\m' + term)
+        category_match = category_name.op('~')(r'\m' + term)
+        if fuzzy and len(term) >= FUZZY_MIN_LENGTH:
+            match = or_(match, literal(term).op('<%')(search_text))
+            category_match = or_(category_match, literal(term).op('<%')(category_name))
+        # Not correlated with the categories join of expense_select()
+        named = select(Category.id).where(Category.user_id == user_id, category_match).correlate(None)
+        clauses.append(or_(match, model.category_id.in_(named)))
+    return and_(*clauses)
+
+
+def _sqlite_matches(models, user_id, terms, fuzzy):
+    # Without ANALYZE statistics SQLite assumes user_id = ? is selective and
+    # always walks the (user_id, date) index, which reads every row of a big
+    # user when the term is rare. Pick the plan from the match count instead.
+    # The index covers archived rows too, so one lookup serves every model.
+    terms_match = fts_query(terms, fuzzy)
+    owned = select(fts.c.rowid).where(text('expenses_fts MATCH :match')).params(
+        match=f'owner:"u{int(user_id)}" AND {terms_match}')
+    ids = db.session.execute(owned.limit(DIRECT_LOOKUP_LIMIT + 1)).scalars().all()
+    if len(ids) <= DIRECT_LOOKUP_LIMIT:
+        # Few matches: fetch them by rowid and sort. "+ 0" keeps SQLite off the user_id index.
+        return [expense_select(model).where(model.id.in_(ids), (model.user_id + 0) == user_id) for model in models]
+    # Many matches: walk the user's rows newest first; a page fills quickly.
+    # The owner filter is left out here since the index already applies it
+    # and intersecting with a big user's token list costs more than it saves.
+    matched = select(fts.c.rowid).where(text('expenses_fts MATCH :match')).params(match=terms_match)
+    return [expense_select(model).where(model.user_id == user_id, model.id.in_(matched)) for model in models]
+
+
+def search_expenses(user_id, query, start=None, end=None, category=None, after=None, limit=50, fuzzy=False):
+    """
+    One page of the user's expenses matching every word of `query`, newest
+    first. Pass the previous page's `next_cursor` as `after` for the next page.
+    """
+    terms = parse_terms(query)
+    if not terms:
+        return ExpensePage([], None, None)
+    if not _installed():
+        raise SearchUnavailable('Search index is not installed; run `flask --app app init-db`')
+    category_id = None
+    if category:
+        category_id = categories.resolve_one(user_id, category, create=False)
+        if category_id is None:
+            return ExpensePage([], None, None)
+
+    models = partitions.expense_models(user_id, start, end)
+    if _dialect() == 'sqlite':
+        queries = _sqlite_matches(models, user_id, terms, fuzzy)
+    else:
+        queries = [expense_select(model).where(model.user_id == user_id, _postgres_filter(model, user_id, terms, fuzzy))
+                   for model in models]
+
+    rows = []
+    for model, q in zip(models, queries):
+        q = date_filter(q, start, end, model)
+        if category_id is not None:
+            q = q.filter(model.category_id == category_id)
+        if after:
+            cursor_date, cursor_id = decode_cursor(after)
+            q = q.filter(or_(
+                model.date < cursor_date,
+                and_(model.date == cursor_date, model.id < cursor_id),
+            ))
+        rows += expense_rows(q.order_by(model.date.desc(), model.id.desc()).limit(limit + 1))
+    if len(models) > 1:
+        rows = sorted(rows, key=page_order, reverse=True)[:limit + 1]
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return ExpensePage(rows[:limit], next_cursor, None)
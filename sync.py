@@ -0,0 +1,158 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import event, func, insert, select, update
+from sqlalchemy.orm import Session
+from models import db, User, ExpenseTombstone
+from queries import ExpenseRow, expense_select
+import partitions
+
+# ----------------------
+# Data Versions
+# ----------------------
+# Every user has a data version (users.data_version) that each expense or
+# goal write bumps inside its own transaction. Expense rows are stamped
+# with the version of their last insert/update and deletes leave a
+# tombstone carrying it, so "what changed since version N" is an index
+# range scan on (user_id, version) in both tables.
+#
+# The bump is an UPDATE of the user's row, which serialises concurrent
+# writers for that user: versions commit in the order they were handed out.
+# One transaction gets one version however many times it asks.
+
+SyncPage = namedtuple('SyncPage', ['version', 'changes', 'deleted', 'next_cursor', 'has_more'])
+
+
+class SyncReset(ValueError):
+    """The cursor is older than the pruned tombstones; the client must resync from scratch."""
+
+
+def _bumped(session=None):
+    return (session or db.session).info.setdefault('data_versions', {})
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def _forget_versions(session):
+    session.info.pop('data_versions', None)
+
+
+def bump(user_id):
+    """The user's new data version for the current transaction. Does not commit."""
+    bumped = _bumped()
+    if user_id in bumped:
+        return bumped[user_id]
+    table = User.__table__
+    stmt = (update(table).where(table.c.id == user_id)
+            .values(data_version=table.c.data_version + 1, data_changed_at=datetime.utcnow()))
+    if db.session.get_bind().dialect.update_returning:
+        version = db.session.execute(stmt.returning(table.c.data_version)).scalar_one()
+    else:
+        db.session.execute(stmt)
+        version = db.session.execute(select(table.c.data_version).where(table.c.id == user_id)).scalar_one()
+    bumped[user_id] = version
+    return version
+
+
+def current(user_id):
+    """(data_version, data_changed_at) for the user."""
+    table = User.__table__
+    row = db.session.execute(
+        select(table.c.data_version, table.c.data_changed_at).where(table.c.id == user_id)).first()
+    return (row.data_version, row.data_changed_at) if row else (0, None)
+
+
+def record_deletes(user_id, expense_ids):
+    """Bump the version and leave a tombstone for each deleted expense. Does not commit."""
+    expense_ids = list(expense_ids)
+    version = bump(user_id)
+    if expense_ids:
+        now = datetime.utcnow()
+        db.session.execute(insert(ExpenseTombstone.__table__), [
+            {'user_id': user_id, 'expense_id': expense_id, 'version': version, 'deleted_at': now}
+            for expense_id in expense_ids
+        ])
+    return version
+
+
+# ----------------------
+# Changes Since a Cursor
+# ----------------------
+# A sync cursor is "version:id" of the last change a client has applied.
+# Changes come back in (version, id) order with upserts and deletes merged,
+# so one write (an import, say) can span several pages.
+
+def encode_cursor(version, item_id):
+    return f"{version}:{item_id}"
+
+
+def decode_cursor(cursor):
+    """Parse a 'version:id' cursor (empty means from the beginning); raises ValueError if malformed."""
+    if not cursor:
+        return 0, 0
+    version, _, item_id = cursor.partition(':')
+    return int(version), int(item_id or 0)
+
+
+def _page(stmt, version_col, id_col, version, item_id, limit):
+    """
+    Up to `limit` rows of `stmt` after (version, item_id) in (version, id)
+    order. Done as two index seeks, the rest of the cursor's version and then
+    later versions, because an OR of the two (or a row-value comparison)
+    only seeks on version and then scans, which is slow when one import put
+    a million rows in the same version.
+    """
+    rows = db.session.execute(stmt.where(version_col == version, id_col > item_id)
+                              .order_by(id_col).limit(limit)).all()
+    if len(rows) < limit:
+        rows += db.session.execute(stmt.where(version_col > version)
+                                   .order_by(version_col, id_col).limit(limit - len(rows))).all()
+    return rows
+
+
+def changes_since(user_id, cursor=None, limit=500):
+    """
+    One page of the user's expense changes after `cursor`: expenses inserted
+    or updated (as ExpenseRow) and deleted (as (expense_id, version)).
+    Raises SyncReset if deletes the client needs have been pruned.
+    """
+    version, item_id = decode_cursor(cursor)
+    user = db.session.get(User, user_id)
+    if cursor and user.sync_floor and version <= user.sync_floor:
+        raise SyncReset(f'Cursor is older than version {user.sync_floor}; sync again from the start')
+
+    changed = []
+    for model in partitions.expense_models(user_id):
+        changed += map(ExpenseRow._make, _page(expense_select(model).where(model.user_id == user_id),
+                                               model.version, model.id, version, item_id, limit + 1))
+    deleted = _page(select(ExpenseTombstone.expense_id, ExpenseTombstone.version)
+                    .where(ExpenseTombstone.user_id == user_id),
+                    ExpenseTombstone.version, ExpenseTombstone.expense_id, version, item_id, limit + 1)
+
+    # Merge the two ordered streams and keep the first `limit` changes
+    merged = sorted([(e.version, e.id, e) for e in changed] + [(v, i, None) for i, v in deleted],
+                    key=lambda change: change[:2])
+    has_more = len(merged) > limit
+    merged = merged[:limit]
+    next_cursor = encode_cursor(*merged[-1][:2]) if merged else cursor
+    return SyncPage(
+        version=user.data_version,
+        changes=[e for _, _, e in merged if e is not None],
+        deleted=[(i, v) for v, i, e in merged if e is None],
+        next_cursor=next_cursor,
+        has_more=has_more,
+    )
+
+
+def prune_tombstones(older_than_days=90):
+    """Drop tombstones older than the cutoff and raise each user's sync floor. Does not commit."""
+    table = ExpenseTombstone.__table__
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    floors = db.session.execute(
+        select(table.c.user_id, func.max(table.c.version)).where(table.c.deleted_at < cutoff)
+        .group_by(table.c.user_id)
+    ).all()
+    users = User.__table__
+    for user_id, floor in floors:
+        db.session.execute(update(users).where(users.c.id == user_id, users.c.sync_floor < floor)
+                           .values(sync_floor=floor))
+    return db.session.execute(table.delete().where(table.c.deleted_at < cutoff)).rowcount
@@ -0,0 +1,5 @@
+# gunicorn entry point: gunicorn wsgi:app
+# Run `flask --app app init-db` once before the first start.
+from app import create_app
+
+app = create_app()